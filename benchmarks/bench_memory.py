@@ -0,0 +1,104 @@
+"""Memory held for the songs of a large playlist, measured with tracemalloc.
+
+A synthetic playlist (20k tracks by default) is served by ``fakes.FakeYTMusic``
+as freshly parsed JSON, like a real ``get_playlist`` response with thumbnails,
+albums and feedback tokens.
+
+- ``legacy``: what ``YoutubeMusic`` held before, the whole response plus a
+  list of ``Song`` dataclasses without slots
+- ``store``: ``get_songs_from_playlist``, a ``SongStore`` with the response let go
+- ``stream``: ``iter_songs_from_playlist`` as a transfer uses it, nothing kept
+
+``retained`` is what is still allocated afterwards, ``peak`` the most at any
+time, both over what was allocated before the scenario. The peak is reached
+while the response is parsed, so it is about the same in every scenario.
+
+    python benchmarks/bench_memory.py --size 20000 --output bench_memory.json
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fakes import FakeYTMusic, synthetic_tracks  # noqa: E402
+from ytm2spt import youtube  # noqa: E402
+from ytm2spt.normalize import clean_artist, clean_title  # noqa: E402
+
+
+@dataclass
+class LegacySong:
+    artist: str
+    title: str
+    duration: int = None
+
+
+def legacy(yt: youtube.YoutubeMusic):
+    playlist = yt.ytmusic.get_playlist("PLbenchmark", limit=None)
+    songs = [LegacySong(clean_artist(track["artists"][0]["name"]), clean_title(track["title"]),
+                        track.get("duration_seconds")) for track in playlist["tracks"]]
+    return playlist, songs
+
+
+def store(yt: youtube.YoutubeMusic):
+    yt.set_playlist_id("PLbenchmark")
+    yt.get_songs_from_playlist()
+    return yt
+
+
+def stream(yt: youtube.YoutubeMusic):
+    yt.set_playlist_id("PLbenchmark")
+    for _ in yt.iter_songs_from_playlist():
+        pass
+    return yt
+
+
+SCENARIOS = {"legacy": legacy, "store": store, "stream": stream}
+
+
+def measure(scenario, size: int) -> dict:
+    yt = youtube.YoutubeMusic()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = scenario(yt)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return {
+        "retained_mb": round((retained - before) / 2 ** 20, 2),
+        "peak_mb": round((peak - before) / 2 ** 20, 2),
+        "retained_bytes_per_song": round((retained - before) / size),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20_000, help="Tracks in the synthetic playlist")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--output", default="bench_memory.json")
+    args = parser.parse_args()
+
+    FakeYTMusic.tracks = synthetic_tracks(args.size)
+    FakeYTMusic.parsed = True
+    youtube.YTMusic = FakeYTMusic
+
+    results = {}
+    for name in args.scenarios:
+        results[name] = measure(SCENARIOS[name], args.size)
+        print(f"{name:8} retained {results[name]['retained_mb']:8.2f} MB "
+              f"({results[name]['retained_bytes_per_song']:5} bytes/song)  peak {results[name]['peak_mb']:8.2f} MB")
+
+    report = {"python": sys.version.split()[0], "size": args.size, "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
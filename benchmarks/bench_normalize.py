@@ -0,0 +1,82 @@
+"""Micro-benchmark of song title/artist normalization.
+
+Compares the original seven-``re.sub`` ``clean_song_info`` with the compiled
+single-pass rules in ``ytm2spt.normalize`` over a synthetic corpus.
+
+    python benchmarks/bench_normalize.py [--size 100000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from ytm2spt.normalize import clean_artist, clean_title, normalized_key  # noqa: E402
+
+
+WORDS = ["love", "night", "Café", "señorita", "dancing", "über", "heart", "fire", "Beyoncé",
+         "golden", "summer", "rain", "Mötley", "crüe", "déjà", "vu", "city", "lights", "road"]
+TITLE_SUFFIXES = ["", "", " (Official Video)", " (feat. {artist})", " ft. {artist}",
+                  " [Remastered 2011]", ", Pt. 2", " (Live)"]
+ARTIST_SUFFIXES = ["", "", " x {artist}", " (UK)", " ft. {artist}", ", {artist}", " feat. {artist}"]
+
+
+def legacy_clean_song_info(artist: str, title: str) -> tuple:
+    title = re.sub(r'\(.*', '', title)
+    title = re.sub(r'ft.*', '', title)
+    title = re.sub(r',.*', '', title)
+    artist = re.sub(r'\sx\s.*', '', artist)
+    artist = re.sub(r'\(.*', '', artist)
+    artist = re.sub(r'ft.*', '', artist)
+    artist = re.sub(r',.*', '', artist)
+    return artist.strip(), title.strip()
+
+
+def make_corpus(size: int, seed: int = 303) -> list:
+    rng = random.Random(seed)
+
+    def phrase(n):
+        return " ".join(rng.choice(WORDS) for _ in range(n)).title()
+
+    corpus = []
+    for _ in range(size):
+        other = phrase(2)
+        artist = phrase(rng.randint(1, 3)) + rng.choice(ARTIST_SUFFIXES).format(artist=other)
+        title = phrase(rng.randint(1, 5)) + rng.choice(TITLE_SUFFIXES).format(artist=other)
+        corpus.append((artist, title))
+    return corpus
+
+
+def bench(func, corpus: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for artist, title in corpus:
+            func(artist, title)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100_000, help="Number of (artist, title) pairs")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per implementation, best is reported")
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.size)
+    results = {
+        "legacy clean_song_info": bench(legacy_clean_song_info, corpus, args.repeat),
+        "clean_artist + clean_title": bench(lambda a, t: (clean_artist(a), clean_title(t)), corpus, args.repeat),
+        "normalized_key": bench(normalized_key, corpus, args.repeat),
+    }
+    baseline = results["legacy clean_song_info"]
+    for name, seconds in results.items():
+        print(f"{name:<28} {seconds * 1000:9.1f} ms  {args.size / seconds:12,.0f} songs/s  "
+              f"{baseline / seconds:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Sharded transfer (``ytm2spt shard``) against a single process transfer.
+
+Runs the real coordinator, SQLite job queue and spawned worker processes on
+this machine, against ``fakes.FakeSpotifyServer`` and ``fakes.FakeYTMusic``.
+Each scenario writes a new playlist, and the playlist is checked to be
+identical to the one written by the single process transfer.
+
+Every worker searches as its own Spotify app (``--apps``, one per worker by
+default). With ``--server-rps`` the fake Spotify limits each app's requests
+per second, so the run shows what separate credentials add.
+
+    python benchmarks/bench_shard.py --size 1500 --workers 1 2 4 --jobs 8 \\
+        --latency-ms 2 --server-rps 40 --output bench_shard.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "src"))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+# URL of the fake Spotify, passed to the worker processes
+SERVER_ENV = "YTM2SPT_BENCH_SERVER"
+
+
+def patch_clients(server_url: str):
+    # Requests go to the fake Spotify and carry the app's client ID, the fake limits every app on its own
+    import spotipy
+    from fakes import FakeYTMusic
+    from ytm2spt import spotify, youtube
+
+    class LocalSpotify(spotipy.Spotify):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prefix = f"{server_url}/v1/"
+            self.client_id = os.environ["SPOTIFY_CLIENT_ID"]
+
+        def _auth_headers(self):
+            return {"Authorization": f"Bearer {self.client_id}"}
+
+    spotify.spotipy.Spotify = LocalSpotify
+    spotify.SpotifyOAuth = lambda **kwargs: None
+    spotify.SpotifyClientCredentials = lambda **kwargs: None
+    youtube.YTMusic = FakeYTMusic
+
+
+def bench_worker(*args):
+    from ytm2spt import shard
+    patch_clients(os.environ[SERVER_ENV])
+    shard._local_worker(*args)
+
+
+def playlist_uris(server, name: str) -> list:
+    for playlist in server.playlists.values():
+        if playlist.get("name") == name:
+            return playlist["items"]
+    return []
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=5000, help="Tracks in the synthetic playlist")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--jobs", type=int, default=4, help="Parallel searches per worker (and of the single process)")
+    parser.add_argument("--chunk-size", type=int, default=200)
+    parser.add_argument("--apps", type=int, default=0, help="Spotify apps shared by the workers (Default: one each)")
+    parser.add_argument("--latency-ms", type=float, default=10.0, help="Latency of every fake Spotify request")
+    parser.add_argument("--server-rps", type=float, default=0.0,
+                        help="Requests per second the fake Spotify allows each app (0 is unlimited)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of the fake Spotify's 429s")
+    parser.add_argument("--verbose", action="store_true", help="Show the transfer log")
+    parser.add_argument("--output", default="bench_shard.json")
+    args = parser.parse_args()
+
+    from fakes import FakeSpotifyServer, FakeYTMusic, synthetic_tracks
+    from ytm2spt import shard, transfer
+
+    output = os.path.abspath(args.output)
+    os.chdir(tempfile.mkdtemp(prefix="ytm2spt-bench-"))
+    os.environ.update({
+        "SPOTIFY_USER_ID": "benchmark",
+        "SPOTIFY_CLIENT_ID": "coordinator",
+        "SPOTIFY_CLIENT_SECRET": "benchmark",
+        "SPOTIFY_REDIRECT_URI": "http://127.0.0.1/callback",
+    })
+    if not args.verbose:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 2)
+    FakeYTMusic.tracks = synthetic_tracks(args.size)
+
+    results = {}
+    with FakeSpotifyServer(latency=args.latency_ms / 1000, max_rps=args.server_rps,
+                           retry_after=args.retry_after) as server:
+        os.environ[SERVER_ENV] = server.url
+        FakeYTMusic.thumbnail_url = f"{server.url}/thumbnail.jpg"
+        patch_clients(server.url)
+
+        start = time.perf_counter()
+        transfer.transfer_playlist("PLbenchmark", None, "single", None, False, False, None, jobs=args.jobs,
+                                   use_cache=False)
+        seconds = time.perf_counter() - start
+        expected = playlist_uris(server, "single")
+        results["single"] = {"seconds": round(seconds, 3), "songs_per_second": round(args.size / seconds, 1),
+                             "throttled": server.calls["429"]}
+        print(f"single    {seconds:8.2f} s  {args.size / seconds:9.1f} songs/s  {server.calls['429']:6} 429s")
+
+        for workers in args.workers:
+            apps = [{"SPOTIFY_CLIENT_ID": f"app-{i + 1}", "SPOTIFY_CLIENT_SECRET": "benchmark"}
+                    for i in range(args.apps or workers)]
+            throttled = server.calls["429"]
+            name = f"{workers} workers"
+            start = time.perf_counter()
+            shard.run_sharded("PLbenchmark", spotify_playlist_name=name, workers=workers,
+                              chunk_size=args.chunk_size, jobs=args.jobs, use_cache=False, credentials=apps,
+                              worker_target=bench_worker, reset=True)
+            seconds = time.perf_counter() - start
+            identical = playlist_uris(server, name) == expected
+            throttled = server.calls["429"] - throttled
+            results[name] = {"workers": workers, "apps": len(apps), "seconds": round(seconds, 3),
+                             "songs_per_second": round(args.size / seconds, 1), "throttled": throttled,
+                             "identical": identical}
+            print(f"{name:9} {seconds:8.2f} s  {args.size / seconds:9.1f} songs/s  {throttled:6} 429s  "
+                  f"{'identical' if identical else 'DIFFERENT'} playlist")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "options": vars(args),
+        "results": results,
+    }
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Startup time of ytm2spt, checked against per-scenario budgets.
+
+Every scenario runs in a fresh interpreter with ``-X importtime``; the import
+time reported is the total over the interpreter's own startup (``python -c
+pass``), so it is what ytm2spt and its dependencies add. It also lists the
+heavy dependencies each scenario imported (or tried to), ``--help`` should
+import none of them.
+
+- ``help``: ``ytm2spt --help``
+- ``dryrun``: ``ytm2spt -yt ... -d -l 10`` against ``fakes.FakeSpotifyServer``
+  and ``fakes.FakeYTMusic`` (their own imports are small and counted too)
+- ``gui``: creates and shows the main window offscreen, skipped without PySide6
+
+With ``--binary`` the Nuitka build is timed as well. Compiled modules don't
+report import times, so its wall time of ``--help`` is used instead.
+
+    python benchmarks/bench_startup.py --repeat 7 --binary ./ytm2spt.bin \\
+        --budget dryrun=800 --output bench_startup.json
+
+Exits with 1 if a scenario is over its budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCHMARKS_DIR, "..", "src")
+
+# Milliseconds of import time (wall time for the binary) a scenario may take
+BUDGETS_MS = {
+    "help": 60,
+    "dryrun": 700,
+    "gui": 400,
+    "binary_help": 500,
+}
+HEAVY_MODULES = ("spotipy", "ytmusicapi", "requests", "rapidfuzz", "PySide6", "PIL", "sqlite3")
+
+SCENARIOS = {
+    "help": "import sys; sys.argv = ['ytm2spt', '--help']\n"
+            "from ytm2spt import main\n"
+            "try:\n    main()\nexcept SystemExit:\n    pass",
+    "dryrun": "import bench_startup; bench_startup.dryrun()",
+    "gui": "import bench_startup; bench_startup.show_gui()",
+}
+
+
+def dryrun():
+    from fakes import FakeSpotifyServer, FakeYTMusic, synthetic_tracks
+    from ytm2spt import cli, spotify, youtube
+
+    os.chdir(tempfile.mkdtemp(prefix="ytm2spt-bench-"))
+    os.environ.update({
+        "SPOTIFY_USER_ID": "benchmark",
+        "SPOTIFY_CLIENT_ID": "benchmark",
+        "SPOTIFY_CLIENT_SECRET": "benchmark",
+        "SPOTIFY_REDIRECT_URI": "http://127.0.0.1/callback",
+    })
+    with FakeSpotifyServer() as server:
+        class LocalSpotify(spotify.spotipy.Spotify):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prefix = f"{server.url}/v1/"
+
+        spotify.spotipy.Spotify = LocalSpotify
+        spotify.SpotifyOAuth = lambda **kwargs: None
+        FakeYTMusic.tracks = synthetic_tracks(10)
+        FakeYTMusic.thumbnail_url = f"{server.url}/thumbnail.jpg"
+        youtube.YTMusic = FakeYTMusic
+        sys.argv = ["ytm2spt", "-yt", "PLbenchmark", "-d", "-l", "10", "--no-cache"]
+        cli.main()
+
+
+def show_gui():
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PySide6.QtWidgets import QApplication
+    from ytm2spt import gui
+
+    app = QApplication([])
+    window = gui.MainWindow()
+    window.show()
+    app.processEvents()
+
+
+def parse_importtime(stderr: str) -> tuple:
+    # Total of the top level imports in microseconds, and every module imported
+    total = 0
+    modules = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules.add(name.strip())
+        if not name.startswith("  "):
+            total += int(cumulative)
+    return total, modules
+
+
+def run_python(code: str) -> tuple:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([SRC_DIR, BENCHMARKS_DIR]))
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    wall = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.splitlines()[-1] if process.stderr else f"exit {process.returncode}")
+    total, modules = parse_importtime(process.stderr)
+    return total, modules, wall
+
+
+def bench_python(name: str, repeat: int, baseline_us: float) -> dict:
+    import_times = []
+    walls = []
+    for _ in range(repeat):
+        total, modules, wall = run_python(SCENARIOS[name])
+        import_times.append(total)
+        walls.append(wall)
+    heavy = sorted(module for module in HEAVY_MODULES if module in modules)
+    return {
+        "import_ms": round((statistics.median(import_times) - baseline_us) / 1000, 1),
+        "wall_ms": round(statistics.median(walls) * 1000, 1),
+        "modules": len(modules),
+        "heavy_modules": heavy,
+    }
+
+
+def bench_binary(binary: str, repeat: int) -> dict:
+    walls = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([binary, "--help"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        walls.append(time.perf_counter() - start)
+    return {"wall_ms": round(statistics.median(walls) * 1000, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per scenario, the median is reported")
+    parser.add_argument("--binary", default=None, help="Nuitka build of ytm2spt.py to time as well")
+    parser.add_argument("--budget", action="append", default=[], metavar="SCENARIO=MS",
+                        help="Override the budget of a scenario")
+    parser.add_argument("--output", default="bench_startup.json")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS_MS)
+    for budget in args.budget:
+        name, _, ms = budget.partition("=")
+        budgets[name] = float(ms)
+
+    baseline_us = statistics.median(run_python("pass")[0] for _ in range(args.repeat))
+    results = {}
+    for name in args.scenarios:
+        if name == "gui":
+            try:
+                import PySide6  # noqa: F401
+            except ImportError:
+                print("gui: skipped, PySide6 is not installed")
+                continue
+        results[name] = bench_python(name, args.repeat, baseline_us)
+        results[name]["measured_ms"] = results[name]["import_ms"]
+    if args.binary:
+        results["binary_help"] = bench_binary(args.binary, args.repeat)
+        results["binary_help"]["measured_ms"] = results["binary_help"]["wall_ms"]
+
+    over_budget = []
+    for name, result in results.items():
+        result["budget_ms"] = budgets.get(name)
+        within = result["budget_ms"] is None or result["measured_ms"] <= result["budget_ms"]
+        if not within:
+            over_budget.append(name)
+        print(f"{name:12} {result['measured_ms']:8.1f} ms (budget {result['budget_ms']} ms) "
+              f"{'ok' if within else 'OVER BUDGET'}  heavy: {', '.join(result.get('heavy_modules', [])) or '-'}")
+
+    report = {"python": sys.version.split()[0], "baseline_ms": round(baseline_us / 1000, 1), "results": results}
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Offline end-to-end benchmark of ``transfer_playlist``.
+
+Every scenario runs the real ``ytm2spt.transfer`` code in a fresh process
+against ``fakes.FakeSpotifyServer`` (spotipy talks HTTP to it) and
+``fakes.FakeYTMusic``, and reports songs/sec, Spotify API calls per song and
+peak RSS. Results are written as JSON so runs can be compared between
+releases.
+
+    python benchmarks/bench_transfer.py --sizes 100 1000 10000 --jobs 8 \\
+        --latency-ms 5 --rate-429 0.01 --output bench_transfer.json
+
+``--server-rps`` makes the fake Spotify answer 429 above a request rate, to
+see how close the rate limiter gets to it.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "src"))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+
+def peak_rss_bytes() -> int:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def run_scenario(size: int, options: dict) -> dict:
+    # Runs in a child process so peak RSS and module state are per scenario
+    import spotipy
+    from fakes import FakeSpotifyServer, FakeYTMusic, synthetic_tracks
+    from ytm2spt import spotify, transfer, youtube
+
+    workdir = tempfile.mkdtemp(prefix="ytm2spt-bench-")
+    os.chdir(workdir)  # match cache, token cache and thumbnail land here
+    if options["quiet"]:
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 2)
+
+    os.environ.update({
+        "SPOTIFY_USER_ID": "benchmark",
+        "SPOTIFY_CLIENT_ID": "benchmark",
+        "SPOTIFY_CLIENT_SECRET": "benchmark",
+        "SPOTIFY_REDIRECT_URI": "http://127.0.0.1/callback",
+    })
+
+    with FakeSpotifyServer(latency=options["latency_ms"] / 1000, rate_429=options["rate_429"],
+                           retry_after=options["retry_after"], max_rps=options["server_rps"]) as server:
+        class LocalSpotify(spotipy.Spotify):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prefix = f"{server.url}/v1/"
+
+        spotify.spotipy.Spotify = LocalSpotify
+        spotify.SpotifyOAuth = lambda **kwargs: None
+        FakeYTMusic.tracks = synthetic_tracks(size)
+        FakeYTMusic.page_latency = options["yt_page_latency_ms"] / 1000
+        FakeYTMusic.thumbnail_url = f"{server.url}/thumbnail.jpg"
+        youtube.YTMusic = FakeYTMusic
+
+        kwargs = dict(
+            youtube_arg="PLbenchmark", spotify_arg=None, spotify_playlist_name=f"Benchmark {size}",
+            youtube_oauth=None, dryrun=False, create_new=False, limit=None, jobs=options["jobs"],
+            use_cache=options["cache"], clear_cache=False, diff_sync=options["diff"],
+        )
+        start = time.perf_counter()
+        result = transfer.transfer_playlist(**kwargs)
+        elapsed = time.perf_counter() - start
+        playlist_size = max((len(p["items"]) for p in server.playlists.values()), default=0)
+        calls = dict(server.calls)
+    api_calls = sum(count for endpoint, count in calls.items() if endpoint != "thumbnail")
+
+    return {
+        "size": size,
+        "seconds": round(elapsed, 3),
+        "songs_per_second": round(size / elapsed, 1),
+        "api_calls": api_calls,
+        "api_calls_per_song": round(api_calls / size, 3),
+        "searches_per_song": round(calls.get("search", 0) / size, 3),
+        "throttled": calls.get("429", 0),
+        "calls_by_endpoint": calls,
+        "phases": result.metrics.to_dict()["phases"],
+        "retries": result.metrics.to_dict()["retries"],
+        "rate_limits": result.metrics.to_dict()["rate_limits"],
+        "youtube_pages": FakeYTMusic.calls["get_playlist"],
+        "playlist_size": playlist_size,
+        "peak_rss_mb": round(peak_rss_bytes() / 2 ** 20, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Latency of every fake Spotify request")
+    parser.add_argument("--yt-page-latency-ms", type=float, default=20.0, help="Latency per 100 YouTube tracks")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of Spotify requests answered with 429")
+    parser.add_argument("--server-rps", type=float, default=0.0,
+                        help="Requests per second the fake Spotify allows before answering 429 (0 is unlimited)")
+    parser.add_argument("--retry-after", type=int, default=0, help="Retry-After of the fake Spotify's 429s")
+    parser.add_argument("--diff", action="store_true", help="Run with --diff")
+    parser.add_argument("--cache", action="store_true", help="Run with the match cache enabled (cold)")
+    parser.add_argument("--verbose", action="store_true", help="Show the transfer log")
+    parser.add_argument("--output", default="bench_transfer.json")
+    args = parser.parse_args()
+
+    options = {
+        "jobs": args.jobs,
+        "latency_ms": args.latency_ms,
+        "yt_page_latency_ms": args.yt_page_latency_ms,
+        "rate_429": args.rate_429,
+        "server_rps": args.server_rps,
+        "retry_after": args.retry_after,
+        "diff": args.diff,
+        "cache": args.cache,
+        "quiet": not args.verbose,
+    }
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in args.sizes:
+        with context.Pool(1) as pool:
+            result = pool.apply(run_scenario, (size, options))
+        results.append(result)
+        print(f"{size:>6} songs  {result['seconds']:8.2f} s  {result['songs_per_second']:9.1f} songs/s  "
+              f"{result['api_calls_per_song']:6.3f} calls/song  {result['peak_rss_mb']:7.1f} MB peak RSS")
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "options": options,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
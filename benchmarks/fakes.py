@@ -0,0 +1,263 @@
+"""Local stand-ins for the Spotify Web API and YTMusic used by the benchmarks.
+
+``FakeSpotifyServer`` is a real HTTP server on localhost that implements the
+handful of endpoints ytm2spt uses, so requests go through spotipy, its
+session and its retry handling exactly as in production. ``FakeYTMusic``
+replaces ``ytmusicapi.YTMusic`` in-process and serves a synthetic playlist.
+Both support artificial latency; the server can also answer a fraction of
+requests, or every request of a client above a rate, with ``429 Too Many
+Requests``.
+"""
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+# Titles containing this word have no match on the fake Spotify
+UNRELEASED = "Unreleased"
+# Size of the JPEG served as playlist thumbnail
+THUMBNAIL_BYTES = 60 * 1024
+
+_FIELD_QUERY = re.compile(r'(track|artist):"([^"]*)"')
+
+
+def synthetic_tracks(size: int, duplicate_ratio: float = 0.05, missing_ratio: float = 0.05, seed: int = 11) -> list:
+    rng = random.Random(seed)
+    tracks = []
+    for i in range(size):
+        if tracks and rng.random() < duplicate_ratio:
+            tracks.append(dict(rng.choice(tracks), videoId=f"dup{i:07d}"))
+            continue
+        title = f"Song {i}" if rng.random() >= missing_ratio else f"{UNRELEASED} Song {i}"
+        tracks.append({
+            "videoId": f"vid{i:08d}",
+            "title": title,
+            "artists": [{"name": f"Artist {i % 997}", "id": None}],
+            "album": {"name": f"Album {i % 211}", "id": None},
+            "duration": "3:20",
+            "duration_seconds": 200 + i % 40,
+            "thumbnails": [{"url": "https://i.ytimg.com/vi/x/default.jpg", "width": 60, "height": 60}],
+            "isAvailable": True,
+            "feedbackTokens": {"add": "x" * 40, "remove": "y" * 40},
+        })
+    return tracks
+
+
+class FakeYTMusic:
+    # Instances are created by ytm2spt through `YTMusic(...)`, configure via class attributes
+    tracks = []
+    page_size = 100
+    page_latency = 0.0
+    thumbnail_url = ""
+    # Serve a fresh copy of the tracks, as parsed from a real response, instead of the shared dicts
+    parsed = False
+    calls = Counter()
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_playlist(self, playlistId: str, limit: int = 100, **kwargs) -> dict:
+        count = len(self.tracks) if limit is None else min(limit, len(self.tracks))
+        pages = max(1, -(-count // self.page_size))
+        FakeYTMusic.calls["get_playlist"] += pages
+        time.sleep(self.page_latency * pages)
+        return {
+            "id": playlistId,
+            "title": f"Benchmark {len(self.tracks)}",
+            "thumbnails": [{"url": self.thumbnail_url, "width": 544, "height": 544}],
+            "trackCount": len(self.tracks),
+            "tracks": json.loads(json.dumps(self.tracks[:count])) if self.parsed else self.tracks[:count],
+        }
+
+
+class FakeSpotifyServer:
+    def __init__(self, latency: float = 0.0, rate_429: float = 0.0, retry_after: int = 0, seed: int = 7,
+                 max_rps: float = 0.0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        # API requests allowed per one second window and client (Authorization header), like
+        # Spotify's rolling limit per app (0 is unlimited)
+        self.max_rps = max_rps
+        self._windows = {}
+        self.calls = Counter()
+        self.throttled = 0
+        self.playlists = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _over_limit(self, client: str = "") -> bool:
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        window = self._windows.setdefault(client, [now, 0])
+        if now - window[0] >= 1:
+            window[:] = [now, 0]
+        window[1] += 1
+        return window[1] > self.max_rps
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def _search(self, query: dict) -> dict:
+        q = query["q"][0]
+        limit = int(query.get("limit", ["10"])[0])
+        fields = dict(_FIELD_QUERY.findall(q))
+        title = fields.get("track", q)
+        items = []
+        if UNRELEASED not in q:
+            number = re.search(r"Song (\d+)", title)
+            if number:
+                i = int(number.group(1))
+                items.append(self._track(f"Song {i}", f"Artist {i % 997}", 200 + i % 40))
+            items.extend(self._track(f"{title} (Cover)", f"Cover Band {n}", 180) for n in range(limit - len(items)))
+        return {"tracks": {"items": items[:limit], "total": len(items)}}
+
+    @staticmethod
+    def _track(name: str, artist: str, seconds: int) -> dict:
+        track_id = f"{zlib.crc32(f'{name}|{artist}'.encode()):022d}"
+        return {
+            "id": track_id,
+            "uri": f"spotify:track:{track_id}",
+            "name": name,
+            "artists": [{"name": artist, "id": "a" * 22}],
+            "duration_ms": seconds * 1000,
+        }
+
+    def _playlist_page(self, playlist_id: str, path: str, query: dict) -> dict:
+        items = self.playlists.setdefault(playlist_id, {"items": [], "snapshot": 0})["items"]
+        offset = int(query.get("offset", ["0"])[0])
+        limit = int(query.get("limit", ["100"])[0])
+        page = [{"track": {"id": uri.rsplit(":", 1)[1], "uri": uri}} for uri in items[offset:offset + limit]]
+        next_url = None
+        if offset + limit < len(items):
+            next_url = f"{self.url}{path}?offset={offset + limit}&limit={limit}"
+        return {"items": page, "next": next_url, "offset": offset, "limit": limit, "total": len(items)}
+
+    def _modify_playlist(self, method: str, playlist_id: str, query: dict, body: dict) -> dict:
+        playlist = self.playlists.setdefault(playlist_id, {"items": [], "snapshot": 0})
+        items = playlist["items"]
+        if method == "POST":
+            position = int(query["position"][0]) if "position" in query else len(items)
+            items[position:position] = body
+        elif method == "PUT" and "uris" in body:
+            items[:] = body["uris"]
+        elif method == "PUT":
+            start, length = body["range_start"], body.get("range_length", 1)
+            moved = items[start:start + length]
+            before = body["insert_before"]
+            del items[start:start + length]
+            if before > start:
+                before -= length
+            items[before:before] = moved
+        elif method == "DELETE":
+            for track in sorted(body["tracks"], key=lambda t: -max(t.get("positions", [0]))):
+                if "positions" in track:
+                    for position in sorted(track["positions"], reverse=True):
+                        del items[position]
+                else:
+                    items[:] = [uri for uri in items if uri != track["uri"]]
+        playlist["snapshot"] += 1
+        return {"snapshot_id": str(playlist["snapshot"])}
+
+    def _route(self, method: str, path: str, query: dict, body) -> tuple:
+        if path == "/thumbnail.jpg":
+            return "thumbnail", None
+        parts = path.strip("/").split("/")[1:]  # drop "v1"
+        if parts == ["search"]:
+            return "search", self._search(query)
+        if parts[0] == "users" and parts[-1] == "playlists":
+            if method == "POST":
+                playlist_id = f"{len(self.playlists):022d}"
+                self.playlists[playlist_id] = {"items": [], "snapshot": 0, "name": body["name"]}
+                return "create_playlist", {"id": playlist_id, "name": body["name"]}
+            items = [{"id": pid, "name": p.get("name", "")} for pid, p in self.playlists.items()]
+            return "user_playlists", {"items": items, "next": None, "offset": 0, "limit": 50, "total": len(items)}
+        if parts[0] == "playlists" and len(parts) == 2:
+            playlist = self.playlists.setdefault(parts[1], {"items": [], "snapshot": 0})
+            if method == "PUT":
+                playlist.update({k: v for k, v in body.items() if k == "name"})
+                return "change_details", {}
+            return "playlist", {"id": parts[1], "name": playlist.get("name", ""),
+                                "snapshot_id": str(playlist["snapshot"])}
+        if parts[0] == "playlists" and parts[2] == "images":
+            return "upload_cover", {}
+        if parts[0] == "playlists" and parts[2] == "tracks":
+            if method == "GET":
+                return "playlist_items", self._playlist_page(parts[1], path, query)
+            return f"playlist_{method.lower()}", self._modify_playlist(method, parts[1], query, body)
+        return "unknown", None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if server.latency:
+                    time.sleep(server.latency)
+                with server._lock:
+                    throttle = url.path.startswith("/v1/") and (
+                        server._rng.random() < server.rate_429
+                        or server._over_limit(self.headers.get("Authorization", "")))
+                    if throttle:
+                        server.throttled += 1
+                        server.calls["429"] += 1
+                if throttle:
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(server.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                try:
+                    body = json.loads(raw) if raw and self.headers.get("Content-Type") == "application/json" else None
+                except ValueError:
+                    body = None
+                with server._lock:
+                    endpoint, payload = server._route(self.command, url.path, parse_qs(url.query), body)
+                    server.calls[endpoint] += 1
+                if endpoint == "thumbnail":
+                    data = b"\xff\xd8" + b"\0" * (THUMBNAIL_BYTES - 4) + b"\xff\xd9"
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    if self.command != "HEAD":
+                        self.wfile.write(data)
+                    return
+                data = json.dumps(payload if payload is not None else {}).encode()
+                self.send_response(200 if endpoint != "unknown" else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _respond
+
+        return Handler
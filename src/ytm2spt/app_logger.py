@@ -1,27 +1,91 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import tempfile
+import threading
 
 
-def setup_logger(name: str):
-    logger = logging.getLogger(name)
+LOGGER_NAME = "ytm2spt"
+# Longest repr of a value passed through `truncate` in a log line
+MAX_LOG_VALUE_CHARS = 300
+
+log_file = None
+_listener = None
+_stream_handler = None
+_configure_lock = threading.Lock()
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    # The queue never leaves the process, so records are passed as they are and
+    # formatted on the listener thread instead of the thread that logged them
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class truncate:
+    # Wraps a large value for %-style log arguments, repr is only built if the line is emitted
+    __slots__ = ("value", "limit")
+
+    def __init__(self, value, limit: int = MAX_LOG_VALUE_CHARS):
+        self.value = value
+        self.limit = limit
+
+    def __str__(self) -> str:
+        text = str(self.value)
+        if len(text) <= self.limit:
+            return text
+        return f"{text[:self.limit]}... ({len(text)} chars)"
+
 
-    logging_format = logging.Formatter(
-        '%(asctime)s~%(levelname)s~\t%(message)s\n\t ~module:%(module)s\n\t~function:%(module)s'
-        )
-    stdout_formating = logging.Formatter('%(levelname)s - %(message)s')
+class PrefixedLogger(logging.LoggerAdapter):
+    # Tells apart the lines of playlists transferred at the same time
+    def process(self, msg, kwargs):
+        return f"[{self.extra['prefix']}] {msg}", kwargs
 
-    with tempfile.NamedTemporaryFile(prefix=name, suffix=".log", delete=False) as f:
-        file_name = f.name
 
-    file_handler = logging.FileHandler(file_name, encoding='utf-8')
-    file_handler.setFormatter(stdout_formating)
-    file_handler.setLevel(logging.DEBUG)
+def configure_logging():
+    # One file and one console handler per process, fed through a queue by a background thread
+    global log_file, _listener, _stream_handler
+    with _configure_lock:
+        if _listener is not None:
+            return
 
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(stdout_formating)
-    stream_handler.setLevel(logging.INFO)
+        stdout_formating = logging.Formatter('%(levelname)s - %(message)s')
 
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
-    logger.setLevel(logging.DEBUG)
+        with tempfile.NamedTemporaryFile(prefix=LOGGER_NAME, suffix=".log", delete=False) as f:
+            log_file = f.name
+
+        file_handler = logging.FileHandler(log_file, encoding='utf-8')
+        file_handler.setFormatter(stdout_formating)
+        file_handler.setLevel(logging.DEBUG)
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(stdout_formating)
+        stream_handler.setLevel(logging.INFO)
+        _stream_handler = stream_handler
+
+        log_queue = queue.SimpleQueue()
+        _listener = logging.handlers.QueueListener(
+            log_queue, file_handler, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.addHandler(_DeferredQueueHandler(log_queue))
+        logger.setLevel(logging.DEBUG)
+
+
+def set_console_level(level: int):
+    # The log file keeps every record, e.g. only warnings on the console while a progress bar is drawn
+    configure_logging()
+    _stream_handler.setLevel(level)
+
+
+def setup_logger(name: str):
+    configure_logging()
+    logger = logging.getLogger(name)
+    if not (name == LOGGER_NAME or name.startswith(f"{LOGGER_NAME}.")):
+        # Modules run as scripts (`__main__`) still go through the shared handlers
+        logger = logging.getLogger(f"{LOGGER_NAME}.{name}")
     return logger
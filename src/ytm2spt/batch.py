@@ -0,0 +1,228 @@
+import argparse
+import dataclasses
+import json
+import sys
+import time
+import tomllib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Union
+from .app_logger import PrefixedLogger, setup_logger
+from .metrics import Metrics
+from .transfer import Transferer, TransferResult
+from .utils import MIN_CONFIDENCE
+
+
+# Playlists transferred at the same time
+DEFAULT_CONCURRENCY = 2
+
+batch_logger = setup_logger(__name__)
+
+
+@dataclass
+class BatchEntry:
+    youtube: str
+    spotify: str = None
+    spotify_name: str = None
+    name: str = None
+    create_new: bool = False
+    dryrun: bool = False
+    limit: int = None
+    jobs: int = 1
+    diff: bool = False
+    stream: bool = False
+    min_confidence: float = MIN_CONFIDENCE
+    manifest: str = None
+
+    @property
+    def label(self) -> str:
+        return self.name or self.spotify_name or self.youtube
+
+
+@dataclass
+class BatchResult:
+    entry: BatchEntry
+    result: Union[TransferResult, None]
+    metrics: Metrics
+    seconds: float
+    error: Union[str, None] = None
+
+
+def load_manifest(path: str, section: str = "batch") -> tuple:
+    # Returns the settings of [section] and one entry per [[playlist]], with [defaults] applied
+    with open(path, "rb") as f:
+        manifest = tomllib.load(f)
+    fields = {field.name for field in dataclasses.fields(BatchEntry)}
+    defaults = manifest.get("defaults", {})
+    entries = []
+    for i, playlist in enumerate(manifest.get("playlist", []), start=1):
+        options = {**defaults, **playlist}
+        unknown = set(options) - fields
+        if unknown:
+            raise ValueError(f"Playlist {i} in {path} has unknown keys: {', '.join(sorted(unknown))}")
+        if not options.get("youtube"):
+            raise ValueError(f"Playlist {i} in {path} has no youtube playlist")
+        if options.get("spotify") and options.get("spotify_name"):
+            raise ValueError(f"Playlist {i} in {path} sets both spotify and spotify_name")
+        entries.append(BatchEntry(**options))
+    if not entries:
+        raise ValueError(f"No [[playlist]] entries in {path}")
+    settings = manifest.get(section, {})
+    concurrency = settings.get("concurrency", DEFAULT_CONCURRENCY)
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError(f"concurrency in [{section}] of {path} must be at least 1")
+    return settings, entries
+
+
+def run_batch(entries: list, concurrency: int = DEFAULT_CONCURRENCY, youtube_oauth: str = None,
+              use_cache: bool = True, resume: bool = False) -> tuple:
+    # One Transferer (session, authenticated clients and match cache) serves every playlist.
+    # Returns the batch metrics (HTTP, summed phases and counters) and a BatchResult per entry.
+    transferer = Transferer.create(
+        youtube_oauth, use_cache=use_cache, pool_size=concurrency * max(entry.jobs for entry in entries))
+    metrics = Metrics()
+    metrics.instrument_session(transferer.session)
+
+    def transfer(entry: BatchEntry) -> BatchResult:
+        entry_metrics = Metrics()
+        start = time.perf_counter()
+        try:
+            result = transferer.transfer(
+                entry.youtube, spotify_arg=entry.spotify, spotify_playlist_name=entry.spotify_name,
+                dryrun=entry.dryrun, create_new=entry.create_new, limit=entry.limit, diff_sync=entry.diff,
+                stream=entry.stream, resume=resume, jobs=entry.jobs, min_confidence=entry.min_confidence,
+                metrics=entry_metrics, ytm2spt_logger=PrefixedLogger(batch_logger, {"prefix": entry.label}),
+                manifest_path=entry.manifest)
+        except Exception as e:
+            batch_logger.error(f"[{entry.label}] Transfer failed: {e}")
+            return BatchResult(entry, None, entry_metrics, time.perf_counter() - start, str(e) or type(e).__name__)
+        return BatchResult(entry, result, entry_metrics, time.perf_counter() - start)
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(transfer, entries))
+    finally:
+        metrics.remove_from_session(transferer.session)
+        transferer.close(metrics)
+
+    for result in results:
+        for phase, seconds in result.metrics.phases.items():
+            metrics.add_time(phase, seconds)
+        for name, value in result.metrics.counters.items():
+            metrics.set_counter(name, metrics.counters.get(name, 0) + value)
+    return metrics, results
+
+
+def log_summary(results: list, seconds: float):
+    lines = []
+    for result in results:
+        counters = result.metrics.counters
+        if result.error:
+            lines.append(f"FAILED {result.entry.label}: {result.error}")
+        elif result.entry.dryrun:
+            lines.append(f"OK     {result.entry.label}: found {counters.get('found', 0)} of "
+                         f"{counters.get('total', 0)} songs in {result.seconds:.1f}s")
+        else:
+            written = counters.get("added", 0)
+            lines.append(f"OK     {result.entry.label}: found {counters.get('found', 0)} of "
+                         f"{counters.get('total', 0)} songs, {written} added in {result.seconds:.1f}s")
+    succeeded = sum(1 for result in results if not result.error)
+    batch_logger.info(f"Batch summary:\n{chr(10).join(lines)}")
+    batch_logger.info(f"Transferred {succeeded} of {len(results)} playlists in {seconds:.1f}s")
+
+
+def write_metrics_json(path: str, metrics: Metrics, results: list):
+    report = metrics.to_dict()
+    report["playlists"] = [
+        {"playlist": result.entry.label, "seconds": round(result.seconds, 3), "error": result.error,
+         **{key: value for key, value in result.metrics.to_dict().items() if key in ("phases", "counters")}}
+        for result in results
+    ]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    batch_logger.info(f"Wrote metrics report to {path}")
+
+
+def get_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="ytm2spt batch",
+        description="Transfer every playlist listed in a TOML manifest",
+    )
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="TOML file with [[playlist]] entries (see README)",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=None,
+        required=False,
+        help=f"Number of playlists to transfer at the same time (Default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument(
+        "-ytauth",
+        "--youtube-oauth-json",
+        type=str,
+        default=None,
+        required=False,
+        help="Youtube OAuth JSON filepath (run 'ytmusicapi-oauth')"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Continue interrupted transfers from their checkpoints",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Do not read or write the local match and cover cache, the playlist cover is then uploaded on every run",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        default=None,
+        required=False,
+        help="Write batch and per-playlist metrics as JSON to this file",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        type=str,
+        default=None,
+        required=False,
+        help="Write the batch metrics in Prometheus textfile format to this file",
+    )
+    args = parser.parse_args(argv)
+    if args.concurrency is not None and args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    return args
+
+
+def main(argv: list = None):
+    args = get_args(sys.argv[1:] if argv is None else argv)
+    settings, entries = load_manifest(args.manifest)
+    concurrency = args.concurrency or settings.get("concurrency", DEFAULT_CONCURRENCY)
+    youtube_oauth = args.youtube_oauth_json or settings.get("youtube_oauth")
+    use_cache = not args.no_cache and settings.get("cache", True)
+
+    start = time.perf_counter()
+    metrics, results = run_batch(entries, concurrency, youtube_oauth, use_cache, args.resume)
+    log_summary(results, time.perf_counter() - start)
+
+    metrics_json = args.metrics_json or settings.get("metrics_json")
+    metrics_prom = args.metrics_prom or settings.get("metrics_prom")
+    if metrics_json:
+        write_metrics_json(metrics_json, metrics, results)
+    if metrics_prom:
+        metrics.write_prometheus(metrics_prom)
+    if any(result.error for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
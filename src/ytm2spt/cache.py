@@ -0,0 +1,162 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import NamedTuple, Union
+from .app_logger import setup_logger
+from .normalize import normalized_key
+from .utils import Candidate
+
+
+# Stored next to the `.spotipy_cache` token file
+MATCH_CACHE_PATH = ".ytm2spt_cache.sqlite"
+FOUND_TTL = 30 * 24 * 60 * 60
+NOT_FOUND_TTL = 24 * 60 * 60
+MAX_ENTRIES = 50_000
+# Encoded covers are tens of kilobytes each, only the most recent are kept
+MAX_COVERS = 200
+# Bump when the table layout or the scoring changes, older caches are dropped
+SCHEMA_VERSION = 4
+
+
+class CachedMatch(NamedTuple):
+    uri: Union[str, None]
+    confidence: float
+    # The best scored candidates, for match manifests
+    candidates: tuple = ()
+
+
+class MatchCache:
+    def __init__(self, path: str = MATCH_CACHE_PATH, max_entries: int = MAX_ENTRIES,
+                 found_ttl: int = FOUND_TTL, not_found_ttl: int = NOT_FOUND_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.found_ttl = found_ttl
+        self.not_found_ttl = not_found_ttl
+        self.hits = 0
+        self.misses = 0
+        self.cache_logger = setup_logger(__name__)
+        self._lock = threading.Lock()
+        # Resolution runs on a thread pool, access is serialised through the lock
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._db.execute("DROP TABLE IF EXISTS matches")
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS matches ("
+            "key TEXT PRIMARY KEY, uri TEXT, confidence REAL NOT NULL, candidates TEXT, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS matches_last_used ON matches (last_used)")
+        # Encoded covers by source thumbnail URL, and the source last uploaded to each Spotify playlist
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS covers (url TEXT PRIMARY KEY, encoded BLOB NOT NULL, created REAL NOT NULL)")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS uploaded_covers ("
+            "playlist_id TEXT PRIMARY KEY, url TEXT NOT NULL, uploaded REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, artist: str, title: str) -> Union[CachedMatch, None]:
+        key = normalized_key(artist, title)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT uri, confidence, candidates, created FROM matches WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            uri, confidence, candidates, created = row
+            ttl = self.found_ttl if uri else self.not_found_ttl
+            if now - created > ttl:
+                self._db.execute("DELETE FROM matches WHERE key = ?", (key,))
+                self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE matches SET last_used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+        candidates = tuple(Candidate(*candidate) for candidate in json.loads(candidates or "[]"))
+        return CachedMatch(uri, confidence, candidates)
+
+    def put(self, artist: str, title: str, uri: Union[str, None], confidence: float = 0.0,
+            candidates: tuple = ()) -> None:
+        key = normalized_key(artist, title)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO matches (key, uri, confidence, candidates, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, uri, confidence, json.dumps([list(candidate) for candidate in candidates]), now, now),
+            )
+            self._db.commit()
+
+    def get_cover(self, url: str) -> Union[bytes, None]:
+        with self._lock:
+            row = self._db.execute("SELECT encoded, created FROM covers WHERE url = ?", (url,)).fetchone()
+        if row is None or time.time() - row[1] > self.found_ttl:
+            return None
+        return row[0]
+
+    def put_cover(self, url: str, encoded: bytes) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO covers (url, encoded, created) VALUES (?, ?, ?)", (url, encoded, time.time()))
+            self._db.commit()
+
+    def get_uploaded_cover(self, playlist_id: str) -> Union[str, None]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, uploaded FROM uploaded_covers WHERE playlist_id = ?", (playlist_id,)).fetchone()
+        if row is None or time.time() - row[1] > self.found_ttl:
+            return None
+        return row[0]
+
+    def set_uploaded_cover(self, playlist_id: str, url: str) -> None:
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO uploaded_covers (playlist_id, url, uploaded) VALUES (?, ?, ?)",
+                (playlist_id, url, time.time()))
+            self._db.commit()
+
+    def evict(self) -> None:
+        self.evict_covers()
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM matches").fetchone()[0]
+            if count <= self.max_entries:
+                return
+            self._db.execute(
+                "DELETE FROM matches WHERE key IN "
+                "(SELECT key FROM matches ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+            self._db.commit()
+        self.cache_logger.debug("Evicted %d entries from match cache", count - self.max_entries)
+
+    def evict_covers(self) -> None:
+        # Expired covers and uploads are never read again, of the rest only the newest MAX_COVERS covers are kept
+        expired = time.time() - self.found_ttl
+        with self._lock:
+            covers = self._db.execute("DELETE FROM covers WHERE created < ?", (expired,)).rowcount
+            covers += self._db.execute(
+                "DELETE FROM covers WHERE url NOT IN (SELECT url FROM covers ORDER BY created DESC LIMIT ?)",
+                (MAX_COVERS,)).rowcount
+            uploads = self._db.execute("DELETE FROM uploaded_covers WHERE uploaded < ?", (expired,)).rowcount
+            self._db.commit()
+        if covers or uploads:
+            self.cache_logger.debug("Evicted %d covers and %d uploaded covers from match cache", covers, uploads)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM matches")
+            self._db.execute("DELETE FROM covers")
+            self._db.execute("DELETE FROM uploaded_covers")
+            self._db.commit()
+        self.cache_logger.debug("Cleared match cache %s", self.path)
+
+    def close(self) -> None:
+        self.evict()
+        with self._lock:
+            self._db.close()
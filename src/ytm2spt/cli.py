@@ -1,15 +1,22 @@
 import argparse
-from .transfer import transfer_playlist
+import logging
+import signal
+import sys
+from .utils import MIN_CONFIDENCE
 
 def get_args():
-    parser = argparse.ArgumentParser()
+    parser = argparse.ArgumentParser(
+        epilog="Run 'ytm2spt batch -h' to transfer many playlists listed in a manifest, "
+               "'ytm2spt watch -h' to keep them in sync, "
+               "or 'ytm2spt shard -h' to transfer a large playlist with several processes",
+    )
     parser.add_argument(
         "-yt",
         "--youtube-url-or-id",
         type=str,
         default=None,
-        required=True,
-        help="Youtube Playlist URL or ID",
+        required=False,
+        help="Youtube Playlist URL or ID (not needed with --apply-manifest)",
     )
     sp_group = parser.add_mutually_exclusive_group(required=False)
     sp_group.add_argument(
@@ -60,17 +67,107 @@ def get_args():
         required=False,
         help="Limit the number of songs to fetch",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of songs to search on Spotify in parallel (Default: 1)",
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=MIN_CONFIDENCE,
+        required=False,
+        help=f"Minimum match score (0-100) for a Spotify track to be used (Default: {MIN_CONFIDENCE})",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Fetch the Youtube playlist page by page and start searching \
+            before the last page is downloaded",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Only add, remove and reorder the songs that changed \
+            instead of emptying an existing playlist",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Continue an interrupted transfer from its checkpoint, \
+            skipping the songs already searched and added",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Do not read or write the local match and cover cache, the playlist cover is then uploaded on every run",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Clear the local match cache before searching",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        default=None,
+        required=False,
+        help="Write per-phase timings and HTTP request metrics as JSON to this file",
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        type=str,
+        default=None,
+        required=False,
+        help="Write the metrics in Prometheus textfile format to this file",
+    )
+    manifest_group = parser.add_mutually_exclusive_group(required=False)
+    manifest_group.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        required=False,
+        help="Write every song with its Spotify match, confidence and candidates to this \
+            JSON lines file (CSV if it ends in .csv) for review",
+    )
+    manifest_group.add_argument(
+        "--apply-manifest",
+        type=str,
+        default=None,
+        required=False,
+        help="Add the songs of a reviewed match manifest to the Spotify playlist (-sp or -spname) \
+            without searching",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Show a progress bar with throughput and ETA instead of a line per song",
+    )
 
     args = parser.parse_args()
-    youtube = args.youtube_url_or_id
-    youtube_oauth = args.youtube_oauth_json
-    spotify = args.spotify_url_or_id
-    spotify_playlist_name = args.spotify_playlist_name
-    dryrun = args.dryrun
-    create_new = args.create_new
-    limit = args.limit
-
-    return youtube, spotify, spotify_playlist_name, youtube_oauth, dryrun, create_new, limit
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.apply_manifest:
+        if not (args.spotify_url_or_id or args.spotify_playlist_name):
+            parser.error("--apply-manifest needs -sp/--spotify-url-or-id or -spname/--spotify-playlist-name")
+    elif not args.youtube_url_or_id:
+        parser.error("the following arguments are required: -yt/--youtube-url-or-id")
+    return args
 
 
 def oauth():
@@ -108,7 +205,55 @@ def oauth():
 
 
 def main():
-    transfer_playlist(*get_args())
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        from .batch import main as batch_main
+        return batch_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        from .watch import main as watch_main
+        return watch_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] in ("shard", "worker"):
+        from .shard import main as shard_main, worker_main
+        return (shard_main if sys.argv[1] == "shard" else worker_main)(sys.argv[2:])
+    args = get_args()
+    from .app_logger import set_console_level, setup_logger
+    from .progress import CancelToken, ProgressBar
+    from .transfer import transfer_playlist
+
+    # The first Ctrl+C stops after the current chunk, the second one right away
+    cancel = CancelToken()
+
+    def stop(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        setup_logger(__name__).warning("Stopping after the current chunk, press Ctrl+C again to abort")
+        cancel.cancel()
+
+    signal.signal(signal.SIGINT, stop)
+    if args.progress:
+        set_console_level(logging.WARNING)
+    result = transfer_playlist(
+        youtube_arg=args.youtube_url_or_id,
+        spotify_arg=args.spotify_url_or_id,
+        spotify_playlist_name=args.spotify_playlist_name,
+        youtube_oauth=args.youtube_oauth_json,
+        dryrun=args.dryrun,
+        create_new=args.create_new,
+        limit=args.limit,
+        jobs=args.jobs,
+        use_cache=not args.no_cache,
+        clear_cache=args.clear_cache,
+        diff_sync=args.diff,
+        stream=args.stream,
+        min_confidence=args.min_confidence,
+        metrics_json=args.metrics_json,
+        metrics_prom=args.metrics_prom,
+        resume=args.resume,
+        on_progress=ProgressBar() if args.progress else None,
+        cancel=cancel,
+        manifest_path=args.manifest,
+        apply_manifest=args.apply_manifest,
+    )
+    if result.cancelled:
+        sys.exit(130)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+import base64
+import io
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union
+import requests
+from .app_logger import setup_logger
+
+
+# Spotify accepts base64 encoded JPEG covers of up to 256 KB
+SPOTIFY_COVER_LIMIT = 256 * 1024
+MAX_COVER_BYTES = SPOTIFY_COVER_LIMIT * 3 // 4
+# Size requested from resizable thumbnail URLs and used when downscaling
+COVER_SIZE = 640
+DOWNSCALE_SIZES = (640, 480, 300)
+JPEG_QUALITIES = (90, 80, 70, 60)
+# Size options at the end of googleusercontent URLs, e.g. "=w544-h544-l90-rj" or "=s1200"
+_GOOGLE_SIZE_OPTIONS = re.compile(r"=[swh]\d+[^/=]*$")
+
+cover_logger = setup_logger(__name__)
+
+
+def resized_url(url: str, size: int = COVER_SIZE) -> Union[str, None]:
+    if "googleusercontent.com" not in url or not _GOOGLE_SIZE_OPTIONS.search(url):
+        return None
+    return _GOOGLE_SIZE_OPTIONS.sub(f"=w{size}-h{size}-l90-rj", url)
+
+
+def _content_length(session: requests.Session, url: str) -> Union[int, None]:
+    try:
+        response = session.head(url, allow_redirects=True)
+        length = response.headers.get("content-length")
+        return int(length) if response.ok and length else None
+    except requests.RequestException as e:
+        cover_logger.debug("Could not probe thumbnail %s: %s", url, e)
+        return None
+
+
+def probe_thumbnails(session: requests.Session, thumbnails: list) -> list:
+    # HEAD every size at once, returns (url, width, content length or None) largest first
+    thumbnails = sorted(thumbnails, key=lambda thumbnail: thumbnail.get("width") or 0, reverse=True)
+    urls = [thumbnail["url"] for thumbnail in thumbnails]
+    with ThreadPoolExecutor(max_workers=max(1, len(urls))) as executor:
+        lengths = list(executor.map(lambda url: _content_length(session, url), urls))
+    return [(url, thumbnail.get("width") or 0, length) for url, thumbnail, length in zip(urls, thumbnails, lengths)]
+
+
+def fit_image(data: bytes) -> Union[bytes, None]:
+    # Re-encode as JPEG, smaller and at lower quality until it fits
+    try:
+        from PIL import Image
+    except ImportError:  # Pillow is optional, only needed when no thumbnail fits as it is
+        cover_logger.warning("No thumbnail fits the Spotify cover limit and Pillow is not installed to downscale it, "
+                             "keeping the current cover. Install it with: pip install ytm2spt[cover]")
+        return None
+    image = Image.open(io.BytesIO(data)).convert("RGB")
+    for size in DOWNSCALE_SIZES:
+        image.thumbnail((size, size))
+        for quality in JPEG_QUALITIES:
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+            if output.tell() <= MAX_COVER_BYTES:
+                return output.getvalue()
+    return None
+
+
+def build_cover(session: requests.Session, thumbnails: list) -> Union[bytes, None]:
+    # Returns the base64 encoded JPEG to upload, or None if no thumbnail can be made to fit
+    if not thumbnails:
+        return None
+    probed = probe_thumbnails(session, thumbnails)
+    fitting = [url for url, _, length in probed if length is not None and length <= MAX_COVER_BYTES]
+    unknown = [url for url, _, length in probed if length is None]
+    candidates = fitting[:1] + unknown
+    resized = resized_url(probed[0][0])
+    if resized:
+        candidates.append(resized)
+
+    largest = None
+    for url in candidates:
+        response = session.get(url)
+        if not response.ok:
+            continue
+        if len(response.content) <= MAX_COVER_BYTES:
+            cover_logger.debug("Using thumbnail %s (%d bytes)", url, len(response.content))
+            return base64.b64encode(response.content)
+        largest = largest or response.content
+
+    if largest is None:
+        response = session.get(probed[0][0])
+        largest = response.content if response.ok else None
+    data = fit_image(largest) if largest else None
+    if data is None:
+        return None
+    cover_logger.debug("Downscaled thumbnail to %d bytes", len(data))
+    return base64.b64encode(data)
@@ -1,18 +1,21 @@
 import os
 import sys
+import time
 import traceback
 from PySide6.QtWidgets import QApplication, QMainWindow, QWidget\
     , QLabel, QLineEdit, QCheckBox, QSpinBox, QTextEdit, QPushButton\
     , QVBoxLayout, QFormLayout, QHBoxLayout, QDialog, QButtonGroup\
-    , QRadioButton, QGroupBox, QMessageBox
+    , QRadioButton, QGroupBox, QMessageBox, QProgressBar
 from PySide6.QtCore import Qt, QSettings, QThread, Signal
 from PySide6 import QtCore
-from ytmusicapi import setup_oauth
 
-from .transfer import transfer_playlist
+from .progress import CancelToken, format_progress
+from .transfer import Transferer
 
 SETTINGS = QSettings(QSettings.IniFormat, QSettings.UserScope, "ytm2spt", "config")
 YTOAUTH_PATH = os.path.join(os.path.dirname(SETTINGS.fileName()), "oauth.json")
+# Shortest time between two progress updates sent to the window
+PROGRESS_INTERVAL = 0.1
 
 
 def init_settings():
@@ -115,6 +118,7 @@ class YouTubeSettingsDialog(QDialog):
         layout.addWidget(self.message_label)
 
     def get_oauth_token(self):
+        from ytmusicapi import setup_oauth
         setup_oauth(filepath=YTOAUTH_PATH, open_browser=True)
         self.message_label.setText("OAuth token saved at " + YTOAUTH_PATH)
         # Qt sleep 3 seconds
@@ -125,6 +129,9 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("YouTube to Spotify")
+        # Reused by the next run while the Youtube account and number of jobs stay the same
+        self.transferer = None
+        self.transferer_key = None
         
         # Create a central widget and set it as the main window's central widget
         central_widget = QWidget(self)
@@ -209,11 +216,22 @@ class MainWindow(QMainWindow):
         limit_layout = QFormLayout()
         limit_layout.addRow("Limit", self.limit_input)
         other_layout.addLayout(limit_layout)
+
+        self.jobs_input = QSpinBox()
+        self.jobs_input.setRange(1, 32)
+        self.jobs_input.valueChanged.connect(self.update_command)
+        jobs_layout = QFormLayout()
+        jobs_layout.addRow("Jobs", self.jobs_input)
+        other_layout.addLayout(jobs_layout)
         
         self.dryrun_checkbox = QCheckBox("Dry Run")
         self.dryrun_checkbox.stateChanged.connect(self.update_command)
         other_layout.addWidget(self.dryrun_checkbox)
 
+        self.diff_checkbox = QCheckBox("Sync Changes Only")
+        self.diff_checkbox.stateChanged.connect(self.update_command)
+        other_layout.addWidget(self.diff_checkbox)
+
         layout.addWidget(self.other_group)
         
         # Command
@@ -224,6 +242,14 @@ class MainWindow(QMainWindow):
         self.cmd_textbox = QTextEdit()
         self.cmd_textbox.setReadOnly(True)
         cmd_layout.addWidget(self.cmd_textbox)
+
+        # Progress of the running transfer
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setVisible(False)
+        cmd_layout.addWidget(self.progress_bar)
+        self.progress_label = QLabel()
+        self.progress_label.setVisible(False)
+        cmd_layout.addWidget(self.progress_label)
         
         # Create button to run the command
         self.run_button = QPushButton("Run Command")
@@ -273,13 +299,21 @@ class MainWindow(QMainWindow):
             
             if self.limit_input.value() > 0:
                 command += f" -l {self.limit_input.value()}"
+
+            if self.diff_checkbox.isChecked():
+                command += " --diff"
+
+            if self.jobs_input.value() > 1:
+                command += f" -j {self.jobs_input.value()}"
         
         self.cmd_textbox.setText(command)
         
     def run_command(self):
         if "Stop" in self.run_button.text():
-            self.worker.terminate()
-            self.run_button.setText("Run Command")
+            # The transfer stops by itself after the current song or chunk
+            self.worker.cancel.cancel()
+            self.run_button.setText("Stopping...")
+            self.run_button.setEnabled(False)
             return
         else:
             self.run_button.setText("Stop Command")
@@ -301,22 +335,56 @@ class MainWindow(QMainWindow):
         dry_run = self.dryrun_checkbox.isChecked()
         create_new = self.create_new_checkbox.isChecked()
         limit = self.limit_input.value() if self.limit_input.value() > 0 else None
+        jobs = self.jobs_input.value()
+        diff_sync = self.diff_checkbox.isChecked()
 
         # Run ytm2spt
-        self.worker = RunCommandWorker(youtube_arg, spotify_arg, spotify_playlist_name, youtube_oauth, dry_run, create_new, limit)
+        transferer_key = (youtube_oauth, jobs, SETTINGS.value("SPOTIFY_CLIENT_ID"), SETTINGS.value("SPOTIFY_USER_ID"))
+        if transferer_key != self.transferer_key:
+            if self.transferer:
+                self.transferer.close()
+            self.transferer = None
+            self.transferer_key = transferer_key
+        self.worker = RunCommandWorker(self.transferer, youtube_arg, spotify_arg, spotify_playlist_name, youtube_oauth, dry_run, create_new, limit, jobs, diff_sync)
         self.worker.completed.connect(self.run_finished)
         self.worker.error.connect(self.run_error)
+        self.worker.progress.connect(self.update_progress)
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(True)
+        self.progress_label.setText("Fetching YouTube playlist...")
+        self.progress_label.setVisible(True)
         self.worker.start()
 
-    def run_finished(self):
-        QMessageBox.information(self, "Info", "Finished running ytm2spt")
+    def update_progress(self, event):
+        if event.total:
+            self.progress_bar.setRange(0, event.total)
+            self.progress_bar.setValue(min(event.done, event.total))
+        else:
+            self.progress_bar.setRange(0, 0)
+        self.progress_label.setText(format_progress(event))
+
+    def reset_run_button(self):
+        self.progress_bar.setVisible(False)
         self.run_button.setText("Run Command")
+        self.run_button.setEnabled(True)
+
+    def run_finished(self, result):
+        self.transferer = self.worker.transferer
+        message = f"Found {len(result.found)} of {len(result.found) + len(result.missing)} songs"
+        if result.added:
+            message += f", added {len(result.added)}"
+        if result.cancelled:
+            QMessageBox.information(self, "Info", f"Stopped ytm2spt\n{message}")
+        else:
+            QMessageBox.information(self, "Info", f"Finished running ytm2spt\n{message}")
+        self.reset_run_button()
 
 
     def run_error(self, error):
+        self.transferer = self.worker.transferer
         self.cmd_textbox.setText("Error running command: " + error)
         QMessageBox.warning(self, "Error", "Error: Failed to run ytm2spt")
-        self.run_button.setText("Run Command")
+        self.reset_run_button()
 
     def open_spotify_settings(self):
         settings_dialog = SpotifySettingsDialog(self)
@@ -334,11 +402,13 @@ class MainWindow(QMainWindow):
 
 
 class RunCommandWorker(QThread):
-    completed = Signal()
+    completed = Signal(object)
     error = Signal(str)
+    progress = Signal(object)
 
-    def __init__(self, youtube_arg, spotify_arg, spotify_playlist_name, youtube_oauth, dry_run, create_new, limit):
+    def __init__(self, transferer, youtube_arg, spotify_arg, spotify_playlist_name, youtube_oauth, dry_run, create_new, limit, jobs, diff_sync):
         super().__init__()
+        self.transferer = transferer
         self.youtube_arg = youtube_arg
         self.spotify_arg = spotify_arg
         self.spotify_playlist_name = spotify_playlist_name
@@ -346,6 +416,20 @@ class RunCommandWorker(QThread):
         self.dry_run = dry_run
         self.create_new = create_new
         self.limit = limit
+        self.jobs = jobs
+        self.diff_sync = diff_sync
+        self.cancel = CancelToken()
+        self.last_progress = 0.0
+        self.progress_stage = None
+
+    def report_progress(self, event):
+        # Called for every song from the transfer threads, the window is updated at most every PROGRESS_INTERVAL
+        now = time.perf_counter()
+        if event.kind != "done" and event.stage == self.progress_stage and now - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        self.progress_stage = event.stage
+        self.progress.emit(event)
     
     def run(self):
         try:
@@ -353,8 +437,10 @@ class RunCommandWorker(QThread):
             os.environ["SPOTIFY_CLIENT_ID"] = SETTINGS.value("SPOTIFY_CLIENT_ID")
             os.environ["SPOTIFY_CLIENT_SECRET"] = SETTINGS.value("SPOTIFY_CLIENT_SECRET")
             os.environ["SPOTIFY_REDIRECT_URI"] = SETTINGS.value("SPOTIFY_REDIRECT_URI")
-            transfer_playlist(self.youtube_arg, self.spotify_arg, self.spotify_playlist_name, self.youtube_oauth, self.dry_run, self.create_new, self.limit)
-            self.completed.emit()
+            if self.transferer is None:
+                self.transferer = Transferer.create(self.youtube_oauth, self.jobs)
+            result = self.transferer.transfer(self.youtube_arg, spotify_arg=self.spotify_arg, spotify_playlist_name=self.spotify_playlist_name, dryrun=self.dry_run, create_new=self.create_new, limit=self.limit, diff_sync=self.diff_sync, on_progress=self.report_progress, cancel=self.cancel)
+            self.completed.emit(result)
         except Exception as e:
             print(e)
             print(traceback.format_exc())
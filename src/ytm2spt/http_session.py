@@ -0,0 +1,125 @@
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+from .rate_limit import MAX_RETRY_AFTER, RateLimiter, parse_retry_after
+
+
+# (connect, read) timeout in seconds for requests that don't set their own
+DEFAULT_TIMEOUT = (5, 30)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.3
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# 429s retried after waiting out Retry-After when the session is rate limited
+RATE_LIMIT_RETRIES = 5
+# Distinct hosts kept in the pool: Spotify API and accounts, YouTube Music, thumbnail CDNs
+POOL_HOSTS = 16
+MIN_POOL_SIZE = 10
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    # With a limiter, requests wait for a token of their bucket and 429s are retried here
+    # instead of by urllib3, so one 429 pauses every thread using the bucket and lowers its rate.
+    # Requests without a bucket (tokens, thumbnails) go through a second adapter whose urllib3
+    # retries still cover 429s.
+    __attrs__ = HTTPAdapter.__attrs__ + ["timeout", "limiter", "unpaced"]
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, limiter: RateLimiter = None, unpaced_retries: Retry = None, **kwargs):
+        self.timeout = timeout
+        self.limiter = limiter
+        self.unpaced = None
+        if limiter and unpaced_retries is not None:
+            self.unpaced = HTTPAdapter(**{**kwargs, "max_retries": unpaced_retries})
+        super().__init__(**kwargs)
+
+    def close(self):
+        super().close()
+        if self.unpaced:
+            self.unpaced.close()
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        bucket = self.limiter.bucket(request.method, request.url) if self.limiter else None
+        if bucket is None:
+            if self.unpaced:
+                return self.unpaced.send(request, **kwargs)
+            return super().send(request, **kwargs)
+
+        throttled = 0
+        while True:
+            bucket.acquire()
+            response = super().send(request, **kwargs)
+            if response.status_code != 429:
+                bucket.on_success()
+                break
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            bucket.on_throttled(retry_after)
+            self.limiter.log_throttled(request.method, request.url, retry_after)
+            if throttled >= RATE_LIMIT_RETRIES or (retry_after or 0) > MAX_RETRY_AFTER:
+                break
+            throttled += 1
+            response.close()
+        # Read by Metrics, these 429s never reach the session's response hooks
+        response.rate_limit_retries = throttled
+        return response
+
+
+def build_session(jobs: int = 1, timeout=DEFAULT_TIMEOUT, retries: int = MAX_RETRIES,
+                  rate_limit: bool = True) -> requests.Session:
+    # One session for spotipy, ytmusicapi and the thumbnail requests, so connections are kept alive
+    # and reused. Every search thread may hold a connection to the same host at once.
+    limiter = RateLimiter() if rate_limit else None
+    retry = Retry(
+        total=retries,
+        connect=None,
+        read=False,
+        status=retries,
+        allowed_methods=frozenset(["HEAD", "GET", "POST", "PUT", "DELETE"]),
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUSES,
+        raise_on_status=False,
+    )
+    # The limiter retries 429s of paced requests itself, urllib3 retries any status with a
+    # Retry-After header otherwise, 429s included
+    paced_retry = retry.new(
+        status_forcelist=[status for status in RETRY_STATUSES if status != 429],
+        respect_retry_after_header=False,
+    ) if limiter else retry
+    adapter = TimeoutHTTPAdapter(
+        timeout=timeout,
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=max(MIN_POOL_SIZE, jobs + 2),
+        max_retries=paced_retry,
+        limiter=limiter,
+        unpaced_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def rate_limit_stats(session: requests.Session) -> dict:
+    # Current rate, requests, 429s and time waited per bucket
+    for adapter in set(session.adapters.values()):
+        if getattr(adapter, "limiter", None):
+            return adapter.limiter.stats()
+    return {}
+
+
+def connection_stats(session: requests.Session) -> dict:
+    # Per host: requests sent and connections opened, the difference was served by kept-alive connections
+    stats = {}
+    adapters = set(session.adapters.values())
+    adapters |= {adapter.unpaced for adapter in adapters if getattr(adapter, "unpaced", None)}
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            host_stats = stats.setdefault(host, {"requests": 0, "connections": 0})
+            host_stats["requests"] += pool.num_requests
+            host_stats["connections"] += pool.num_connections
+    for host_stats in stats.values():
+        host_stats["reused"] = max(0, host_stats["requests"] - host_stats["connections"])
+    return stats
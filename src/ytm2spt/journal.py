@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import zlib
+from typing import Union
+from .app_logger import setup_logger
+from .utils import Candidate, Match
+
+
+# Directory of checkpoints, one JSON lines file per YouTube and Spotify playlist pair
+JOURNAL_DIR = ".ytm2spt_journal"
+# Resolved matches are written in batches, chunks and playlist changes immediately
+MATCH_FLUSH_EVERY = 50
+
+
+class Journal:
+    # Checkpoints of a transfer: the Spotify playlist it writes to, whether it was emptied,
+    # every resolved match and every chunk added. Removed once the transfer completes.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.spotify_id = None
+        self.emptied = False
+        self.matches = {}
+        self.written_end = 0
+        self.written_tracks = 0
+        self.journal_logger = setup_logger(__name__)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def for_transfer(cls, youtube_id: str, spotify_target: Union[str, None], directory: str = JOURNAL_DIR) -> 'Journal':
+        target = f"{zlib.crc32((spotify_target or '').encode()):08x}"
+        return cls(os.path.join(directory, f"{youtube_id}-{target}.jsonl"))
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # The process died while writing this line
+                kind = entry.get("type")
+                if kind == "start":
+                    self.spotify_id = entry["spotify_id"]
+                elif kind == "emptied":
+                    self.emptied = True
+                    self.written_end = self.written_tracks = 0
+                elif kind == "match":
+                    candidates = tuple(Candidate(*candidate) for candidate in entry.get("candidates", []))
+                    self.matches[entry["key"]] = Match(entry["uri"], entry["confidence"], candidates)
+                elif kind == "chunk":
+                    self.written_end = entry["end"]
+                    self.written_tracks = entry["tracks"]
+        self.journal_logger.debug(
+            "Loaded journal %s: %d matches, %d songs written", self.path, len(self.matches), self.written_end)
+        return True
+
+    def open(self, resume: bool = False):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+
+    def _record(self, flush: bool = True, **entry):
+        with self._lock:
+            if self._file is None:
+                return
+            self._pending.append(json.dumps(entry))
+            if flush or len(self._pending) >= MATCH_FLUSH_EVERY:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        self._file.write("\n".join(self._pending) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending.clear()
+
+    def record_start(self, spotify_id: str):
+        self.spotify_id = spotify_id
+        self._record(type="start", spotify_id=spotify_id)
+
+    def record_emptied(self):
+        self.emptied = True
+        self.written_end = self.written_tracks = 0
+        self._record(type="emptied")
+
+    def record_match(self, key: str, match: Match):
+        self._record(flush=False, type="match", key=key, uri=match.uri, confidence=match.confidence,
+                     candidates=[list(candidate) for candidate in match.candidates])
+
+    def record_chunk(self, end: int, tracks: int):
+        self._record(type="chunk", end=end, tracks=tracks)
+
+    def resume_offset(self, playlist_tracks: Union[int, None], total: int) -> int:
+        # Songs of the target list already in the playlist. A chunk added right before the
+        # process died may be missing from the journal, the playlist's track count tells.
+        offset = self.written_end
+        if playlist_tracks is not None and playlist_tracks > self.written_tracks:
+            offset += playlist_tracks - self.written_tracks
+        return min(offset, total)
+
+    def close(self, completed: bool = False):
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.close()
+            self._file = None
+        if completed:
+            os.remove(self.path)
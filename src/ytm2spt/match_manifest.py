@@ -0,0 +1,94 @@
+import csv
+import json
+import os
+import re
+from typing import Union
+from .transfer import TransferItem
+from .utils import Candidate, Match
+
+
+# Columns of a match manifest, in order. Files ending in .csv are CSV (with the candidates
+# as a JSON list), anything else is JSON lines.
+FIELDS = ("position", "video_id", "artist", "title", "duration", "uri", "confidence", "candidates")
+
+_TRACK_URL = re.compile(r"open\.spotify\.com/(?:intl-\w+/)?track/(\w+)")
+
+
+def is_csv(path: str) -> bool:
+    return path.lower().endswith(".csv")
+
+
+def item_to_row(item: TransferItem) -> dict:
+    song, match = item.song, item.match
+    return {
+        "position": item.position,
+        "video_id": song.video_id,
+        "artist": song.artist,
+        "title": song.title,
+        "duration": song.duration,
+        "uri": match.uri,
+        "confidence": round(match.confidence, 1),
+        "candidates": [candidate._asdict() for candidate in match.candidates],
+    }
+
+
+def write_match_manifest(path: str, items: list):
+    # `items` are TransferItems in playlist order, with and without a match
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        if is_csv(path):
+            writer = csv.DictWriter(f, FIELDS)
+            writer.writeheader()
+            for item in items:
+                row = item_to_row(item)
+                row["candidates"] = json.dumps(row["candidates"])
+                writer.writerow(row)
+        else:
+            for item in items:
+                f.write(json.dumps(item_to_row(item)) + "\n")
+    os.replace(tmp_path, path)
+
+
+def track_uri(value: Union[str, None]) -> Union[str, None]:
+    # Reviewers may paste a track link instead of the URI, an empty value leaves the song out
+    value = (value or "").strip()
+    if not value:
+        return None
+    if value.startswith("spotify:track:"):
+        return value
+    url_match = _TRACK_URL.search(value)
+    if url_match:
+        return f"spotify:track:{url_match.group(1)}"
+    raise ValueError(f"Not a Spotify track: {value}")
+
+
+def row_to_item(row: dict, position: int) -> TransferItem:
+    from .youtube import Song
+    candidates = row.get("candidates") or []
+    if isinstance(candidates, str):
+        candidates = json.loads(candidates)
+    duration = row.get("duration")
+    song = Song(row.get("artist") or "", row.get("title") or "", int(duration) if duration not in (None, "") else None,
+                row.get("video_id") or None)
+    match = Match(track_uri(row.get("uri")), float(row.get("confidence") or 0),
+                  tuple(Candidate(**candidate) for candidate in candidates))
+    return TransferItem(int(row.get("position") or position), song, match)
+
+
+def read_match_manifest(path: str) -> list:
+    # Songs are returned in file order, so a reviewer can reorder the playlist by moving rows
+    items = []
+    with open(path, encoding="utf-8", newline="") as f:
+        rows = enumerate(csv.DictReader(f), start=2) if is_csv(path) else enumerate(f, start=1)
+        for line_number, row in rows:
+            try:
+                if isinstance(row, str):
+                    if not row.strip():
+                        continue
+                    row = json.loads(row)
+                if "uri" not in row:
+                    raise ValueError("no uri")
+                items.append(row_to_item(row, len(items) + 1))
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Line {line_number} of {path}: {e}") from e
+    return items
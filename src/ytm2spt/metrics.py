@@ -0,0 +1,239 @@
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterable, Union
+from urllib.parse import urlparse
+from .app_logger import setup_logger
+
+if TYPE_CHECKING:
+    import requests
+
+
+PHASES = ("fetch", "normalize", "cover", "empty", "resolve", "write")
+# Upper bounds (in seconds) of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Path segments following these are IDs, collapsed so endpoints group together
+_ID_PARENTS = {"users", "playlists", "tracks", "albums", "artists", "episodes", "shows"}
+_ID_SEGMENT = re.compile(r"^[0-9A-Za-z]{22}$")
+# Requests share one session, the service is told apart by host
+SERVICE_HOSTS = (
+    ("accounts.spotify.com", "spotify_auth"),
+    ("spotify.com", "spotify"),
+    ("youtube.com", "youtube"),
+    ("googleusercontent.com", "thumbnail"),
+    ("ytimg.com", "thumbnail"),
+)
+
+
+def endpoint_name(method: str, url: str) -> str:
+    segments = urlparse(url).path.strip("/").split("/")
+    for i, segment in enumerate(segments):
+        if (i and segments[i - 1] in _ID_PARENTS) or _ID_SEGMENT.match(segment):
+            segments[i] = "{id}"
+    return f"{method} /{'/'.join(segments)}"
+
+
+def service_name(url: str) -> str:
+    host = urlparse(url).hostname or ""
+    for suffix, service in SERVICE_HOSTS:
+        if host == suffix or host.endswith(f".{suffix}"):
+            return service
+    return host
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds: float, status: int):
+        self.count += 1
+        self.total_seconds += seconds
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        if status >= 400:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total_seconds": round(self.total_seconds, 6),
+            "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.buckets)),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.endpoints = {}
+        self.retries = {}
+        self.throttled = {}
+        self.counters = {}
+        self.connections = {}
+        self.rate_limits = {}
+        self._lock = threading.Lock()
+        self.metrics_logger = setup_logger(__name__)
+
+    @contextmanager
+    def phase(self, name: str):
+        # Phases may be entered several times, their durations add up
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def timed_iter(self, items: Iterable, name: str):
+        # Charges the time spent producing each item (e.g. fetching pages) to a phase
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_time(name, time.perf_counter() - start)
+                return
+            self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def set_counter(self, name: str, value: float):
+        self.counters[name] = value
+
+    def set_connection_stats(self, stats: dict):
+        self.connections = stats
+
+    def set_rate_limits(self, stats: dict):
+        self.rate_limits = stats
+
+    def instrument_session(self, session: Union['requests.Session', None]):
+        if session is None:
+            return
+        session.hooks["response"].append(self._on_response)
+
+    def remove_from_session(self, session: Union['requests.Session', None]):
+        # The session outlives a transfer (batch runs, the GUI), don't keep feeding a finished report
+        if session is None:
+            return
+        session.hooks["response"] = [hook for hook in session.hooks["response"] if hook != self._on_response]
+
+    def _on_response(self, response: 'requests.Response', *args, **kwargs):
+        self.observe(response)
+
+    def observe(self, response: 'requests.Response'):
+        # Requests retried by urllib3 or the rate limiter never reach the hook, the final response counts them
+        history = getattr(getattr(response.raw, "retries", None), "history", ()) or ()
+        rate_limit_retries = getattr(response, "rate_limit_retries", 0)
+        throttled = (sum(1 for attempt in history if attempt.status == 429) + rate_limit_retries
+                     + (response.status_code == 429))
+        service = service_name(response.url)
+        endpoint = endpoint_name(response.request.method, response.url)
+        with self._lock:
+            stats = self.endpoints.setdefault(service, {}).setdefault(endpoint, EndpointStats())
+            stats.observe(response.elapsed.total_seconds(), response.status_code)
+            self.retries[service] = self.retries.get(service, 0) + len(history) + rate_limit_retries
+            self.throttled[service] = self.throttled.get(service, 0) + throttled
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "started": self.started,
+                "phases": {name: round(seconds, 6) for name, seconds in self.phases.items()},
+                "endpoints": {
+                    service: {endpoint: stats.to_dict() for endpoint, stats in sorted(endpoints.items())}
+                    for service, endpoints in self.endpoints.items()
+                },
+                "retries": dict(self.retries),
+                "throttled": dict(self.throttled),
+                "counters": dict(self.counters),
+                "connections": dict(self.connections),
+                "rate_limits": dict(self.rate_limits),
+            }
+
+    def to_prometheus(self) -> str:
+        report = self.to_dict()
+        lines = [
+            "# HELP ytm2spt_last_run_timestamp_seconds Start time of the last transfer.",
+            "# TYPE ytm2spt_last_run_timestamp_seconds gauge",
+            f"ytm2spt_last_run_timestamp_seconds {report['started']:.3f}",
+            "# HELP ytm2spt_phase_seconds Wall time spent in each phase of the last transfer.",
+            "# TYPE ytm2spt_phase_seconds gauge",
+        ]
+        lines += [f'ytm2spt_phase_seconds{{phase="{name}"}} {seconds}' for name, seconds in report["phases"].items()]
+
+        lines += [
+            "# HELP ytm2spt_http_request_duration_seconds Latency of HTTP requests by endpoint.",
+            "# TYPE ytm2spt_http_request_duration_seconds histogram",
+        ]
+        for service, endpoints in report["endpoints"].items():
+            for endpoint, stats in endpoints.items():
+                labels = f'service="{service}",endpoint="{endpoint}"'
+                cumulative = 0
+                for bound, count in stats["buckets"].items():
+                    cumulative += count
+                    lines.append(f'ytm2spt_http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"ytm2spt_http_request_duration_seconds_sum{{{labels}}} {stats['total_seconds']}")
+                lines.append(f"ytm2spt_http_request_duration_seconds_count{{{labels}}} {stats['count']}")
+
+        lines += [
+            "# HELP ytm2spt_http_errors Responses with a status of 400 or above.",
+            "# TYPE ytm2spt_http_errors gauge",
+        ]
+        for service, endpoints in report["endpoints"].items():
+            for endpoint, stats in endpoints.items():
+                lines.append(f'ytm2spt_http_errors{{service="{service}",endpoint="{endpoint}"}} {stats["errors"]}')
+
+        for name, help_text, values in (
+                ("retries", "Requests retried by the HTTP client.", report["retries"]),
+                ("throttled", "Responses with status 429.", report["throttled"])):
+            lines += [f"# HELP ytm2spt_http_{name} {help_text}", f"# TYPE ytm2spt_http_{name} gauge"]
+            lines += [f'ytm2spt_http_{name}{{service="{service}"}} {value}' for service, value in values.items()]
+
+        lines += [
+            "# HELP ytm2spt_http_pool_requests Requests sent through the shared connection pool by host.",
+            "# TYPE ytm2spt_http_pool_requests gauge",
+        ]
+        lines += [f'ytm2spt_http_pool_requests{{host="{host}"}} {stats["requests"]}'
+                  for host, stats in report["connections"].items()]
+        lines += [
+            "# HELP ytm2spt_http_pool_connections Connections opened by the shared connection pool by host.",
+            "# TYPE ytm2spt_http_pool_connections gauge",
+        ]
+        lines += [f'ytm2spt_http_pool_connections{{host="{host}"}} {stats["connections"]}'
+                  for host, stats in report["connections"].items()]
+
+        for name, help_text in (
+                ("rate", "Requests per second the rate limiter allows, absent until the first 429."),
+                ("requests", "Requests sent through the rate limiter."),
+                ("throttled", "Responses with status 429 seen by the rate limiter."),
+                ("waited_seconds", "Time requests waited for the rate limiter.")):
+            lines += [f"# HELP ytm2spt_rate_limit_{name} {help_text}", f"# TYPE ytm2spt_rate_limit_{name} gauge"]
+            lines += [f'ytm2spt_rate_limit_{name}{{bucket="{bucket}"}} {stats[name]}'
+                      for bucket, stats in report["rate_limits"].items() if stats[name] is not None]
+
+        lines += ["# HELP ytm2spt_songs Song counts of the last transfer.", "# TYPE ytm2spt_songs gauge"]
+        lines += [f'ytm2spt_songs{{kind="{name}"}} {value}' for name, value in report["counters"].items()]
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        self.metrics_logger.info(f"Wrote metrics report to {path}")
+
+    def write_prometheus(self, path: str):
+        # Written to a temporary file first, the textfile collector must never read a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temp_path, path)
+        self.metrics_logger.info(f"Wrote Prometheus metrics to {path}")
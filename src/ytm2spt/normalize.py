@@ -0,0 +1,54 @@
+import re
+import unicodedata
+
+
+# Everything from the first marker onwards is dropped: '(', '[', ',', 'feat.' or 'ft.'
+_TITLE_TAIL = re.compile(r"[(\[,]|\b(?:feat|ft)\b", re.IGNORECASE)
+# Same for artists, which are also split on ' x ' / ' × ' collaborations
+_ARTIST_TAIL = re.compile(r"[(\[,]|\b(?:feat|ft)\b|\s[x×]\s", re.IGNORECASE)
+# Spotify also names versions after a dash, e.g. "Song - Remastered 2011"
+_TRACK_NAME_TAIL = re.compile(r"[(\[,]|\b(?:feat|ft)\b|\s[-\u2013]\s", re.IGNORECASE)
+# Words of another recording or arrangement than the original, a remaster is the same song
+_VERSION_WORD = re.compile(
+    r"\b(?:remix(?:ed)?|live|acoustic|instrumental|karaoke|cover|demo|sped|slowed|reverb|nightcore|unplugged)\b",
+    re.IGNORECASE)
+_NON_WORD = re.compile(r"[\W_]+")
+# Combining diacritical mark blocks left over after NFKD decomposition
+_COMBINING = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+_APOSTROPHES = str.maketrans("", "", "'\u2019`")
+
+
+def _cut_tail(pattern: re.Pattern, text: str) -> str:
+    match = pattern.search(text)
+    if match:
+        text = text[:match.start()]
+    return text.strip()
+
+
+def clean_title(title: str) -> str:
+    return _cut_tail(_TITLE_TAIL, title)
+
+
+def clean_track_name(name: str) -> str:
+    return _cut_tail(_TRACK_NAME_TAIL, name)
+
+
+def version_words(text: str) -> set:
+    return {word.casefold() for word in _VERSION_WORD.findall(text)}
+
+
+def clean_artist(artist: str) -> str:
+    return _cut_tail(_ARTIST_TAIL, artist)
+
+
+def fold(text: str) -> str:
+    # Casefold, strip accents and collapse punctuation/whitespace into single spaces
+    text = text.casefold().translate(_APOSTROPHES)
+    if not text.isascii():
+        text = _COMBINING.sub("", unicodedata.normalize("NFKD", text))
+    return _NON_WORD.sub(" ", text).strip()
+
+
+def normalized_key(artist: str, title: str) -> str:
+    # Stable key for the same song across runs, used by the match cache and deduplication
+    return f"{fold(clean_artist(artist))}\t{fold(clean_title(title))}"
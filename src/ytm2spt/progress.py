@@ -0,0 +1,162 @@
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Union
+
+
+# Shortest time between two redraws of the CLI progress bar
+REDRAW_INTERVAL = 0.1
+BAR_WIDTH = 30
+
+
+class TransferCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    # Set from any thread; the transfer checks it between songs and after every written chunk
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise TransferCancelled("Transfer was stopped")
+
+
+@dataclass
+class ProgressEvent:
+    # kind is "resolved", "missing", "added", "failed" or "done" (the end of a stage).
+    # stage is "resolve" while songs are searched and "write" while they are added,
+    # done and total count songs of that stage (total is None while it is unknown).
+    kind: str
+    stage: str
+    done: int
+    total: Union[int, None]
+    found: int
+    missing: int
+    added: int
+    failed: int
+    rate: float = 0.0
+    eta: Union[float, None] = None
+    position: Union[int, None] = None
+    song: object = None
+    uri: Union[str, None] = None
+
+
+class ProgressTracker:
+    # Counts songs as they are resolved and written and reports every step to `callback`,
+    # with the throughput of the current stage (songs per second) and its ETA in seconds.
+    # Songs are resolved on worker threads, so updates are serialized.
+
+    def __init__(self, callback: Callable[[ProgressEvent], None]):
+        self.callback = callback
+        self.total = None
+        self.found = 0
+        self.missing = 0
+        self.added = 0
+        self.failed = 0
+        self.stage = "resolve"
+        self.stage_done = 0
+        self.stage_total = None
+        self.stage_start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def set_total(self, total: Union[int, None]):
+        with self._lock:
+            self.total = total
+            if self.stage == "resolve":
+                self.stage_total = total
+
+    def _emit(self, kind: str, **fields):
+        elapsed = time.perf_counter() - self.stage_start
+        rate = self.stage_done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.stage_total is not None and rate > 0:
+            eta = max(0, self.stage_total - self.stage_done) / rate
+        self.callback(ProgressEvent(
+            kind, self.stage, self.stage_done, self.stage_total, self.found, self.missing, self.added,
+            self.failed, rate, eta, **fields))
+
+    def resolved(self, position: int, song, uri: Union[str, None]):
+        with self._lock:
+            self.stage_done += 1
+            if uri:
+                self.found += 1
+            else:
+                self.missing += 1
+            self._emit("resolved" if uri else "missing", position=position, song=song, uri=uri)
+
+    def start_writing(self, total: int, done: int = 0):
+        with self._lock:
+            self.stage = "write"
+            self.stage_total = total
+            self.stage_done = done
+            self.stage_start = time.perf_counter()
+
+    def written(self, added: list, failed: list = ()):
+        with self._lock:
+            for uri in added:
+                self.stage_done += 1
+                self.added += 1
+                self._emit("added", uri=uri)
+            for uri in failed:
+                self.stage_done += 1
+                self.failed += 1
+                self._emit("failed", uri=uri)
+
+    def finish(self):
+        with self._lock:
+            self.stage_total = self.stage_done
+            self._emit("done")
+
+
+class ProgressBar:
+    # Progress of the current stage on one terminal line, redrawn at most every REDRAW_INTERVAL
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stderr
+        self._last_draw = 0.0
+        self._stage = None
+
+    def __call__(self, event: ProgressEvent):
+        now = time.perf_counter()
+        if event.kind != "done" and event.stage == self._stage and now - self._last_draw < REDRAW_INTERVAL:
+            return
+        if self._stage and event.stage != self._stage:
+            self.stream.write("\n")
+        self._stage = event.stage
+        self._last_draw = now
+        self.stream.write(f"\r{format_progress(event)}")
+        if event.kind == "done":
+            self.stream.write("\n")
+            self._stage = None
+        self.stream.flush()
+
+
+def format_eta(seconds: Union[float, None]) -> str:
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+
+def format_progress(event: ProgressEvent) -> str:
+    label = "Searching" if event.stage == "resolve" else "Adding"
+    if event.total:
+        filled = min(BAR_WIDTH, BAR_WIDTH * event.done // event.total)
+        bar = f"[{'#' * filled}{'.' * (BAR_WIDTH - filled)}] {event.done}/{event.total}"
+    else:
+        bar = f"{event.done}"
+    if event.stage == "resolve":
+        counts = f"{event.found} found, {event.missing} missing"
+    else:
+        counts = f"{event.added} added, {event.failed} failed"
+    return f"{label} {bar} songs ({counts}) {event.rate:.1f} songs/s ETA {format_eta(event.eta)}"
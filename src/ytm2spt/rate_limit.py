@@ -0,0 +1,149 @@
+import threading
+import time
+from typing import Union
+from urllib.parse import urlparse
+from .app_logger import setup_logger
+
+
+# Requests are paced per bucket. Spotify doesn't publish its limits, so a bucket is unpaced until
+# its first 429 and then starts from the rate it was sending at.
+BUCKETS = ("search", "write", "read", "youtube")
+MIN_RATE = 0.5
+# AIMD: each successful request adds INCREASE / rate (about INCREASE per second at full pace),
+# a 429 multiplies the rate by DECREASE, at most once per DECREASE_INTERVAL seconds.
+# The rate doesn't grow past MAX_HEADROOM times the rate requests are actually sent at.
+INCREASE = 1.0
+DECREASE = 0.85
+DECREASE_INTERVAL = 1.0
+MAX_HEADROOM = 2.0
+# Seconds worth of requests a paced bucket may send at once
+BURST = 0.1
+# Wait after a 429 without Retry-After, and the longest Retry-After that is waited out
+DEFAULT_RETRY_AFTER = 1.0
+MAX_RETRY_AFTER = 60.0
+
+rate_limit_logger = setup_logger(__name__)
+
+
+def bucket_name(method: str, url: str) -> Union[str, None]:
+    # Spotify Web API calls by kind and YouTube Music calls, anything else (tokens, thumbnails) is not paced
+    parsed = urlparse(url)
+    host = parsed.hostname or ""
+    if host == "music.youtube.com" or parsed.path.startswith("/youtubei/"):
+        return "youtube"
+    if not parsed.path.startswith("/v1/") or host == "accounts.spotify.com":
+        return None
+    if parsed.path.startswith("/v1/search"):
+        return "search"
+    return "read" if method in ("GET", "HEAD") else "write"
+
+
+def parse_retry_after(value: Union[str, None]) -> Union[float, None]:
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate: Union[float, None] = None, min_rate: float = MIN_RATE):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.sent_rate = 0.0
+        self.window_start = None
+        self.window_requests = 0
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    def _take(self, now: float) -> float:
+        # Returns 0 if the request may be sent now, otherwise how long to wait before trying again
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.rate is not None:
+            self.tokens = min(max(1.0, self.rate * BURST), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+        self.requests += 1
+        self.window_requests += 1
+        if self.window_start is None:
+            self.window_start = now
+        elif now - self.window_start >= 1:
+            self.sent_rate = self.window_requests / (now - self.window_start)
+            self.window_start = now
+            self.window_requests = 0
+        return 0.0
+
+    def _sent(self, now: float) -> float:
+        # Requests per second sent over the last full second, or so far if there wasn't one yet
+        if self.sent_rate or self.window_start is None:
+            return self.sent_rate
+        return self.window_requests / max(now - self.window_start, 0.1)
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self._lock:
+                wait = self._take(time.monotonic())
+                if not wait:
+                    self.waited += waited
+                    return
+            time.sleep(wait)
+            waited += wait
+
+    def on_success(self):
+        with self._lock:
+            if self.rate is not None:
+                ceiling = max(self.min_rate, self._sent(time.monotonic()) * MAX_HEADROOM)
+                self.rate = max(self.min_rate, min(ceiling, self.rate + INCREASE / self.rate))
+
+    def on_throttled(self, retry_after: Union[float, None]):
+        # Every request of the bucket waits out Retry-After, not only the one that got the 429.
+        # "Retry-After: 0" asks for a retry, not for a lower rate.
+        with self._lock:
+            now = time.monotonic()
+            self.throttled += 1
+            if retry_after == 0:
+                return
+            self.blocked_until = max(self.blocked_until, now + (DEFAULT_RETRY_AFTER if retry_after is None else retry_after))
+            self.tokens = 0.0
+            self.updated = self.blocked_until
+            if now - self.last_decrease >= DECREASE_INTERVAL:
+                current = self.rate if self.rate is not None else self._sent(now)
+                self.rate = max(self.min_rate, current * DECREASE)
+                self.last_decrease = now
+
+    def stats(self) -> dict:
+        with self._lock:
+            rate = round(self.rate, 3) if self.rate is not None else None
+            return {"rate": rate, "requests": self.requests, "throttled": self.throttled,
+                    "waited_seconds": round(self.waited, 3)}
+
+
+class RateLimiter:
+    # One per session, shared by every thread that sends Spotify and YouTube Music requests.
+    # `rates` sets a starting rate per bucket, e.g. a limit known from earlier runs.
+    def __init__(self, rates: dict = None):
+        rates = rates or {}
+        self.buckets = {name: TokenBucket(rates.get(name)) for name in BUCKETS}
+
+    def bucket(self, method: str, url: str) -> Union[TokenBucket, None]:
+        return self.buckets.get(bucket_name(method, url))
+
+    def stats(self) -> dict:
+        return {name: bucket.stats() for name, bucket in self.buckets.items()}
+
+    def log_throttled(self, method: str, url: str, retry_after: Union[float, None]):
+        bucket = bucket_name(method, url)
+        rate = self.buckets[bucket].rate
+        rate_limit_logger.debug(
+            "429 on %s %s, %s bucket waits %.1fs then sends %s",
+            method, url, bucket, DEFAULT_RETRY_AFTER if retry_after is None else retry_after,
+            "unpaced" if rate is None else f"{rate:.2f} requests/s")
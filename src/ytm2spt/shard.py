@@ -0,0 +1,564 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import sys
+import time
+import tomllib
+from contextlib import contextmanager
+from typing import Callable, Union
+from .app_logger import PrefixedLogger, setup_logger
+from .metrics import Metrics
+from .normalize import normalized_key
+from .progress import ProgressTracker
+from .transfer import (Transferer, TransferItem, TransferResult, get_youtube_playlist_id, resolve_songs,
+                       set_yt_thumbnail_as_sp_cover)
+from .utils import Candidate, Match, MIN_CONFIDENCE
+
+
+# SQLite queue of song chunks shared by the coordinator and its workers, kept to resume an interrupted run
+QUEUE_PATH = ".ytm2spt_queue.sqlite"
+DEFAULT_WORKERS = 4
+DEFAULT_CHUNK_SIZE = 200
+# A chunk whose claim was not refreshed for this long is handed to another worker, its worker is assumed dead
+CLAIM_TIMEOUT = 600
+# Workers refresh their claim at most this often (seconds) while songs of the chunk get resolved
+HEARTBEAT_INTERVAL = 10
+# A chunk that failed this many times is given up, its songs count as not found
+MAX_ATTEMPTS = 3
+# Seconds between two looks at the queue, of the coordinator and of workers waiting for claimed chunks
+POLL_INTERVAL = 0.5
+
+shard_logger = setup_logger(__name__)
+
+
+def song_to_row(key: str, song) -> list:
+    return [key, song.artist, song.title, song.duration, song.video_id]
+
+
+def match_to_row(match: Match) -> list:
+    return [match.uri, match.confidence, [list(candidate) for candidate in match.candidates]]
+
+
+def row_to_match(row: list) -> Match:
+    uri, confidence, candidates = row
+    return Match(uri, confidence, tuple(Candidate(*candidate) for candidate in candidates))
+
+
+class JobQueue:
+    # Chunks of distinct songs in SQLite, shared by the coordinator and the workers of one machine.
+    # Claims hold the write lock (BEGIN IMMEDIATE), so two workers never get the same chunk.
+
+    def __init__(self, path: str = QUEUE_PATH):
+        self.path = path
+        # Heartbeats come from the threads resolving songs, one at a time while the worker waits for them
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "id INTEGER PRIMARY KEY, songs TEXT NOT NULL, state TEXT NOT NULL DEFAULT 'pending', "
+            "worker TEXT, claimed REAL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "matches TEXT, searches INTEGER, error TEXT)"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    @contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def reset(self, chunks: list, settings: dict):
+        # Replaces whatever was queued before, `chunks` are lists of song rows
+        with self._transaction():
+            self._db.execute("DELETE FROM chunks")
+            self._db.execute("DELETE FROM settings")
+            self._db.executemany(
+                "INSERT INTO chunks (id, songs) VALUES (?, ?)",
+                ((chunk_id, json.dumps(chunk)) for chunk_id, chunk in enumerate(chunks)))
+            self._db.executemany(
+                "INSERT INTO settings (key, value) VALUES (?, ?)",
+                ((key, json.dumps(value)) for key, value in settings.items()))
+
+    def requeue(self, stale_after: float):
+        # For a resumed queue: chunks given up on get MAX_ATTEMPTS more tries, and claims without a
+        # heartbeat for `stale_after` seconds (of workers that were stopped with it) go back to pending
+        with self._transaction():
+            self._db.execute(
+                "UPDATE chunks SET state = 'pending', worker = NULL, attempts = 0 "
+                "WHERE state = 'failed' OR (state = 'claimed' AND claimed < ?)", (time.time() - stale_after,))
+
+    def settings(self) -> dict:
+        return {key: json.loads(value) for key, value in self._db.execute("SELECT key, value FROM settings")}
+
+    def claim(self, worker: str) -> Union[tuple, None]:
+        # Returns (chunk ID, song rows) of the first chunk that is pending or whose claim timed out
+        now = time.time()
+        with self._transaction():
+            self._db.execute(
+                "UPDATE chunks SET state = 'failed', error = 'Claim timed out' "
+                "WHERE state = 'claimed' AND claimed < ? AND attempts >= ?", (now - CLAIM_TIMEOUT, MAX_ATTEMPTS))
+            row = self._db.execute(
+                "SELECT id, songs FROM chunks WHERE state = 'pending' OR (state = 'claimed' AND claimed < ?) "
+                "ORDER BY id LIMIT 1", (now - CLAIM_TIMEOUT,)).fetchone()
+            if row:
+                self._db.execute(
+                    "UPDATE chunks SET state = 'claimed', worker = ?, claimed = ?, attempts = attempts + 1 "
+                    "WHERE id = ?", (worker, now, row[0]))
+        return (row[0], json.loads(row[1])) if row else None
+
+    def heartbeat(self, chunk_id: int, worker: str) -> bool:
+        # Refreshes the claim, returns False when the chunk was handed to another worker
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE chunks SET claimed = ? WHERE id = ? AND worker = ? AND state = 'claimed'",
+                (time.time(), chunk_id, worker))
+        return cursor.rowcount > 0
+
+    def complete(self, chunk_id: int, matches: list, searches: int, worker: str) -> bool:
+        # Only the worker holding the claim completes the chunk, returns False otherwise
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE chunks SET state = 'done', matches = ?, searches = ?, error = NULL "
+                "WHERE id = ? AND worker = ? AND state != 'done'",
+                (json.dumps([match_to_row(match) for match in matches]), searches, chunk_id, worker))
+        return cursor.rowcount > 0
+
+    def release(self, chunk_id: int, error: str, worker: str):
+        # Back to pending for another try, or failed once it was tried MAX_ATTEMPTS times
+        with self._transaction():
+            self._db.execute(
+                "UPDATE chunks SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ? "
+                "WHERE id = ? AND worker = ? AND state = 'claimed'", (MAX_ATTEMPTS, error, chunk_id, worker))
+
+    def counts(self) -> dict:
+        return dict(self._db.execute("SELECT state, COUNT(*) FROM chunks GROUP BY state").fetchall())
+
+    def finished(self) -> bool:
+        counts = self.counts()
+        return not counts.get("pending") and not counts.get("claimed")
+
+    def results(self) -> tuple:
+        # Matches by song key, searches made for them and the errors of the chunks given up on
+        matches = {}
+        searches = 0
+        errors = []
+        for chunk_id, songs, state, chunk_matches, chunk_searches, error in self._db.execute(
+                "SELECT id, songs, state, matches, searches, error FROM chunks ORDER BY id"):
+            if state != "done":
+                errors.append(f"chunk {chunk_id}: {error}")
+                continue
+            for song, match in zip(json.loads(songs), json.loads(chunk_matches)):
+                matches[song[0]] = row_to_match(match)
+            searches += chunk_searches or 0
+        return matches, searches, errors
+
+    def close(self):
+        self._db.close()
+
+
+def run_worker(queue_path: str = QUEUE_PATH, worker_id: str = None, credentials: dict = None, jobs: int = 1,
+               use_cache: bool = True) -> int:
+    # Claims and resolves chunks until the queue is done, returns how many chunks it resolved.
+    # Workers only search, so they authenticate as the app alone; `credentials` (SPOTIFY_CLIENT_ID
+    # and SPOTIFY_CLIENT_SECRET) search with another Spotify app and its own rate limit.
+    from .youtube import Song
+    worker_id = worker_id or f"worker-{os.getpid()}"
+    worker_logger = PrefixedLogger(shard_logger, {"prefix": worker_id})
+    if credentials:
+        os.environ.update(credentials)
+    queue = JobQueue(queue_path)
+    min_confidence = queue.settings().get("min_confidence", MIN_CONFIDENCE)
+    transferer = Transferer.create(jobs=jobs, use_cache=use_cache, min_confidence=min_confidence, app_only=True)
+    resolved_chunks = 0
+    chunk_id = None
+    last_heartbeat = 0.0
+
+    def heartbeat(event):
+        # Called once per resolved song, the claim is refreshed every HEARTBEAT_INTERVAL
+        nonlocal last_heartbeat
+        if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+            last_heartbeat = time.monotonic()
+            if not queue.heartbeat(chunk_id, worker_id):
+                worker_logger.warning(f"Chunk {chunk_id} was handed to another worker")
+
+    try:
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                if queue.finished():
+                    worker_logger.info(f"Queue is done, resolved {resolved_chunks} chunks")
+                    return resolved_chunks
+                time.sleep(POLL_INTERVAL)
+                continue
+            chunk_id, rows = job
+            last_heartbeat = time.monotonic()
+            sp = transferer.sp.clone()
+            try:
+                resolved, _ = resolve_songs(sp, [Song(*row[1:]) for row in rows], jobs,
+                                            progress=ProgressTracker(heartbeat))
+            except Exception as e:
+                worker_logger.error(f"Chunk {chunk_id} failed: {e}")
+                queue.release(chunk_id, str(e) or type(e).__name__, worker_id)
+                continue
+            if not queue.complete(chunk_id, [match for _, match in resolved], sp.search_count, worker_id):
+                worker_logger.warning(f"Dropped chunk {chunk_id}, another worker resolved it")
+                continue
+            resolved_chunks += 1
+            worker_logger.info(f"Resolved chunk {chunk_id}: {len(rows)} songs, {sp.search_count} searches")
+    finally:
+        transferer.close()
+        queue.close()
+
+
+def _local_worker(*args):
+    # Ctrl+C is handled by the coordinator, which stops its workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    run_worker(*args)
+
+
+def load_credentials(path: str) -> list:
+    # One [[app]] table per Spotify app with client_id and client_secret, handed to the workers in turn
+    with open(path, "rb") as f:
+        apps = tomllib.load(f).get("app", [])
+    if not apps:
+        raise ValueError(f"No [[app]] entries in {path}")
+    return [{"SPOTIFY_CLIENT_ID": app["client_id"], "SPOTIFY_CLIENT_SECRET": app["client_secret"]} for app in apps]
+
+
+def wait_for_workers(queue: JobQueue, workers: int, jobs: int = 1, use_cache: bool = True, credentials: list = None,
+                     worker_target: Callable = None):
+    # Starts `workers` local processes and waits until every chunk is resolved or given up on.
+    # Without local workers it waits for ones started with `ytm2spt worker`.
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for i in range(workers):
+        app = credentials[i % len(credentials)] if credentials else None
+        process = context.Process(target=worker_target or _local_worker, name=f"ytm2spt-worker-{i + 1}",
+                                  args=(queue.path, f"worker-{i + 1}", app, jobs, use_cache))
+        process.start()
+        processes.append(process)
+    if not processes:
+        shard_logger.info(f"Waiting for workers, start them with: ytm2spt worker {queue.path}")
+
+    total = sum(queue.counts().values())
+    last_done = None
+    try:
+        while not queue.finished():
+            if processes and not any(process.is_alive() for process in processes):
+                raise RuntimeError("Every worker exited before the queue was done")
+            done = queue.counts().get("done", 0)
+            if done != last_done:
+                shard_logger.info(f"Resolved {done} of {total} chunks")
+                last_done = done
+            time.sleep(POLL_INTERVAL)
+    finally:
+        for process in processes:
+            process.join(timeout=POLL_INTERVAL * 4)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def run_sharded(youtube_arg: str, spotify_arg: str = None, spotify_playlist_name: str = None,
+                youtube_oauth: str = None, dryrun: bool = False, create_new: bool = False, limit: int = None,
+                diff_sync: bool = False, workers: int = DEFAULT_WORKERS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                jobs: int = 1, use_cache: bool = True, min_confidence: float = MIN_CONFIDENCE,
+                queue_path: str = QUEUE_PATH, credentials: list = None, manifest_path: str = None,
+                metrics: Metrics = None, worker_target: Callable = None, reset: bool = False) -> TransferResult:
+    # The coordinator fetches the Youtube playlist and queues its distinct songs in chunks. Worker
+    # processes resolve them independently, then the coordinator writes the playlist in order.
+    # A queue left by an interrupted run for the same songs and settings is resumed, unless `reset`.
+    transferer = Transferer.create(youtube_oauth, jobs, use_cache, min_confidence=min_confidence)
+    metrics = metrics or Metrics()
+    youtube_id = get_youtube_playlist_id(youtube_arg)
+    yt = transferer.yt.clone()
+    try:
+        with metrics.phase("fetch"):
+            yt.set_playlist_id(youtube_id, limit)
+            songs = yt.get_songs_from_playlist(limit)
+        shard_logger.info(f"Youtube Playlist Name: {yt.get_playlist_title()} ({len(songs)} songs)")
+
+        keys = []
+        distinct = {}
+        with metrics.phase("normalize"):
+            for song in songs:
+                key = normalized_key(song.artist, song.title)
+                keys.append(key)
+                if key not in distinct:
+                    distinct[key] = song_to_row(key, song)
+        rows = list(distinct.values())
+        chunks = [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+        settings = {"youtube_id": youtube_id, "min_confidence": min_confidence,
+                    "chunks": hashlib.sha1(json.dumps(chunks).encode()).hexdigest()}
+        queue = JobQueue(queue_path)
+        try:
+            if not reset and queue.settings() == settings:
+                queue.requeue(HEARTBEAT_INTERVAL * 3)
+                shard_logger.info(f"Resuming the queue: {queue.counts().get('done', 0)} of {len(chunks)} chunks "
+                                  f"already resolved")
+            else:
+                queue.reset(chunks, settings)
+                shard_logger.info(f"Queued {len(rows)} distinct songs in {len(chunks)} chunks for {workers} workers")
+            with metrics.phase("resolve"):
+                wait_for_workers(queue, workers, jobs, use_cache, credentials, worker_target)
+            matches, searches, errors = queue.results()
+        finally:
+            queue.close()
+        for error in errors:
+            shard_logger.error(f"Gave up on {error}")
+
+        items = [TransferItem(position, song, matches.get(key, Match(None, 0.0)))
+                 for position, (key, song) in enumerate(zip(keys, songs), start=1)]
+        for item in items:
+            if not item.match.uri:
+                shard_logger.error("%s - %s was not found!", item.song.artist, item.song.title)
+        shard_logger.info(f"Made {searches} searches for {len(songs)} songs, "
+                          f"skipped {len(songs) - len(rows)} lookups for duplicate songs")
+        metrics.set_counter("searches", searches)
+        metrics.set_counter("lookups_saved", len(songs) - len(rows))
+        if manifest_path:
+            from .match_manifest import write_match_manifest
+            write_match_manifest(manifest_path, items)
+            shard_logger.info(f"Wrote {len(items)} matches to {manifest_path}")
+
+        if not (spotify_arg or spotify_playlist_name):
+            spotify_playlist_name = yt.get_playlist_title()
+        result = transferer.apply_matches(items, spotify_arg=spotify_arg, spotify_playlist_name=spotify_playlist_name,
+                                          dryrun=dryrun, create_new=create_new, diff_sync=diff_sync, metrics=metrics,
+                                          youtube_id=youtube_id)
+        result.youtube_title = yt.get_playlist_title()
+        if not dryrun:
+            sp = transferer.sp.clone()
+            sp.set_playlist_id(result.spotify_id)
+            try:
+                with metrics.phase("cover"):
+                    set_yt_thumbnail_as_sp_cover(yt, sp)
+            except Exception as e:
+                shard_logger.warning(str(e))
+        return result
+    finally:
+        transferer.close(metrics)
+
+
+def get_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="ytm2spt shard",
+        description="Transfer a large playlist with several worker processes sharing a local job queue",
+    )
+    parser.add_argument(
+        "-yt",
+        "--youtube-url-or-id",
+        type=str,
+        default=None,
+        required=True,
+        help="Youtube Playlist URL or ID",
+    )
+    sp_group = parser.add_mutually_exclusive_group(required=False)
+    sp_group.add_argument(
+        "-sp",
+        "--spotify-url-or-id",
+        type=str,
+        default=None,
+        help="Spotify Playlist URL or ID",
+    )
+    sp_group.add_argument(
+        "-spname",
+        "--spotify-playlist-name",
+        type=str,
+        default=None,
+        help="Spotify Playlist Name (Default: Youtube Playlist Name)",
+    )
+    parser.add_argument(
+        "-ytauth",
+        "--youtube-oauth-json",
+        type=str,
+        default=None,
+        required=False,
+        help="Youtube OAuth JSON filepath (run 'ytmusicapi-oauth')"
+    )
+    run_group = parser.add_mutually_exclusive_group(required=False)
+    run_group.add_argument(
+        "-n",
+        "--create-new",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Force create a new playlist",
+    )
+    run_group.add_argument(
+        "-d",
+        "--dryrun",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Do not add to Spotify",
+    )
+    parser.add_argument(
+        "-l",
+        "--limit",
+        type=int,
+        default=None,
+        required=False,
+        help="Limit the number of songs to fetch",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        required=False,
+        help=f"Number of local worker processes, 0 to only use workers started with 'ytm2spt worker' \
+            (Default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of songs each worker searches in parallel (Default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        required=False,
+        help=f"Songs per queued chunk (Default: {DEFAULT_CHUNK_SIZE})",
+    )
+    parser.add_argument(
+        "--credentials",
+        type=str,
+        default=None,
+        required=False,
+        help="TOML file with [[app]] entries (client_id, client_secret), the workers search with them in turn",
+    )
+    parser.add_argument(
+        "--queue",
+        type=str,
+        default=QUEUE_PATH,
+        required=False,
+        help=f"SQLite file of the job queue (Default: {QUEUE_PATH})",
+    )
+    parser.add_argument(
+        "--reset",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Queue every song again instead of resuming the chunks an interrupted run resolved",
+    )
+    parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=MIN_CONFIDENCE,
+        required=False,
+        help=f"Minimum match score (0-100) for a Spotify track to be used (Default: {MIN_CONFIDENCE})",
+    )
+    parser.add_argument(
+        "--diff",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Only add, remove and reorder the songs that changed \
+            instead of emptying an existing playlist",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Do not read or write the local match and cover cache, the playlist cover is then uploaded on every run",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default=None,
+        required=False,
+        help="Write every song with its Spotify match to this match manifest (JSON lines, or CSV if it ends in .csv)",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=str,
+        default=None,
+        required=False,
+        help="Write per-phase timings and the coordinator's HTTP request metrics as JSON to this file",
+    )
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error("--workers must not be negative")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.chunk_size < 1:
+        parser.error("--chunk-size must be at least 1")
+    return args
+
+
+def main(argv: list = None):
+    args = get_args(sys.argv[1:] if argv is None else argv)
+    metrics = Metrics()
+    run_sharded(
+        args.youtube_url_or_id, args.spotify_url_or_id, args.spotify_playlist_name, args.youtube_oauth_json,
+        args.dryrun, args.create_new, args.limit, args.diff, args.workers, args.chunk_size, args.jobs,
+        not args.no_cache, args.min_confidence, args.queue,
+        load_credentials(args.credentials) if args.credentials else None, args.manifest, metrics,
+        reset=args.reset,
+    )
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json)
+
+
+def get_worker_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="ytm2spt worker",
+        description="Resolve songs queued by 'ytm2spt shard', e.g. with the Spotify app in this environment",
+    )
+    parser.add_argument(
+        "queue",
+        type=str,
+        nargs="?",
+        default=QUEUE_PATH,
+        help=f"SQLite file of the job queue (Default: {QUEUE_PATH})",
+    )
+    parser.add_argument(
+        "--id",
+        type=str,
+        default=None,
+        required=False,
+        help="Name of this worker in the queue and the logs (Default: worker-<pid>)",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        required=False,
+        help="Number of songs to search in parallel (Default: 1)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Do not read or write the local match cache",
+    )
+    args = parser.parse_args(argv)
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def worker_main(argv: list = None):
+    args = get_worker_args(sys.argv[1:] if argv is None else argv)
+    run_worker(args.queue, args.id, jobs=args.jobs, use_cache=not args.no_cache)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,125 @@
 import platform
 import spotipy
-from spotipy.oauth2 import SpotifyOAuth
+from spotipy.cache_handler import MemoryCacheHandler
+from spotipy.oauth2 import SpotifyClientCredentials, SpotifyOAuth
 from spotipy.exceptions import SpotifyException
+import copy
 import os
-from .app_logger import setup_logger
-from .utils import fuzzy_match_artist, artist_names_from_tracks
-from typing import Union
+import requests
+import threading
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from .app_logger import setup_logger, truncate
+from .utils import Match, MIN_CONFIDENCE, select_best_candidate, top_candidates
+from .cache import MatchCache
+from .http_session import DEFAULT_TIMEOUT, build_session
+from typing import Callable, Iterator, Union
 from datetime import datetime
 
 
+# Maximum number of items accepted by a single playlist write request
+MAX_PLAYLIST_ITEMS_PER_REQUEST = 100
+# Largest page sizes accepted by the playlist items and user playlists endpoints
+PLAYLIST_ITEMS_PAGE_SIZE = 100
+USER_PLAYLISTS_PAGE_SIZE = 50
+# Search queries tried in order, from the most precise to the loosest, with their result limit
+SEARCH_TIERS = (
+    ('track:"{title}" artist:"{artist}"', 5),
+    ('{title} {artist}', 10),
+    ('track:"{title}"', 10),
+)
+# Stop trying looser queries once a candidate scores at least this much
+CONFIDENT_MATCH = 85
+
+
+def longest_increasing_subsequence(values: 'list') -> 'set':
+    tails = []
+    tail_indices = []
+    previous = [-1] * len(values)
+    for i, value in enumerate(values):
+        pos = bisect_left(tails, value)
+        if pos == len(tails):
+            tails.append(value)
+            tail_indices.append(i)
+        else:
+            tails[pos] = value
+            tail_indices[pos] = i
+        previous[i] = tail_indices[pos - 1] if pos > 0 else -1
+    result = set()
+    i = tail_indices[-1] if tail_indices else -1
+    while i != -1:
+        result.add(values[i])
+        i = previous[i]
+    return result
+
+
+class SlotCounter:
+    # Fenwick tree of item counts per slot, counts the items before a slot in O(log n)
+    def __init__(self, size: int):
+        self.tree = [0] * (size + 1)
+
+    def add(self, slot: int, count: int = 1) -> None:
+        slot += 1
+        while slot < len(self.tree):
+            self.tree[slot] += count
+            slot += slot & -slot
+
+    def before(self, slot: int) -> int:
+        total = 0
+        while slot > 0:
+            total += self.tree[slot]
+            slot -= slot & -slot
+        return total
+
+
+def plan_playlist_sync(current: 'list', total: int) -> 'list':
+    # `current` holds the target index of every kept item, in playlist order, after the removals.
+    # Returns ("move", range_start, range_length, insert_before) and ("add", index, count, position)
+    # operations that turn the playlist into target indices 0..total-1. The longest run already
+    # in order stays put and everything else is moved or added next to the item before it.
+    stable = longest_increasing_subsequence(current)
+    # Slot 0 is the start of the playlist, kept items take slots 1..n in their current order.
+    # Items moved or added behind an item that stays put share its slot, so the position of
+    # anything is the number of items in `placed` and `unplaced` with a lower slot.
+    slot_of = {index: slot for slot, index in enumerate(current, start=1)}
+    placed = SlotCounter(len(current) + 1)
+    unplaced = SlotCounter(len(current) + 1)
+    for slot in range(1, len(current) + 1):
+        unplaced.add(slot)
+
+    operations = []
+    anchor = 0
+    index = 0
+    while index < total:
+        # Every index before `index` is placed, right after them is where the next item goes
+        position = index + unplaced.before(anchor)
+        slot = slot_of.get(index)
+        if slot is None:
+            end = index
+            while end < total and end not in slot_of and end - index < MAX_PLAYLIST_ITEMS_PER_REQUEST:
+                end += 1
+            operations.append(("add", index, end - index, position))
+            placed.add(anchor, end - index)
+        elif index in stable:
+            unplaced.add(slot, -1)
+            placed.add(slot)
+            anchor = slot
+            end = index + 1
+        else:
+            # Items that are next to each other and in order move together
+            end = index + 1
+            while end < total and end not in stable and slot_of.get(end) == slot + end - index:
+                end += 1
+            range_start = placed.before(slot) + unplaced.before(slot)
+            if range_start != position:
+                operations.append(("move", range_start, end - index, position))
+            for moved_slot in range(slot, slot + end - index):
+                unplaced.add(moved_slot, -1)
+            placed.add(anchor, end - index)
+        index = end
+    return operations
+
+
 def generate_description() -> str:
     isodate = datetime.now().strftime("%b %d, %Y") # example: Jun 30, 2021
     github = "github.com/abhishekmj303/ytm2spt"
@@ -17,35 +128,74 @@ def generate_description() -> str:
 
 
 class Spotify:
-    def __init__(self):
-        self.user_id = os.environ["SPOTIFY_USER_ID"]
-        open_browser = True
-        if platform.system() == "Linux" and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
-            open_browser = False
-        self.spotify = spotipy.Spotify(auth_manager=SpotifyOAuth(
-            client_id=os.environ['SPOTIFY_CLIENT_ID'],
-            client_secret=os.environ['SPOTIFY_CLIENT_SECRET'],
-            redirect_uri=os.environ['SPOTIFY_REDIRECT_URI'],
-            scope='playlist-read-collaborative playlist-modify-private playlist-modify-public playlist-read-private ugc-image-upload',
-            open_browser=open_browser,
-            cache_path=".spotipy_cache",
-        ))
+    def __init__(self, match_cache: Union[MatchCache, None] = None, min_confidence: float = MIN_CONFIDENCE,
+                 session: Union[requests.Session, None] = None, app_only: bool = False):
+        # `app_only` authenticates the app alone (client credentials), enough to search but not to
+        # touch playlists. The token is kept in memory, so several apps can run side by side.
+        self.user_id = os.environ.get("SPOTIFY_USER_ID") if app_only else os.environ["SPOTIFY_USER_ID"]
+        self.session = session or build_session()
+        if app_only:
+            auth_manager = SpotifyClientCredentials(
+                client_id=os.environ['SPOTIFY_CLIENT_ID'],
+                client_secret=os.environ['SPOTIFY_CLIENT_SECRET'],
+                requests_session=self.session,
+                requests_timeout=DEFAULT_TIMEOUT,
+                cache_handler=MemoryCacheHandler(),
+            )
+        else:
+            open_browser = True
+            if platform.system() == "Linux" and not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY")):
+                open_browser = False
+            auth_manager = SpotifyOAuth(
+                client_id=os.environ['SPOTIFY_CLIENT_ID'],
+                client_secret=os.environ['SPOTIFY_CLIENT_SECRET'],
+                redirect_uri=os.environ['SPOTIFY_REDIRECT_URI'],
+                scope='playlist-read-collaborative playlist-modify-private playlist-modify-public playlist-read-private ugc-image-upload',
+                open_browser=open_browser,
+                cache_path=".spotipy_cache",
+                requests_session=self.session,
+                requests_timeout=DEFAULT_TIMEOUT,
+            )
+        self.spotify = spotipy.Spotify(auth_manager=auth_manager, requests_session=self.session,
+                                       requests_timeout=DEFAULT_TIMEOUT)
         self.playlist_id = ""
+        self.match_cache = match_cache
+        self.min_confidence = min_confidence
+        self.search_count = 0
+        self._search_count_lock = threading.Lock()
         self.spotify_logger = setup_logger(__name__)
-        # print(self.spotify.token)
+
+    def clone(self) -> 'Spotify':
+        # Shares the authenticated spotipy client, session and match cache, with its own playlist state
+        clone = copy.copy(self)
+        clone.playlist_id = ""
+        clone.search_count = 0
+        clone._search_count_lock = threading.Lock()
+        return clone
     
     def set_playlist_id(self, playlist_id: str):
         self.playlist_id = playlist_id
-        self.spotify_logger.debug(f"Set Playlist ID: {self.playlist_id}")
+        self.spotify_logger.debug("Set Playlist ID: %s", self.playlist_id)
     
+    def _iter_pages(self, results: 'dict') -> Iterator['dict']:
+        while results:
+            yield results
+            results = self.spotify.next(results) if results.get("next") else None
+
+    def iter_user_playlists(self, page_size: int = USER_PLAYLISTS_PAGE_SIZE) -> Iterator['dict']:
+        results = self.spotify.user_playlists(self.user_id, limit=page_size)
+        for page in self._iter_pages(results):
+            self.spotify_logger.debug("Got %d User's Playlists at offset %s", len(page['items']), page['offset'])
+            yield from page["items"]
+
     def get_user_playlists(self) -> 'list':
-        playlists = self.spotify.user_playlists(self.user_id)["items"]
-        self.spotify_logger.debug(f"Got User's Playlists: {playlists}")
+        playlists = list(self.iter_user_playlists())
+        self.spotify_logger.debug("Got User's Playlists: %s", truncate(playlists))
         return playlists
 
     def create_playlist(self, playlist_name: str, description: str = "") -> str:
         playlist = self.spotify.user_playlist_create(self.user_id, playlist_name, description)
-        self.spotify_logger.debug(f"Created Playlist: {playlist}")
+        self.spotify_logger.debug("Created Playlist: %s", truncate(playlist))
         return playlist['id']
     
     def set_playlist_description(self, description: str = "", playlist_id: str = "") -> None:
@@ -54,75 +204,189 @@ class Spotify:
         if not description:
             description = generate_description()
         self.spotify.playlist_change_details(playlist_id, description=description)
-        self.spotify_logger.debug(f"Set Playlist {playlist_id} Description {description}")
+        self.spotify_logger.debug("Set Playlist %s Description %s", playlist_id, description)
     
     def get_playlist_name(self, playlist_id: str = "") -> str:
         if not playlist_id:
             playlist_id = self.playlist_id
         playlist_name = self.spotify.playlist(playlist_id)["name"]
-        self.spotify_logger.debug(f"Got Playlist Name: {playlist_name}")
+        self.spotify_logger.debug("Got Playlist Name: %s", playlist_name)
         return playlist_name
     
-    def get_playlist_items(self, playlist_id: str = "", limit: int = 100) -> 'dict':
+    def iter_playlist_items(self, playlist_id: str = "", page_size: int = PLAYLIST_ITEMS_PAGE_SIZE,
+                            fields: str = None) -> Iterator['dict']:
         if not playlist_id:
             playlist_id = self.playlist_id
-        result = self.spotify.playlist_tracks(playlist_id, limit=limit)["items"]
-        track_ids = [t["track"]["id"] for t in result]
-        self.spotify_logger.debug(f"Got Playlist Items: {track_ids}")
+        if fields and "next" not in fields:
+            fields += ",next"
+        results = self.spotify.playlist_items(playlist_id, fields=fields, limit=page_size)
+        for page in self._iter_pages(results):
+            self.spotify_logger.debug("Got %d Playlist Items from %s", len(page['items']), playlist_id)
+            yield from page["items"]
+
+    def get_playlist_items(self, playlist_id: str = "", limit: int = None) -> 'list':
+        track_ids = []
+        page_size = min(limit, PLAYLIST_ITEMS_PAGE_SIZE) if limit else PLAYLIST_ITEMS_PAGE_SIZE
+        for item in self.iter_playlist_items(playlist_id, page_size, fields="items(track(id))"):
+            if limit is not None and len(track_ids) >= limit:
+                break
+            track_ids.append(item["track"]["id"] if item["track"] else None)
+        self.spotify_logger.debug("Got %d Playlist Items: %s", len(track_ids), truncate(track_ids))
         return track_ids
     
     def empty_playlist(self, playlist_id: str = "") -> None:
         if not playlist_id:
             playlist_id = self.playlist_id
-        tracks = self.get_playlist_items(playlist_id)
-        track_ids = [id for id in tracks]
+        # Replacing with no items clears the whole playlist in a single request
+        self.spotify.playlist_replace_items(playlist_id, [])
+        self.spotify_logger.debug("Emptied Playlist %s", playlist_id)
 
-        if not track_ids:
-            self.spotify_logger.debug(f"Playlist {playlist_id} is already empty")
-            return
+    def get_playlist_snapshot(self, playlist_id: str = "") -> 'tuple':
+        if not playlist_id:
+            playlist_id = self.playlist_id
+        snapshot_id = self.spotify.playlist(playlist_id, fields="snapshot_id")["snapshot_id"]
+        track_uris = [
+            item["track"]["uri"] if item["track"] else None
+            for item in self.iter_playlist_items(playlist_id, fields="items(track(uri))")
+        ]
+        self.spotify_logger.debug("Got Playlist Snapshot %s with %d Items", snapshot_id, len(track_uris))
+        return snapshot_id, track_uris
 
-        self.spotify.playlist_remove_all_occurrences_of_items(playlist_id, track_ids)
-        self.spotify_logger.debug(f"Emptied Playlist {playlist_id}")
+    def sync_playlist(self, song_uris: 'list', playlist_id: str = "") -> Union['dict', None]:
+        # Turn the playlist into `song_uris` with the fewest removes, adds and reorders.
+        # Returns None when the playlist has items that can't be addressed by URI, or
+        # when replacing the whole playlist takes fewer requests.
+        if not playlist_id:
+            playlist_id = self.playlist_id
+        snapshot_id, current = self.get_playlist_snapshot(playlist_id)
+        if None in current:
+            self.spotify_logger.debug("Playlist %s has unavailable items, can't sync by diff", playlist_id)
+            return None
 
-    def get_song_uri(self, artist: str, song_name: str) -> Union['str', None]:
-        try:
-            results = self.spotify.search(f'{song_name} {artist}', type='track', limit=10)
-        except SpotifyException as e:
-            self.spotify_logger.error(f"Error searching for song: {e}")
+        wanted = Counter(song_uris)
+        kept = []
+        removals = []
+        for position, uri in enumerate(current):
+            if wanted[uri] > 0:
+                wanted[uri] -= 1
+                kept.append(uri)
+            else:
+                removals.append((position, uri))
+
+        # Items are tracked by their index in `song_uris`
+        target_indices = defaultdict(deque)
+        for index, uri in enumerate(song_uris):
+            target_indices[uri].append(index)
+        operations = plan_playlist_sync([target_indices[uri].popleft() for uri in kept], len(song_uris))
+
+        # A replace takes one request to empty the playlist and one per chunk of adds
+        requests_needed = -(-len(removals) // MAX_PLAYLIST_ITEMS_PER_REQUEST) + len(operations)
+        replace_requests = 1 + -(-len(song_uris) // MAX_PLAYLIST_ITEMS_PER_REQUEST)
+        if requests_needed > replace_requests:
+            self.spotify_logger.debug("Syncing Playlist %s takes %d requests, a replace takes %d",
+                                      playlist_id, requests_needed, replace_requests)
             return None
 
-        tracks_found = results['tracks']['items']
+        # Remove from the end so the positions of earlier items stay valid
+        removals.reverse()
+        for start in range(0, len(removals), MAX_PLAYLIST_ITEMS_PER_REQUEST):
+            chunk = removals[start:start + MAX_PLAYLIST_ITEMS_PER_REQUEST]
+            items = [{"uri": uri, "positions": [position]} for position, uri in chunk]
+            result = self.spotify.playlist_remove_specific_occurrences_of_items(playlist_id, items, snapshot_id)
+            snapshot_id = result["snapshot_id"]
 
-        artist_names = artist_names_from_tracks(tracks_found)
-        track_name = f'{artist}'
-        fuzzy_match_artist(
-            artist_names=artist_names,
-            track_input=track_name)
+        moved = 0
+        added = 0
+        for operation, start, length, position in operations:
+            if operation == "move":
+                result = self.spotify.playlist_reorder_items(
+                    playlist_id, start, position, range_length=length, snapshot_id=snapshot_id)
+                moved += length
+            else:
+                result = self.spotify.playlist_add_items(playlist_id, song_uris[start:start + length], position=position)
+                added += length
+            snapshot_id = result["snapshot_id"]
 
-        if not tracks_found:
-            track_uri = None
-        else:
-            track_uri = tracks_found[0]['uri']
-        self.spotify_logger.debug(f"Got Track URI: {track_uri}")
-        return track_uri
+        stats = {"removed": len(removals), "added": added, "moved": moved}
+        self.spotify_logger.debug("Synced Playlist %s: %s", playlist_id, stats)
+        return stats
+
+    def get_song_match(self, artist: str, song_name: str, duration: int = None) -> Match:
+        if self.match_cache:
+            cached = self.match_cache.get(artist, song_name)
+            if cached:
+                self.spotify_logger.debug("Got Cached Track URI: %s (%.1f)", cached.uri, cached.confidence)
+                # The threshold may have changed since the match was cached
+                uri = cached.uri if cached.confidence >= self.min_confidence else None
+                return Match(uri, cached.confidence, cached.candidates)
+
+        # Quotes would end the field filters early
+        fields = {"title": song_name.replace('"', ''), "artist": artist.replace('"', '')}
+        match = Match(None, 0.0)
+        candidates = []
+        searched = False
+        for query, limit in SEARCH_TIERS:
+            try:
+                results = self.spotify.search(query.format(**fields), type='track', limit=limit)
+            except SpotifyException as e:
+                self.spotify_logger.error(f"Error searching for song: {e}")
+                continue
+            finally:
+                with self._search_count_lock:
+                    self.search_count += 1
+            searched = True
+            tier_match = select_best_candidate(song_name, artist, duration, results['tracks']['items'])
+            candidates.extend(tier_match.candidates)
+            if tier_match.confidence > match.confidence:
+                match = tier_match
+            if match.confidence >= CONFIDENT_MATCH:
+                break
+
+        # The best candidate is cached even below the threshold, so a lower threshold needs no new search
+        candidates = top_candidates(candidates)
+        if self.match_cache and searched:
+            self.match_cache.put(artist, song_name, match.uri, match.confidence, candidates)
+        uri = match.uri if match.confidence >= self.min_confidence else None
+        match = Match(uri, match.confidence, candidates)
+        self.spotify_logger.debug("Got Track URI: %s (%.1f)", match.uri, match.confidence)
+        return match
+
+    def get_song_uri(self, artist: str, song_name: str, duration: int = None) -> Union['str', None]:
+        return self.get_song_match(artist, song_name, duration).uri
 
     def add_song_to_playlist(self, song_uri: str, playlist_id: str = "") -> bool:
         if not playlist_id:
             playlist_id = self.playlist_id
         try:
             self.spotify.playlist_add_items(playlist_id, [song_uri])
-            self.spotify_logger.debug(f"Added Song {song_uri} to Playlist {playlist_id}")
+            self.spotify_logger.debug("Added Song %s to Playlist %s", song_uri, playlist_id)
             return True
         except SpotifyException as e:
             self.spotify_logger.error(f"Error adding song to playlist: {e}")
             return False
+
+    def add_songs_to_playlist(self, song_uris: 'list', playlist_id: str = "") -> bool:
+        if not playlist_id:
+            playlist_id = self.playlist_id
+        try:
+            self.spotify.playlist_add_items(playlist_id, song_uris)
+            self.spotify_logger.debug("Added %d Songs to Playlist %s", len(song_uris), playlist_id)
+            return True
+        except SpotifyException as e:
+            self.spotify_logger.error(f"Error adding {len(song_uris)} songs to playlist: {e}")
+            return False
+
+    def get_playlist_writer(self, playlist_id: str = "", on_write: Callable = None) -> 'PlaylistWriter':
+        if not playlist_id:
+            playlist_id = self.playlist_id
+        return PlaylistWriter(self, playlist_id, on_write=on_write)
     
     def set_playlist_cover(self, encoded_img: str, playlist_id: str = "") -> bool:
         if not playlist_id:
             playlist_id = self.playlist_id
         try:
             self.spotify.playlist_upload_cover_image(playlist_id, encoded_img)
-            self.spotify_logger.debug(f"Set Playlist Cover: {encoded_img}")
+            self.spotify_logger.debug("Set Playlist Cover (%d bytes)", len(encoded_img))
             return True
         except SpotifyException as e:
             self.spotify_logger.error(f"Error setting playlist cover: {e}")
@@ -133,3 +397,43 @@ class Spotify:
             playlist_id = self.playlist_id
         results = self.spotify.playlist_items(playlist_id, limit=1)
         return results.get("total")
+
+
+class PlaylistWriter:
+    # Buffers song URIs in playlist order and adds them in chunks.
+    # A rejected chunk is retried song by song so only the bad URIs end up in `failed`.
+    # `on_write(writer)` is called after every chunk, e.g. to checkpoint the progress.
+
+    def __init__(self, spotify: Spotify, playlist_id: str, chunk_size: int = MAX_PLAYLIST_ITEMS_PER_REQUEST,
+                 on_write: Callable = None):
+        self.spotify = spotify
+        self.playlist_id = playlist_id
+        self.chunk_size = min(chunk_size, MAX_PLAYLIST_ITEMS_PER_REQUEST)
+        self.pending = []
+        self.added = []
+        self.failed = []
+        self.on_write = on_write
+
+    def add(self, song_uri: str) -> None:
+        self.pending.append(song_uri)
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        while self.pending:
+            chunk = self.pending[:self.chunk_size]
+            del self.pending[:self.chunk_size]
+            self._write_chunk(chunk)
+            if self.on_write:
+                self.on_write(self)
+
+    def _write_chunk(self, chunk: 'list') -> None:
+        if self.spotify.add_songs_to_playlist(chunk, self.playlist_id):
+            self.added.extend(chunk)
+            return
+        # Nothing from a rejected chunk was added, so retrying in order keeps the playlist order
+        for song_uri in chunk:
+            if self.spotify.add_song_to_playlist(song_uri, self.playlist_id):
+                self.added.append(song_uri)
+            else:
+                self.failed.append(song_uri)
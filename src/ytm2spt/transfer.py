@@ -1,9 +1,21 @@
-from .spotify import Spotify
-from .youtube import YoutubeMusic
-from urllib import request
-import base64
+from .utils import Match, MIN_CONFIDENCE
+from .normalize import normalized_key
+from .metrics import Metrics
+from .journal import Journal
+from .progress import CancelToken, ProgressTracker, TransferCancelled
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Iterable, NamedTuple, Union
+import time
 from .app_logger import setup_logger
 
+# spotipy, ytmusicapi and requests take most of the startup time, they are
+# imported once a transfer needs them so `--help` and the GUI open quickly
+if TYPE_CHECKING:
+    from .spotify import Spotify
+    from .youtube import Song, YoutubeMusic
+
 
 def url_to_id(url: str, site: str) -> str:
     if site == "yt":
@@ -29,7 +41,7 @@ def get_youtube_playlist_id(youtube_arg: str) -> str:
     return youtube_arg
 
 
-def get_spotify_playlist_id(spotify_arg: str, spotify_playlist_name: str, create_new: bool, dryrun: bool) -> str:
+def get_spotify_playlist_id(yt: 'YoutubeMusic', sp: 'Spotify', spotify_arg: str, spotify_playlist_name: str, create_new: bool, dryrun: bool) -> str:
     if spotify_arg:
         for site in ["spotify.com", "spotify:"]:
             if site in spotify_arg:
@@ -38,8 +50,7 @@ def get_spotify_playlist_id(spotify_arg: str, spotify_playlist_name: str, create
     
     elif spotify_playlist_name:
         if not create_new:
-            user_playlists = sp.get_user_playlists()
-            for playlist in user_playlists:
+            for playlist in sp.iter_user_playlists():
                 if playlist["name"] == spotify_playlist_name:
                     return playlist["id"]
         return sp.create_playlist(spotify_playlist_name)
@@ -49,88 +60,501 @@ def get_spotify_playlist_id(spotify_arg: str, spotify_playlist_name: str, create
             return sp.create_playlist(yt.get_playlist_title())
 
 
-def set_yt_thumbnail_as_sp_cover(dryrun: bool = False):
-    thumbnail_url = yt.get_playlist_thumbnail()
-    if not thumbnail_url:
+def set_yt_thumbnail_as_sp_cover(yt: 'YoutubeMusic', sp: 'Spotify', dryrun: bool = False):
+    # The largest thumbnail URL identifies the cover, covers are reused and uploaded only when it changed
+    thumbnails = yt.get_playlist_thumbnails()
+    if not thumbnails:
+        return
+    source_url = max(thumbnails, key=lambda thumbnail: thumbnail.get("width") or 0)["url"]
+    # Covers are kept in the match cache file, so with --no-cache every run builds and uploads the cover again
+    cover_cache = sp.match_cache
+    if cover_cache is None:
+        setup_logger(__name__).debug("Match cache is disabled, uploading the playlist cover without checking it")
+    if not dryrun and cover_cache and cover_cache.get_uploaded_cover(sp.playlist_id) == source_url:
+        setup_logger(__name__).debug("Playlist cover is unchanged, skipping upload")
         return
-    request.urlretrieve(thumbnail_url, "thumbnail.jpg")
+
+    encoded_img = cover_cache.get_cover(source_url) if cover_cache else None
+    if encoded_img is None:
+        from .cover import build_cover
+        encoded_img = build_cover(yt.session, thumbnails)
+        if encoded_img is None:
+            raise ValueError("No Thumbnail found which can be used as Playlist Cover")
+        if cover_cache:
+            cover_cache.put_cover(source_url, encoded_img)
 
     if dryrun:
         return
 
-    with open("thumbnail.jpg", "rb") as img:
-        encoded_img = base64.b64encode(img.read())
-        sp.set_playlist_cover(encoded_img)
+    if sp.set_playlist_cover(encoded_img) and cover_cache:
+        cover_cache.set_uploaded_cover(sp.playlist_id, source_url)
 
 
-def transfer_playlist(youtube_arg, spotify_arg, spotify_playlist_name, youtube_oauth, dryrun, create_new, limit):
-    global yt, sp
-    yt = YoutubeMusic(youtube_oauth)
-    sp = Spotify()
-    ytm2spt_logger = setup_logger(__name__)
+def resolve_songs(sp: 'Spotify', songs: Iterable, jobs: int = 1, metrics: Metrics = None, journal: Journal = None,
+                  progress: ProgressTracker = None, cancel: CancelToken = None) -> tuple:
+    # Returns (song, match) pairs in playlist order and the number of lookups saved.
+    # `songs` may be a generator still fetching pages. Copies of the same song
+    # (by normalized key) share a single lookup, even while it is still running.
+    # Matches in the journal (of an interrupted run) are reused, new ones are recorded.
+    # Every song is reported to `progress` once resolved; `cancel` is checked before each lookup.
+    pending = []
+    lookups = {}
+    metrics = metrics or Metrics()
+    songs = metrics.timed_iter(songs, "fetch")
+    journaled = journal.matches if journal else {}
 
-    youtube_id = get_youtube_playlist_id(youtube_arg)
-    ytm2spt_logger.info(f"Youtube Playlist ID: {youtube_id}")
-    yt.set_playlist_id(youtube_id)
-    ytm2spt_logger.info(f"Youtube Playlist Name: {yt.get_playlist_title()}")
-    
-    if dryrun:
-        ytm2spt_logger.info("Dryrun mode enabled. No songs will be added to Spotify.")
-        set_yt_thumbnail_as_sp_cover(dryrun=True)
-        ytm2spt_logger.info("Get playlist cover from youtube thumbnail")
-    else:
+    if jobs <= 1:
+        for position, song in enumerate(songs, start=1):
+            if cancel:
+                cancel.raise_if_cancelled()
+            with metrics.phase("normalize"):
+                key = normalized_key(song.artist, song.title)
+            if key not in lookups:
+                if key in journaled:
+                    lookups[key] = journaled[key]
+                else:
+                    lookups[key] = sp.get_song_match(song.artist, song.title, song.duration)
+                    if journal:
+                        journal.record_match(key, lookups[key])
+            pending.append((song, lookups[key]))
+            if progress:
+                progress.resolved(position, song, lookups[key].uri)
+        return pending, len(pending) - len(lookups)
+
+    def record(key: str, future: Future):
+        if not future.cancelled() and not future.exception():
+            journal.record_match(key, future.result())
+
+    def report(position: int, song: 'Song', future: Future):
+        if not future.cancelled() and not future.exception():
+            progress.resolved(position, song, future.result().uri)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        try:
+            for position, song in enumerate(songs, start=1):
+                if cancel:
+                    cancel.raise_if_cancelled()
+                with metrics.phase("normalize"):
+                    key = normalized_key(song.artist, song.title)
+                if key not in lookups:
+                    if key in journaled:
+                        lookups[key] = Future()
+                        lookups[key].set_result(journaled[key])
+                    else:
+                        lookups[key] = executor.submit(sp.get_song_match, song.artist, song.title, song.duration)
+                        if journal:
+                            lookups[key].add_done_callback(partial(record, key))
+                if progress:
+                    lookups[key].add_done_callback(partial(report, position, song))
+                pending.append((song, lookups[key]))
+            resolved = []
+            for song, future in pending:
+                if cancel:
+                    cancel.raise_if_cancelled()
+                resolved.append((song, future.result()))
+        except TransferCancelled:
+            # Lookups not started yet are dropped, the running ones finish
+            executor.shutdown(cancel_futures=True)
+            raise
+        return resolved, len(pending) - len(lookups)
+
+
+class TransferItem(NamedTuple):
+    position: int
+    song: 'Song'
+    match: Match
+
+
+@dataclass
+class TransferResult:
+    youtube_id: str
+    youtube_title: str = ""
+    spotify_id: Union[str, None] = None
+    # Songs in playlist order, with and without a Spotify match
+    found: list = field(default_factory=list)
+    missing: list = field(default_factory=list)
+    # URIs added and rejected by this run, empty for dry runs and diff syncs
+    added: list = field(default_factory=list)
+    failed: list = field(default_factory=list)
+    # Added, removed and moved counts of a diff sync
+    sync: Union[dict, None] = None
+    # Stopped through the cancel token, at a chunk boundary. The journal is kept for --resume.
+    cancelled: bool = False
+    metrics: Metrics = field(default_factory=Metrics)
+
+    @property
+    def timings(self) -> dict:
+        return dict(self.metrics.phases)
+
+
+class Transferer:
+    # Transfers playlists with long-lived clients, session and match cache. Every transfer
+    # works on its own clones of the clients, so transfers may run at the same time.
+
+    def __init__(self, yt: 'YoutubeMusic', sp: 'Spotify', jobs: int = 1):
+        self.yt = yt
+        self.sp = sp
+        self.jobs = jobs
+        self.session = sp.session
+        self.match_cache = sp.match_cache
+        self.ytm2spt_logger = setup_logger(__name__)
+
+    @classmethod
+    def create(cls, youtube_oauth: str = None, jobs: int = 1, use_cache: bool = True, clear_cache: bool = False,
+               min_confidence: float = MIN_CONFIDENCE, pool_size: int = None, app_only: bool = False) -> 'Transferer':
+        from .cache import MatchCache
+        from .http_session import build_session
+        from .spotify import Spotify
+        from .youtube import YoutubeMusic
+        match_cache = MatchCache() if use_cache or clear_cache else None
+        if clear_cache:
+            match_cache.clear()
+            if not use_cache:
+                match_cache.close()
+                match_cache = None
+        session = build_session(pool_size or jobs)
+        return cls(YoutubeMusic(youtube_oauth, session), Spotify(match_cache, min_confidence, session, app_only), jobs)
+
+    def close(self, metrics: Metrics = None):
+        if metrics:
+            from .http_session import connection_stats, rate_limit_stats
+            metrics.set_connection_stats(connection_stats(self.session))
+            metrics.set_rate_limits(rate_limit_stats(self.session))
+            self.ytm2spt_logger.debug("HTTP connections: %s", metrics.connections)
+            self.ytm2spt_logger.debug("Rate limits: %s", metrics.rate_limits)
+        if self.match_cache:
+            self.ytm2spt_logger.info(f"Match cache: {self.match_cache.hits} hits, {self.match_cache.misses} misses")
+            if metrics:
+                metrics.set_counter("cache_hits", self.match_cache.hits)
+                metrics.set_counter("cache_misses", self.match_cache.misses)
+            self.match_cache.close()
+
+    def transfer(self, youtube_arg: str, *, spotify_arg: str = None, spotify_playlist_name: str = None,
+                 dryrun: bool = False, create_new: bool = False, limit: int = None, diff_sync: bool = False,
+                 stream: bool = False, resume: bool = False, jobs: int = None, min_confidence: float = None,
+                 metrics: Metrics = None, ytm2spt_logger=None, on_progress=None,
+                 cancel: CancelToken = None, manifest_path: str = None) -> TransferResult:
+        # `on_progress` receives a ProgressEvent for every song resolved, added or rejected.
+        # Once `cancel` is set the transfer stops before the next lookup or after the current chunk.
+        # The matches are written to `manifest_path` (see match_manifest) once every song is resolved.
+        yt = self.yt.clone()
+        sp = self.sp.clone()
+        if min_confidence is not None:
+            sp.min_confidence = min_confidence
+        ytm2spt_logger = ytm2spt_logger or self.ytm2spt_logger
+
+        youtube_id = get_youtube_playlist_id(youtube_arg)
+        ytm2spt_logger.info(f"Youtube Playlist ID: {youtube_id}")
+        result = TransferResult(youtube_id, metrics=metrics or Metrics())
+        journal = None
+        resumed = False
+        if not dryrun:
+            journal = Journal.for_transfer(youtube_id, spotify_arg or spotify_playlist_name)
+            resumed = resume and journal.load()
+            if resumed:
+                ytm2spt_logger.info(
+                    f"Resuming from {journal.path}: {len(journal.matches)} songs resolved, {journal.written_end} written")
+            elif resume:
+                ytm2spt_logger.info("Nothing to resume, starting a new transfer")
+            journal.open(resume=resumed)
+        progress = ProgressTracker(on_progress) if on_progress else None
+        try:
+            self._transfer(yt, sp, result, spotify_arg, spotify_playlist_name, dryrun, create_new, limit,
+                           jobs or self.jobs, diff_sync, stream, ytm2spt_logger, journal, resumed, progress, cancel,
+                           manifest_path)
+        except TransferCancelled:
+            if journal:
+                journal.close()
+                ytm2spt_logger.warning("Transfer stopped, run it again with --resume to continue")
+            else:
+                ytm2spt_logger.warning("Transfer stopped")
+            result.cancelled = True
+            return result
+        except BaseException:
+            if journal:
+                journal.close()
+            raise
+        if journal:
+            journal.close(completed=True)
+        return result
+
+    def apply_manifest(self, manifest_path: str, *, spotify_arg: str = None, spotify_playlist_name: str = None,
+                       dryrun: bool = False, create_new: bool = False, diff_sync: bool = False,
+                       metrics: Metrics = None, ytm2spt_logger=None, on_progress=None,
+                       cancel: CancelToken = None) -> TransferResult:
+        # Writes the songs of a (reviewed) match manifest to a Spotify playlist, in file order.
+        # Nothing is searched and Youtube is not asked, only batched playlist writes are made.
+        from .match_manifest import read_match_manifest
+        ytm2spt_logger = ytm2spt_logger or self.ytm2spt_logger
+        items = read_match_manifest(manifest_path)
+        ytm2spt_logger.info(f"Read {len(items)} songs from match manifest {manifest_path}")
+        return self.apply_matches(items, spotify_arg=spotify_arg, spotify_playlist_name=spotify_playlist_name,
+                                  dryrun=dryrun, create_new=create_new, diff_sync=diff_sync, metrics=metrics,
+                                  ytm2spt_logger=ytm2spt_logger, on_progress=on_progress, cancel=cancel)
+
+    def apply_matches(self, items: list, *, spotify_arg: str = None, spotify_playlist_name: str = None,
+                      dryrun: bool = False, create_new: bool = False, diff_sync: bool = False,
+                      metrics: Metrics = None, ytm2spt_logger=None, on_progress=None,
+                      cancel: CancelToken = None, youtube_id: str = "") -> TransferResult:
+        # Writes the matched songs of `items` (TransferItems) in the given order
         if not (spotify_arg or spotify_playlist_name):
-            spotify_playlist_name = yt.get_playlist_title()
-        spotify_id = get_spotify_playlist_id(spotify_arg, spotify_playlist_name, create_new, dryrun)
-        ytm2spt_logger.info(f"Spotify Playlist ID: {spotify_id}")
-        sp.set_playlist_id(spotify_id)
-        ytm2spt_logger.info(f"Spotify Playlist Name: {sp.get_playlist_name()}")
+            raise ValueError("Applying matches needs a Spotify playlist ID or name")
+        sp = self.sp.clone()
+        ytm2spt_logger = ytm2spt_logger or self.ytm2spt_logger
+        result = TransferResult(youtube_id, metrics=metrics or Metrics())
+        metrics = result.metrics
+
+        for item in items:
+            (result.found if item.match.uri else result.missing).append(item)
+        uris = [item.match.uri for item in result.found]
+        metrics.set_counter("total", len(items))
+        metrics.set_counter("found", len(uris))
+        ytm2spt_logger.info(f"{len(uris)} songs to add out of {len(items)}")
+        if dryrun:
+            ytm2spt_logger.info("Dryrun mode enabled. No songs will be added to Spotify.")
+            return result
 
+        result.spotify_id = get_spotify_playlist_id(None, sp, spotify_arg, spotify_playlist_name, create_new, dryrun)
+        sp.set_playlist_id(result.spotify_id)
+        ytm2spt_logger.info(f"Spotify Playlist ID: {result.spotify_id}")
+        progress = ProgressTracker(on_progress) if on_progress else None
         try:
-            set_yt_thumbnail_as_sp_cover()
-            ytm2spt_logger.info("Set playlist cover from youtube thumbnail")
-        except Exception as e:
-            ytm2spt_logger.warning(str(e))
-            ytm2spt_logger.warning("Could not able to set playlist cover from youtube thumbnail")
+            if not create_new:
+                sp.set_playlist_description()
+            if diff_sync and not create_new:
+                with metrics.phase("write"):
+                    result.sync = sp.sync_playlist(uris)
+                if result.sync is not None:
+                    ytm2spt_logger.info(
+                        f"Synced playlist: {result.sync['added']} added, {result.sync['removed']} removed, "
+                        f"{result.sync['moved']} moved")
+                    for name, value in result.sync.items():
+                        metrics.set_counter(name, value)
+                    return result
+                ytm2spt_logger.warning("Could not sync changes only, replacing the whole playlist")
+            if not create_new:
+                with metrics.phase("empty"):
+                    sp.empty_playlist()
 
-        if not create_new:
-            sp.set_playlist_description()
-            ytm2spt_logger.info("Update playlist description")
+            reported = [0, 0]
 
-            sp.empty_playlist()
-            ytm2spt_logger.info("Empty the current playlist")
+            def checkpoint(writer):
+                if progress:
+                    progress.written(writer.added[reported[0]:], writer.failed[reported[1]:])
+                    reported[:] = len(writer.added), len(writer.failed)
+                if cancel:
+                    cancel.raise_if_cancelled()
 
-    songs = yt.get_songs_from_playlist(limit)
-    ytm2spt_logger.info(f"Got {len(songs)} songs from Youtube Playlist")
+            if progress:
+                progress.start_writing(len(uris))
+            writer = sp.get_playlist_writer(on_write=checkpoint)
+            result.added = writer.added
+            result.failed = writer.failed
+            with metrics.phase("write"):
+                for song_uri in uris:
+                    writer.add(song_uri)
+                writer.flush()
+            if progress:
+                progress.finish()
+        except TransferCancelled:
+            ytm2spt_logger.warning("Transfer stopped")
+            result.cancelled = True
+        metrics.set_counter("added", len(result.added))
+        if result.failed:
+            ytm2spt_logger.warning(f"Songs not added:\n{chr(10).join(result.failed)}")
+        ytm2spt_logger.info(f"Added {len(result.added)} songs out of {len(items)}")
+        return result
+
+    def _transfer(self, yt: 'YoutubeMusic', sp: 'Spotify', result: TransferResult, spotify_arg, spotify_playlist_name, dryrun, create_new, limit, jobs, diff_sync, stream, ytm2spt_logger, journal: Journal, resumed: bool, progress: ProgressTracker = None, cancel: CancelToken = None, manifest_path: str = None):
+        youtube_id = result.youtube_id
+        metrics = result.metrics
+        with metrics.phase("fetch"):
+            yt.set_playlist_id(youtube_id, limit, stream)
+        result.youtube_title = yt.get_playlist_title()
+        ytm2spt_logger.info(f"Youtube Playlist Name: {result.youtube_title}")
+        if progress:
+            track_count = yt.get_playlist_track_count()
+            progress.set_total(min(track_count, limit) if track_count is not None and limit else track_count)
+        if cancel:
+            cancel.raise_if_cancelled()
     
-    total_songs_added = 0
-    total_songs_found = 0
-    songs_not_found = []
+        if dryrun:
+            ytm2spt_logger.info("Dryrun mode enabled. No songs will be added to Spotify.")
+            try:
+                with metrics.phase("cover"):
+                    set_yt_thumbnail_as_sp_cover(yt, sp, dryrun=True)
+                ytm2spt_logger.info("Get playlist cover from youtube thumbnail")
+            except Exception as e:
+                ytm2spt_logger.warning(str(e))
+        else:
+            if not (spotify_arg or spotify_playlist_name):
+                spotify_playlist_name = yt.get_playlist_title()
+            if resumed and journal.spotify_id:
+                spotify_id = journal.spotify_id
+            else:
+                spotify_id = get_spotify_playlist_id(yt, sp, spotify_arg, spotify_playlist_name, create_new, dryrun)
+                journal.record_start(spotify_id)
+            result.spotify_id = spotify_id
+            ytm2spt_logger.info(f"Spotify Playlist ID: {spotify_id}")
+            sp.set_playlist_id(spotify_id)
+            ytm2spt_logger.info(f"Spotify Playlist Name: {sp.get_playlist_name()}")
 
-    for i, song in enumerate(songs, start=1):
-        song_uri = sp.get_song_uri(song.artist, song.title)
+            try:
+                with metrics.phase("cover"):
+                    set_yt_thumbnail_as_sp_cover(yt, sp)
+                ytm2spt_logger.info("Set playlist cover from youtube thumbnail")
+            except Exception as e:
+                ytm2spt_logger.warning(str(e))
+                ytm2spt_logger.warning("Could not able to set playlist cover from youtube thumbnail")
 
-        if not song_uri:
-            ytm2spt_logger.error(f"{song.artist} - {song.title} was not found!")
-            songs_not_found.append(f"{i}. {song.artist} - {song.title}")
-            continue
-        else:
-            total_songs_found += 1
+            if not create_new:
+                sp.set_playlist_description()
+                ytm2spt_logger.info("Update playlist description")
+
+                if not diff_sync and resumed and journal.emptied:
+                    ytm2spt_logger.info("Keep the songs added before the transfer was interrupted")
+                elif not diff_sync:
+                    with metrics.phase("empty"):
+                        sp.empty_playlist()
+                    journal.record_emptied()
+                    ytm2spt_logger.info("Empty the current playlist")
+
+        # Waiting for YouTube pages and normalizing are charged to their own phases, not to resolve
+        overlap_before = metrics.phases["fetch"] + metrics.phases["normalize"]
+        resolve_start = time.perf_counter()
+        resolved, lookups_saved = resolve_songs(
+            sp, yt.iter_songs_from_playlist(limit), jobs, metrics, journal, progress, cancel)
+        overlap = metrics.phases["fetch"] + metrics.phases["normalize"] - overlap_before
+        metrics.add_time("resolve", time.perf_counter() - resolve_start - overlap)
+        if progress:
+            progress.finish()
+        songs = [song for song, _ in resolved]
+        ytm2spt_logger.info(f"Got {len(songs)} songs from Youtube Playlist")
+
+        total_songs_found = 0
+        songs_not_found = []
+        song_labels = {}
+        found_uris = []
+
+        if songs:
+            ytm2spt_logger.info(
+                f"Made {sp.search_count} searches for {len(songs)} songs "
+                f"({sp.search_count / len(songs):.2f} per song)")
+        if lookups_saved:
+            ytm2spt_logger.info(f"Skipped {lookups_saved} lookups for duplicate songs")
+        for i, (song, match) in enumerate(resolved, start=1):
+            song_uri = match.uri
+            if not song_uri:
+                ytm2spt_logger.error("%s - %s was not found!", song.artist, song.title)
+                songs_not_found.append(f"{i}. {song.artist} - {song.title}")
+                result.missing.append(TransferItem(i, song, match))
+                continue
+            else:
+                total_songs_found += 1
+                result.found.append(TransferItem(i, song, match))
         
-        if dryrun:
-            continue
+            if dryrun:
+                continue
         
-        was_added = sp.add_song_to_playlist(song_uri)
+            ytm2spt_logger.info('%s - %s was found (%.0f%% match).', song.artist, song.title, match.confidence)
+            song_labels.setdefault(song_uri, f"{i}. {song.artist} - {song.title}")
+            found_uris.append(song_uri)
 
-        if was_added:
-            ytm2spt_logger.info(
-                f'{song.artist} - {song.title} was added to playlist.')
-            total_songs_added += 1
+        if manifest_path:
+            from .match_manifest import write_match_manifest
+            write_match_manifest(manifest_path, sorted(result.found + result.missing, key=lambda item: item.position))
+            ytm2spt_logger.info(f"Wrote {len(songs)} matches to {manifest_path}")
     
-    if not dryrun:
-        ytm2spt_logger.info(f'Added {total_songs_added} songs out of {len(songs)}')
-    else:
-        ytm2spt_logger.info(f'Found {total_songs_found} songs out of {len(songs)}')
+        sync_stats = None
+        if cancel and not dryrun:
+            cancel.raise_if_cancelled()
+        if not dryrun and diff_sync and not create_new:
+            with metrics.phase("write"):
+                sync_stats = sp.sync_playlist(found_uris)
+            if sync_stats is None:
+                ytm2spt_logger.warning("Could not sync changes only, replacing the whole playlist")
+                with metrics.phase("empty"):
+                    sp.empty_playlist()
+                journal.record_emptied()
+                resumed = False
+            else:
+                ytm2spt_logger.info(
+                    f"Synced playlist: {sync_stats['added']} added, {sync_stats['removed']} removed, "
+                    f"{sync_stats['moved']} moved")
+                ytm2spt_logger.info(f'Playlist has {len(found_uris)} songs out of {len(songs)}')
+
+        if not dryrun and sync_stats is None:
+            written = playlist_tracks = 0
+            if resumed:
+                playlist_tracks = sp._num_playlist_songs() or 0
+                written = journal.resume_offset(playlist_tracks, len(found_uris))
+                ytm2spt_logger.info(f"Skip {written} songs added before the transfer was interrupted")
+
+            reported = [0, 0]
+
+            def checkpoint(writer):
+                journal.record_chunk(written + len(writer.added) + len(writer.failed), playlist_tracks + len(writer.added))
+                if progress:
+                    progress.written(writer.added[reported[0]:], writer.failed[reported[1]:])
+                    reported[:] = len(writer.added), len(writer.failed)
+                # The chunk is written and checkpointed, a resumed run continues right after it
+                if cancel:
+                    cancel.raise_if_cancelled()
+
+            if progress:
+                progress.start_writing(len(found_uris), written)
+            writer = sp.get_playlist_writer(on_write=checkpoint)
+            # Shared with the writer, so a stopped transfer still reports what it added
+            result.added = writer.added
+            result.failed = writer.failed
+            with metrics.phase("write"):
+                for song_uri in found_uris[written:]:
+                    writer.add(song_uri)
+                writer.flush()
+            if progress:
+                progress.finish()
+            metrics.set_counter("added", len(writer.added))
+            if writer.failed:
+                songs_not_added = [song_labels[song_uri] for song_uri in writer.failed]
+                ytm2spt_logger.warning(f"Songs not added:\n{chr(10).join(songs_not_added)}")
+            ytm2spt_logger.info(f'Added {len(writer.added)} songs out of {len(songs)}')
+        elif dryrun:
+            ytm2spt_logger.info(f'Found {total_songs_found} songs out of {len(songs)}')
     
-    if songs_not_found:
-        ytm2spt_logger.warning(f"Songs not found:\n{chr(10).join(songs_not_found)}")
+        if songs_not_found:
+            ytm2spt_logger.warning(f"Songs not found:\n{chr(10).join(songs_not_found)}")
+
+        result.sync = sync_stats
+        metrics.set_counter("total", len(songs))
+        metrics.set_counter("found", total_songs_found)
+        metrics.set_counter("searches", sp.search_count)
+        metrics.set_counter("lookups_saved", lookups_saved)
+        if sync_stats:
+            for name, value in sync_stats.items():
+                metrics.set_counter(name, value)
+
+
+def transfer_playlist(youtube_arg, spotify_arg, spotify_playlist_name, youtube_oauth, dryrun, create_new, limit, *, jobs=1, use_cache=True, clear_cache=False, diff_sync=False, stream=False, min_confidence=MIN_CONFIDENCE, metrics_json=None, metrics_prom=None, resume=False, on_progress=None, cancel=None, manifest_path=None, apply_manifest=None) -> TransferResult:
+    # Options past `limit` are keyword-only, there are too many to pass them in order
+    transferer = Transferer.create(youtube_oauth, jobs, use_cache, clear_cache, min_confidence)
+    metrics = Metrics()
+    metrics.instrument_session(transferer.session)
+    try:
+        if apply_manifest:
+            result = transferer.apply_manifest(
+                apply_manifest, spotify_arg=spotify_arg, spotify_playlist_name=spotify_playlist_name, dryrun=dryrun,
+                create_new=create_new, diff_sync=diff_sync, metrics=metrics, on_progress=on_progress, cancel=cancel)
+        else:
+            result = transferer.transfer(
+                youtube_arg, spotify_arg=spotify_arg, spotify_playlist_name=spotify_playlist_name, dryrun=dryrun,
+                create_new=create_new, limit=limit, diff_sync=diff_sync, stream=stream, resume=resume,
+                metrics=metrics, on_progress=on_progress, cancel=cancel, manifest_path=manifest_path)
+    finally:
+        metrics.remove_from_session(transferer.session)
+        transferer.close(metrics)
+
+    if metrics_json:
+        metrics.write_json(metrics_json)
+    if metrics_prom:
+        metrics.write_prometheus(metrics_prom)
+    return result
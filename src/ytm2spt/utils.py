@@ -1,29 +1,101 @@
-from thefuzz import process, fuzz
+from typing import Iterable, NamedTuple, Union
 from .app_logger import setup_logger
+from .normalize import clean_track_name, version_words
 
 
 utils_logger = setup_logger(__name__)
 
-def artist_names_from_tracks(items: dict):
-    artist_names = set()
-
-    for idx, track in enumerate(items):
-        artist_names.add(track['artists'][0]['name'])
-    return artist_names
-
-
-def fuzzy_match_artist(artist_names: set, track_input: str) -> bool: 
-    match_grade = process.extract(track_input, artist_names, limit=3, scorer=fuzz.token_sort_ratio)
-    try:
-        if match_grade[0][1] > 70:
-            print(f'Fuzy match found {match_grade}')
-            return True
-        else:
-            print(f'Fuzy match not found {match_grade}')
-            return False
-    except IndexError:
-        utils_logger.debug('Issue with ingest to fuzzmatch with data')
-        utils_logger.debug(f'Track {track_input}')
-        utils_logger.debug(f'{artist_names}')
-        print("No data provided to matching process")
-        return False
+# Weights of the title, artist and duration scores in the confidence of a candidate
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.35
+DURATION_WEIGHT = 0.15
+# Duration difference (in seconds) at which the duration score drops to 0
+DURATION_TOLERANCE = 30
+# Title score taken off a candidate that is a remix, live, acoustic... version the title doesn't ask for
+VERSION_PENALTY = 40
+MIN_CONFIDENCE = 60
+# Best candidates kept with a match, for review in the match manifest
+MAX_CANDIDATES = 5
+
+
+class Candidate(NamedTuple):
+    uri: str
+    name: str
+    artists: str
+    confidence: float
+
+
+class Match(NamedTuple):
+    uri: Union[str, None]
+    confidence: float
+    # Best scored Spotify tracks, for review in the match manifest
+    candidates: tuple = ()
+
+
+def top_candidates(candidates: Iterable, limit: int = MAX_CANDIDATES) -> tuple:
+    # Highest confidence first, a track found by several queries is listed once
+    best = {}
+    for candidate in candidates:
+        if candidate.uri not in best or candidate.confidence > best[candidate.uri].confidence:
+            best[candidate.uri] = candidate
+    return tuple(sorted(best.values(), key=lambda candidate: -candidate.confidence)[:limit])
+
+
+def score_candidates(title: str, artist: str, duration: Union[int, None], tracks: list) -> list:
+    # Each field is scored against every candidate in one rapidfuzz call
+    # (process.cdist needs numpy, which we don't ship)
+    if not tracks:
+        return []
+    # Imported on first use, the CLI only needs the constants above to parse its arguments
+    from rapidfuzz import process, fuzz, utils as fuzz_utils
+    # Titles are compared with and without the version tail (the Youtube title had it cut off too),
+    # a version the title doesn't name costs VERSION_PENALTY instead of a superset scoring 100
+    title_scores = [0.0] * len(tracks)
+    for names in ([track["name"] for track in tracks], [clean_track_name(track["name"]) for track in tracks]):
+        for _, score, index in process.extract(
+                title, names, scorer=fuzz.token_sort_ratio, processor=fuzz_utils.default_process, limit=None):
+            title_scores[index] = max(title_scores[index], score)
+    wanted_versions = version_words(title)
+    for index, track in enumerate(tracks):
+        if version_words(track["name"]) - wanted_versions:
+            title_scores[index] = max(0.0, title_scores[index] - VERSION_PENALTY)
+
+    artist_owners = []
+    artist_names = []
+    for index, track in enumerate(tracks):
+        for track_artist in track["artists"]:
+            artist_owners.append(index)
+            artist_names.append(track_artist["name"])
+    artist_scores = [0.0] * len(tracks)
+    for _, score, index in process.extract(
+            artist, artist_names, scorer=fuzz.token_sort_ratio,
+            processor=fuzz_utils.default_process, limit=None):
+        owner = artist_owners[index]
+        artist_scores[owner] = max(artist_scores[owner], score)
+
+    scores = []
+    for track, title_score, artist_score in zip(tracks, title_scores, artist_scores):
+        score = TITLE_WEIGHT * title_score + ARTIST_WEIGHT * artist_score
+        weight = TITLE_WEIGHT + ARTIST_WEIGHT
+        if duration and track.get("duration_ms"):
+            difference = abs(track["duration_ms"] / 1000 - duration)
+            score += DURATION_WEIGHT * max(0.0, 100 - difference * 100 / DURATION_TOLERANCE)
+            weight += DURATION_WEIGHT
+        scores.append(score / weight)
+    return scores
+
+
+def select_best_candidate(title: str, artist: str, duration: Union[int, None], tracks: list,
+                          min_confidence: float = 0) -> Match:
+    scores = score_candidates(title, artist, duration, tracks)
+    if not scores:
+        return Match(None, 0.0)
+    best = max(range(len(scores)), key=scores.__getitem__)
+    utils_logger.debug("Best candidate for %s - %s: %s (%.1f)", artist, title, tracks[best]['uri'], scores[best])
+    candidates = top_candidates(
+        Candidate(track["uri"], track["name"], ", ".join(track_artist["name"] for track_artist in track["artists"]),
+                  round(score, 1))
+        for track, score in zip(tracks, scores))
+    if scores[best] < min_confidence:
+        return Match(None, scores[best], candidates)
+    return Match(tracks[best]["uri"], scores[best], candidates)
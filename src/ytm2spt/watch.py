@@ -0,0 +1,324 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Union
+from .app_logger import PrefixedLogger, setup_logger
+from .batch import BatchEntry, load_manifest
+from .metrics import Metrics
+from .transfer import (Transferer, get_spotify_playlist_id, get_youtube_playlist_id, resolve_songs,
+                       set_yt_thumbnail_as_sp_cover)
+from .utils import Match
+
+
+# Per watched playlist: its Spotify playlist, first page fingerprint and last matches, rewritten after each poll
+WATCH_STATE_PATH = ".ytm2spt_watch.json"
+# Seconds between polls of a playlist that changed, and the most it backs off to
+DEFAULT_INTERVAL = 300
+DEFAULT_MAX_INTERVAL = 3600
+# Interval growth after a poll without changes, and after a failed poll
+UNCHANGED_BACKOFF = 1.5
+ERROR_BACKOFF = 2
+# Polls only compare the track count and the first page, the whole playlist is fetched
+# at least this often (seconds) to see edits further down and to search missing songs again
+FULL_CHECK_INTERVAL = 6 * 3600
+
+watch_logger = setup_logger(__name__)
+
+
+def track_key(track: dict) -> str:
+    # Tracks without a video ID (unavailable uploads) fall back to their title and artist
+    if track.get("videoId"):
+        return track["videoId"]
+    artists = ", ".join(artist["name"] for artist in track.get("artists") or [])
+    return f"{artists} - {track.get('title')}"
+
+
+def playlist_fingerprint(keys: list) -> str:
+    return hashlib.sha1("\n".join(keys).encode()).hexdigest()
+
+
+@dataclass
+class WatchState:
+    spotify_id: Union[str, None] = None
+    fingerprint: Union[str, None] = None
+    track_count: int = 0
+    # Video ID to the Spotify match, for the tracks currently in the playlist
+    matches: dict = field(default_factory=dict)
+    changed: Union[float, None] = None
+    # Fingerprint of the first page and track count of the header, and when the whole playlist was fetched
+    head: Union[str, None] = None
+    header_count: Union[int, None] = None
+    checked: Union[float, None] = None
+    # Changed since it was last saved, not saved itself
+    dirty: bool = False
+
+    def to_dict(self) -> dict:
+        return {
+            "spotify_id": self.spotify_id,
+            "fingerprint": self.fingerprint,
+            "track_count": self.track_count,
+            "matches": {key: [match.uri, match.confidence] for key, match in self.matches.items()},
+            "changed": self.changed,
+            "head": self.head,
+            "header_count": self.header_count,
+            "checked": self.checked,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'WatchState':
+        matches = {key: Match(uri, confidence) for key, (uri, confidence) in data.get("matches", {}).items()}
+        return cls(data.get("spotify_id"), data.get("fingerprint"), data.get("track_count", 0), matches,
+                   data.get("changed"), data.get("head"), data.get("header_count"), data.get("checked"))
+
+
+def load_states(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {key: WatchState.from_dict(data) for key, data in json.load(f).items()}
+
+
+def save_states(path: str, states: dict):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({key: state.to_dict() for key, state in states.items()}, f)
+    os.replace(tmp_path, path)
+    for state in states.values():
+        state.dirty = False
+
+
+def state_key(entry: BatchEntry) -> str:
+    return f"{get_youtube_playlist_id(entry.youtube)}:{entry.spotify or entry.spotify_name or ''}"
+
+
+def poll_playlist(transferer: Transferer, entry: BatchEntry, state: WatchState, ytm2spt_logger=None) -> Union[dict, None]:
+    # Fetches the header and first page of the Youtube playlist and compares them with the last poll,
+    # the rest is only fetched when they changed (or every FULL_CHECK_INTERVAL). Only songs added
+    # since then, and those not found before, are searched. The Spotify playlist is synced by diff,
+    # or replaced when that takes fewer requests. Returns None when nothing changed, or the sync counts.
+    from .youtube import track_to_song
+    ytm2spt_logger = ytm2spt_logger or watch_logger
+    yt = transferer.yt.clone()
+    sp = transferer.sp.clone()
+    sp.min_confidence = entry.min_confidence
+    metrics = Metrics()
+    written = bool(state.spotify_id or entry.dryrun)
+
+    # Only the keys of all tracks are kept, and the songs of those to search
+    keys = []
+    new_songs = {}
+    with metrics.phase("fetch"):
+        yt.set_playlist_id(get_youtube_playlist_id(entry.youtube), entry.limit, stream=True)
+        head = playlist_fingerprint([track_key(track) for track in yt.peek_tracks()[:entry.limit]])
+        header_count = yt.get_playlist_track_count()
+        if (written and head == state.head and header_count is not None and header_count == state.header_count
+                and time.time() - (state.checked or 0) < FULL_CHECK_INTERVAL):
+            ytm2spt_logger.debug("Playlist unchanged (%d tracks, same first page)", header_count)
+            return None
+        for track in yt.iter_tracks_from_playlist(entry.limit):
+            key = track_key(track)
+            keys.append(key)
+            if key not in new_songs and not (key in state.matches and state.matches[key].uri):
+                new_songs[key] = track_to_song(track)
+
+    # Songs that were not found are searched again, the match cache keeps that cheap
+    resolved, _ = resolve_songs(sp, new_songs.values(), entry.jobs, metrics)
+    matches = {key: state.matches[key] for key in keys if key in state.matches}
+    matches.update(zip(new_songs, (match for _, match in resolved)))
+    fingerprint = playlist_fingerprint(keys)
+    unchanged = fingerprint == state.fingerprint and len(keys) == state.track_count
+    if written and unchanged and not any(match.uri for _, match in resolved):
+        ytm2spt_logger.debug("Playlist unchanged (%d tracks)", len(keys))
+        state.head, state.header_count, state.checked = head, header_count, time.time()
+        state.matches = matches
+        state.dirty = True
+        return None
+
+    retried = sum(key in state.matches for key in new_songs)
+    removed_keys = set(state.matches) - set(keys)
+    ytm2spt_logger.info(
+        f"Youtube Playlist {yt.get_playlist_title()} changed: {len(new_songs) - retried} new, "
+        f"{len(removed_keys)} removed, {retried} searched again, {len(keys)} songs")
+    for (song, match) in resolved:
+        if not match.uri:
+            ytm2spt_logger.error("%s - %s was not found!", song.artist, song.title)
+    found_uris = [matches[key].uri for key in keys if matches[key].uri]
+
+    stats = {"added": 0, "removed": 0, "moved": 0}
+    if entry.dryrun:
+        ytm2spt_logger.info(f"Dryrun mode enabled. Found {len(found_uris)} songs out of {len(keys)}")
+    else:
+        if not state.spotify_id:
+            spotify_name = entry.spotify_name or yt.get_playlist_title()
+            state.spotify_id = get_spotify_playlist_id(yt, sp, entry.spotify, spotify_name, entry.create_new, False)
+            ytm2spt_logger.info(f"Spotify Playlist ID: {state.spotify_id}")
+        sp.set_playlist_id(state.spotify_id)
+        try:
+            set_yt_thumbnail_as_sp_cover(yt, sp)
+        except Exception as e:
+            ytm2spt_logger.warning(str(e))
+        sp.set_playlist_description()
+
+        with metrics.phase("write"):
+            synced = sp.sync_playlist(found_uris)
+            if synced is None:
+                ytm2spt_logger.warning("Could not sync changes only, replacing the whole playlist")
+                sp.empty_playlist()
+                writer = sp.get_playlist_writer()
+                for song_uri in found_uris:
+                    writer.add(song_uri)
+                writer.flush()
+                synced = {"added": len(writer.added), "removed": 0, "moved": 0}
+        stats = synced
+        ytm2spt_logger.info(
+            f"Synced playlist: {stats['added']} added, {stats['removed']} removed, {stats['moved']} moved "
+            f"({sp.search_count} searches)")
+
+    state.fingerprint = fingerprint
+    state.track_count = len(keys)
+    state.matches = matches
+    state.head, state.header_count, state.checked = head, header_count, time.time()
+    state.changed = time.time()
+    state.dirty = True
+    ytm2spt_logger.debug("Poll timings: %s", dict(metrics.phases))
+    return stats
+
+
+class WatchedPlaylist:
+    # Poll schedule of one playlist: the interval grows while it is unchanged or failing
+    def __init__(self, entry: BatchEntry, interval: float, max_interval: float):
+        self.entry = entry
+        self.logger = PrefixedLogger(watch_logger, {"prefix": entry.label})
+        self.base_interval = interval
+        self.max_interval = max_interval
+        self.interval = interval
+        self.next_poll = 0.0
+
+    def schedule(self, now: float, changed: bool = False, failed: bool = False):
+        if changed:
+            self.interval = self.base_interval
+        else:
+            factor = ERROR_BACKOFF if failed else UNCHANGED_BACKOFF
+            self.interval = min(self.interval * factor, self.max_interval)
+        self.next_poll = now + self.interval
+
+
+def watch(entries: list, youtube_oauth: str = None, use_cache: bool = True, interval: float = DEFAULT_INTERVAL,
+          max_interval: float = DEFAULT_MAX_INTERVAL, state_path: str = WATCH_STATE_PATH, once: bool = False) -> bool:
+    # Polls until interrupted, or a single round with `once`. Returns False if a poll of the last round failed.
+    states = load_states(state_path)
+    watched = [WatchedPlaylist(entry, interval, max(interval, max_interval)) for entry in entries]
+    transferer = Transferer.create(youtube_oauth, max(entry.jobs for entry in entries), use_cache)
+    watch_logger.info(f"Watching {len(watched)} playlists every {interval:g}s (up to {max_interval:g}s)")
+    try:
+        while True:
+            failed = False
+            for playlist in watched:
+                if playlist.next_poll > time.monotonic():
+                    continue
+                key = state_key(playlist.entry)
+                state = states.setdefault(key, WatchState())
+                try:
+                    stats = poll_playlist(transferer, playlist.entry, state, playlist.logger)
+                except Exception as e:
+                    failed = True
+                    playlist.schedule(time.monotonic(), failed=True)
+                    playlist.logger.error(f"Poll failed: {e}, next poll in {playlist.interval:g}s")
+                    continue
+                playlist.schedule(time.monotonic(), changed=stats is not None)
+                # Also after a whole playlist was checked without changes, so a restart keeps that check
+                if state.dirty:
+                    save_states(state_path, states)
+                playlist.logger.debug("Next poll in %gs", playlist.interval)
+            if once:
+                return not failed
+            time.sleep(max(0.0, min(playlist.next_poll for playlist in watched) - time.monotonic()))
+    except KeyboardInterrupt:
+        watch_logger.info("Stopped watching")
+        return True
+    finally:
+        transferer.close()
+
+
+def get_args(argv: list):
+    parser = argparse.ArgumentParser(
+        prog="ytm2spt watch",
+        description="Keep the Spotify copies of the playlists in a TOML manifest in sync",
+    )
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="TOML file with [[playlist]] entries (see README)",
+    )
+    parser.add_argument(
+        "-i",
+        "--interval",
+        type=float,
+        default=None,
+        required=False,
+        help=f"Seconds between polls of a playlist (Default: {DEFAULT_INTERVAL})",
+    )
+    parser.add_argument(
+        "--max-interval",
+        type=float,
+        default=None,
+        required=False,
+        help=f"Longest wait between polls of an unchanged or failing playlist (Default: {DEFAULT_MAX_INTERVAL})",
+    )
+    parser.add_argument(
+        "-ytauth",
+        "--youtube-oauth-json",
+        type=str,
+        default=None,
+        required=False,
+        help="Youtube OAuth JSON filepath (run 'ytmusicapi-oauth')"
+    )
+    parser.add_argument(
+        "--state",
+        type=str,
+        default=None,
+        required=False,
+        help=f"File keeping the fingerprints and matches between polls (Default: {WATCH_STATE_PATH})",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Poll every playlist once and exit",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        required=False,
+        default=False,
+        help="Do not read or write the local match and cover cache, the playlist cover is then uploaded on every run",
+    )
+    args = parser.parse_args(argv)
+    if args.interval is not None and args.interval <= 0:
+        parser.error("--interval must be positive")
+    return args
+
+
+def main(argv: list = None):
+    args = get_args(sys.argv[1:] if argv is None else argv)
+    settings, entries = load_manifest(args.manifest, "watch")
+    succeeded = watch(
+        entries,
+        args.youtube_oauth_json or settings.get("youtube_oauth"),
+        not args.no_cache and settings.get("cache", True),
+        args.interval or settings.get("interval", DEFAULT_INTERVAL),
+        args.max_interval or settings.get("max_interval", DEFAULT_MAX_INTERVAL),
+        args.state or settings.get("state", WATCH_STATE_PATH),
+        args.once,
+    )
+    if not succeeded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,200 @@
 from ytmusicapi import YTMusic
+from ytmusicapi.continuations import CONTINUATION_ITEMS, get_continuation_token
+from ytmusicapi.navigation import nav, CONTENT, EDITABLE_PLAYLIST_DETAIL_HEADER, HEADER, RESPONSIVE_HEADER\
+    , SECTION, SECTION_LIST_ITEM, TAB_CONTENT, TWO_COLUMN_RENDERER
+from ytmusicapi.parsers.playlists import parse_playlist_header_meta, parse_playlist_items
+from array import array
 from dataclasses import dataclass
-import re
+from typing import Iterable, Union
+import copy
+from itertools import islice
 import requests
 from .app_logger import setup_logger
+from .http_session import build_session
+from .cover import MAX_COVER_BYTES, probe_thumbnails
+from .normalize import clean_artist, clean_title
 
-@dataclass
+# Stored duration of songs without one
+NO_DURATION = -1
+
+
+@dataclass(slots=True)
 class Song:
     artist: str
     title: str
+    duration: int = None
+    video_id: str = None
 
 
 def clean_song_info(song: Song) -> Song:
-    artist, title = song.artist, song.title
-    title = re.sub(r'\(.*', '', title)          # Remove everything after '(' including '('
-    title = re.sub(r'ft.*', '', title)          # Remove everything after 'ft' including 'ft'
-    title = re.sub(r',.*', '', title)           # Remove everything after ',' including ','
-    artist = re.sub(r'\sx\s.*', '', artist)     # Remove everything after ' x ' including ' x '
-    artist = re.sub(r'\(.*', '', artist)        # Remove everything after '(' including '('
-    artist = re.sub(r'ft.*', '', artist)        # Remove everything after 'ft' including 'ft'
-    artist = re.sub(r',.*', '', artist)         # Remove everything after ',' including ','
-    return Song(artist.strip(), title.strip())  # Remove whitespaces from start and end
+    return Song(clean_artist(song.artist), clean_title(song.title), song.duration, song.video_id)
+
+
+def track_to_song(track: dict) -> Song:
+    return clean_song_info(
+        Song(track["artists"][0]["name"], track["title"], track.get("duration_seconds"), track.get("videoId")))
+
+
+class SongStore:
+    # The songs of a playlist by column, with only what matching needs. Durations and artists are
+    # arrays, each artist name is stored once. Songs are created when they are read.
+    __slots__ = ("titles", "video_ids", "durations", "artist_ids", "artists", "_artist_index")
+
+    def __init__(self, songs: Iterable = ()):
+        self.titles = []
+        self.video_ids = []
+        self.durations = array("i")
+        self.artist_ids = array("I")
+        self.artists = []
+        self._artist_index = {}
+        for song in songs:
+            self.append(song)
+
+    def append(self, song: Song):
+        artist_id = self._artist_index.get(song.artist)
+        if artist_id is None:
+            artist_id = self._artist_index[song.artist] = len(self.artists)
+            self.artists.append(song.artist)
+        self.artist_ids.append(artist_id)
+        self.titles.append(song.title)
+        self.durations.append(NO_DURATION if song.duration is None else song.duration)
+        self.video_ids.append(song.video_id)
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def __getitem__(self, index: int) -> Song:
+        duration = self.durations[index]
+        return Song(self.artists[self.artist_ids[index]], self.titles[index],
+                    None if duration == NO_DURATION else duration, self.video_ids[index])
+
+    def __iter__(self):
+        for index in range(len(self.titles)):
+            yield self[index]
 
 
 class YoutubeMusic:
-    def __init__(self, oauth_json: str = None):
+    def __init__(self, oauth_json: str = None, session: requests.Session = None):
+        self.session = session or build_session()
         self.playlist_id = ""
         self.playlist = {}
-        self.songs = []
+        self.tracks = []
+        self.continuation = None
+        self.songs = None
+        self.streamed = False
         self.yt_logger = setup_logger(__name__)
-        self.ytmusic = YTMusic(oauth_json)
+        self.ytmusic = YTMusic(oauth_json, requests_session=self.session)
+
+    def clone(self) -> 'YoutubeMusic':
+        # Shares the authenticated YTMusic client and session, with its own playlist state
+        clone = copy.copy(self)
+        clone.playlist_id = ""
+        clone.playlist = {}
+        clone.tracks = []
+        clone.continuation = None
+        clone.songs = None
+        clone.streamed = False
+        return clone
 
-    def __fetch_playlist(self) -> dict:
-        result = self.ytmusic.get_playlist(self.playlist_id, limit=None)
+    def __fetch_playlist(self, limit: int = None) -> dict:
+        result = self.ytmusic.get_playlist(self.playlist_id, limit=limit)
         return result
+
+    def __browse_playlist(self) -> dict:
+        # Only the header and the first page of tracks, the rest is fetched by continuation.
+        # Mirrors YTMusic.get_playlist (ytmusicapi is pinned) for non-audio playlists.
+        browse_id = self.playlist_id if self.playlist_id.startswith("VL") else "VL" + self.playlist_id
+        response = self.ytmusic._send_request("browse", {"browseId": browse_id})
+        header_data = nav(response, [*TWO_COLUMN_RENDERER, *TAB_CONTENT, *SECTION_LIST_ITEM])
+        if EDITABLE_PLAYLIST_DETAIL_HEADER[0] in header_data:
+            header = nav(header_data, [*EDITABLE_PLAYLIST_DETAIL_HEADER, *HEADER, *RESPONSIVE_HEADER])
+        else:
+            header = nav(header_data, RESPONSIVE_HEADER)
+        playlist = parse_playlist_header_meta(header)
+
+        section_list = nav(response, [*TWO_COLUMN_RENDERER, "secondaryContents", *SECTION])
+        contents = nav(section_list, [*CONTENT, "musicPlaylistShelfRenderer"]).get("contents", [])
+        playlist["tracks"] = parse_playlist_items(contents)
+        self.continuation = get_continuation_token(contents) if contents else None
+        return playlist
+
+    def __fetch_continuation(self) -> list:
+        response = self.ytmusic._send_request("browse", {"continuation": self.continuation})
+        items = nav(response, CONTINUATION_ITEMS, True)
+        if not items:
+            self.continuation = None
+            return []
+        self.continuation = get_continuation_token(items)
+        return parse_playlist_items(items)
     
-    def set_playlist_id(self, playlist_id: str):
+    def set_playlist_id(self, playlist_id: str, limit: int = None, stream: bool = False):
         self.playlist_id = playlist_id
-        self.playlist = self.__fetch_playlist()
-        self.songs = []
-
-    def get_songs_from_playlist(self, limit: int = None):
-        if limit:
-            tracks = self.playlist["tracks"][:limit]
+        self.continuation = None
+        if stream and not playlist_id.removeprefix("VL").startswith("OLA"):
+            playlist = self.__browse_playlist()
         else:
-            tracks = self.playlist["tracks"]
-        for track in tracks:
-            yt_title = track["title"]
-            yt_artist = track["artists"][0]["name"]
-            song = clean_song_info(Song(yt_artist, yt_title))
-            self.songs.append(song)
+            playlist = self.__fetch_playlist(limit)
+        # Only the header is kept, the raw tracks (with thumbnails, albums and feedback tokens)
+        # are let go of one by one while they are iterated
+        self.tracks = playlist.pop("tracks", None) or []
+        self.playlist = playlist
+        self.songs = None
+        self.streamed = False
+
+    def iter_tracks_from_playlist(self, limit: int = None):
+        # Yields the raw tracks page by page and stops fetching once `limit` tracks were yielded.
+        # The tracks can be iterated once per set_playlist_id.
+        count = 0
+        tracks, self.tracks = self.tracks, []
+        self.streamed = True
+        while True:
+            tracks.reverse()
+            while tracks:
+                if limit and count >= limit:
+                    return
+                yield tracks.pop()
+                count += 1
+            if not self.continuation or (limit and count >= limit):
+                return
+            tracks = self.__fetch_continuation()
+            if not tracks:
+                return
+            self.yt_logger.debug("Got %d more tracks from Youtube Playlist", len(tracks))
+
+    def peek_tracks(self) -> list:
+        # The tracks fetched but not iterated yet, when streaming only the first page
+        return self.tracks
+
+    def iter_songs_from_playlist(self, limit: int = None):
+        if self.songs is not None:
+            yield from islice(self.songs, limit)
+            return
+        for track in self.iter_tracks_from_playlist(limit):
+            yield track_to_song(track)
+
+    def get_songs_from_playlist(self, limit: int = None) -> SongStore:
+        # Built once per playlist, later calls return the same store
+        if self.songs is None:
+            if self.streamed:
+                raise RuntimeError("The playlist tracks were already streamed, call set_playlist_id again to store them")
+            self.songs = SongStore(self.iter_songs_from_playlist(limit))
         return self.songs
 
     def get_playlist_title(self):       
         return self.playlist["title"]
     
+    def get_playlist_track_count(self) -> Union[int, None]:
+        return self.playlist.get("trackCount")
+
+    def get_playlist_thumbnails(self) -> list:
+        return self.playlist.get("thumbnails") or []
+
     def get_playlist_thumbnail(self):
-        for thumbnails in reversed(self.playlist["thumbnails"]):
-            res = requests.head(thumbnails["url"])
-            if int(res.headers['content-length']) < 200*1024:
-                return thumbnails["url"]
-        self.yt_logger("No Thumbnail found which can be used as Playlist Cover")
+        # Largest thumbnail that fits the Spotify cover limit as it is
+        for url, _, length in probe_thumbnails(self.session, self.get_playlist_thumbnails()):
+            if length is not None and length <= MAX_COVER_BYTES:
+                return url
+        self.yt_logger.warning("No Thumbnail found which can be used as Playlist Cover")
 
 
 if __name__ == "__main__":
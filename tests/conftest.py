@@ -0,0 +1,23 @@
+import pytest
+import spotipy
+from fakes import FakeSpotifyServer
+from ytm2spt import spotify
+
+
+@pytest.fixture
+def spotify_server():
+    with FakeSpotifyServer() as server:
+        yield server
+
+
+@pytest.fixture
+def sp(spotify_server, monkeypatch):
+    # A ytm2spt Spotify client that talks to the fake server
+    for name in ("SPOTIFY_USER_ID", "SPOTIFY_CLIENT_ID", "SPOTIFY_CLIENT_SECRET", "SPOTIFY_REDIRECT_URI"):
+        monkeypatch.setenv(name, "test")
+    monkeypatch.setattr(spotify, "SpotifyOAuth", lambda **kwargs: None)
+    client = spotify.Spotify()
+    client.spotify = spotipy.Spotify(auth="test", requests_session=client.session)
+    client.spotify.prefix = f"{spotify_server.url}/v1/"
+    client.set_playlist_id("test")
+    return client
@@ -0,0 +1,96 @@
+import threading
+import pytest
+from ytm2spt import shard
+from ytm2spt.utils import Match
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = shard.JobQueue(str(tmp_path / "queue.sqlite"))
+    queue.reset([[["a", "Artist", "A", None, None]], [["b", "Artist", "B", None, None]]], {"youtube_id": "PLx"})
+    yield queue
+    queue.close()
+
+
+def age_claim(queue: shard.JobQueue, chunk_id: int, seconds: float):
+    queue._db.execute("UPDATE chunks SET claimed = claimed - ? WHERE id = ?", (seconds, chunk_id))
+
+
+def test_claims_are_unique_and_in_order(queue):
+    assert queue.claim("w1")[0] == 0
+    assert queue.claim("w2")[0] == 1
+    assert queue.claim("w3") is None
+    assert queue.counts() == {"claimed": 2}
+
+
+def test_concurrent_claims_never_share_a_chunk(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    setup = shard.JobQueue(path)
+    setup.reset([[[str(i), "Artist", str(i), None, None]] for i in range(100)], {})
+    setup.close()
+    claimed = []
+
+    def work(worker: str):
+        queue = shard.JobQueue(path)
+        while (job := queue.claim(worker)) is not None:
+            claimed.append(job[0])
+        queue.close()
+
+    threads = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == list(range(100))
+
+
+def test_release_requeues_until_max_attempts(queue):
+    for _ in range(shard.MAX_ATTEMPTS - 1):
+        chunk_id, _ = queue.claim("w1")
+        queue.release(chunk_id, "boom", "w1")
+        assert queue.counts()["pending"] == 2
+    chunk_id, _ = queue.claim("w1")
+    queue.release(chunk_id, "boom", "w1")
+    assert queue.counts() == {"failed": 1, "pending": 1}
+    assert queue.results()[2][0] == "chunk 0: boom"
+
+
+def test_stale_claim_is_handed_to_another_worker(queue):
+    chunk_id, _ = queue.claim("w1")
+    age_claim(queue, chunk_id, shard.CLAIM_TIMEOUT + 1)
+    assert queue.claim("w2")[0] == chunk_id
+    assert not queue.heartbeat(chunk_id, "w1")
+    # The first worker's late result and errors are dropped
+    assert not queue.complete(chunk_id, [Match("spotify:track:w1", 90.0)], 1, "w1")
+    queue.release(chunk_id, "late", "w1")
+    assert queue.complete(chunk_id, [Match("spotify:track:w2", 90.0)], 1, "w2")
+    assert queue.results()[0]["a"].uri == "spotify:track:w2"
+
+
+def test_heartbeat_keeps_the_claim(queue):
+    chunk_id, _ = queue.claim("w1")
+    age_claim(queue, chunk_id, shard.CLAIM_TIMEOUT + 1)
+    assert queue.heartbeat(chunk_id, "w1")
+    assert queue.claim("w2")[0] != chunk_id
+
+
+def test_claim_timing_out_too_often_fails(queue):
+    for attempt in range(shard.MAX_ATTEMPTS):
+        chunk_id, _ = queue.claim(f"w{attempt}")
+        assert chunk_id == 0
+        age_claim(queue, chunk_id, shard.CLAIM_TIMEOUT + 1)
+    assert queue.claim("w9")[0] == 1
+    assert queue.counts() == {"claimed": 1, "failed": 1}
+    assert queue.results()[2][0] == "chunk 0: Claim timed out"
+
+
+def test_requeue_keeps_done_chunks(queue):
+    chunk_id, _ = queue.claim("w1")
+    queue.complete(chunk_id, [Match("spotify:track:a", 90.0)], 1, "w1")
+    chunk_id, _ = queue.claim("w2")
+    queue.requeue(stale_after=60)
+    assert queue.counts() == {"claimed": 1, "done": 1}
+    age_claim(queue, chunk_id, 61)
+    queue.requeue(stale_after=60)
+    assert queue.counts() == {"done": 1, "pending": 1}
+    assert queue.results()[0]["a"].uri == "spotify:track:a"
@@ -0,0 +1,103 @@
+import json
+import pytest
+from ytm2spt.journal import Journal
+from ytm2spt.utils import Candidate, Match
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = Journal.for_transfer("PLx", "spotify-id", directory=str(tmp_path))
+    journal.open()
+    yield journal
+    journal.close()
+
+
+def reload(journal: Journal) -> Journal:
+    # What a resumed run reads, the writing journal is left as it was when the process died
+    loaded = Journal(journal.path)
+    assert loaded.load()
+    return loaded
+
+
+def test_matches_and_chunks_are_loaded(journal):
+    journal.record_start("spotify-id")
+    journal.record_emptied()
+    journal.record_match("artist - a", Match("spotify:track:a", 91.5, (Candidate("spotify:track:a", "A", "Artist", 91.5),)))
+    journal.record_match("artist - b", Match(None, 0.0))
+    journal.record_chunk(100, 99)
+    loaded = reload(journal)
+    assert loaded.spotify_id == "spotify-id"
+    assert loaded.emptied
+    assert loaded.matches["artist - a"] == Match("spotify:track:a", 91.5, (Candidate("spotify:track:a", "A", "Artist", 91.5),))
+    assert loaded.matches["artist - b"].uri is None
+    assert (loaded.written_end, loaded.written_tracks) == (100, 99)
+
+
+def test_truncated_last_line_is_ignored(journal):
+    journal.record_start("spotify-id")
+    journal.record_emptied()
+    journal.record_chunk(100, 100)
+    journal.close()
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"type": "chunk", "end": 200, "tracks": 200})[:20])
+    loaded = reload(journal)
+    assert loaded.emptied
+    assert (loaded.written_end, loaded.written_tracks) == (100, 100)
+
+
+def test_interrupted_before_emptying(journal):
+    journal.record_start("spotify-id")
+    for i in range(5):
+        journal.record_match(f"artist - {i}", Match(f"spotify:track:{i}", 90.0))
+    journal.close()
+    loaded = reload(journal)
+    # The playlist still has its old songs, a resumed run empties it again
+    assert not loaded.emptied
+    assert loaded.written_end == 0
+    assert len(loaded.matches) == 5
+
+
+def test_interrupted_after_emptying(journal):
+    journal.record_start("spotify-id")
+    journal.record_emptied()
+    loaded = reload(journal)
+    assert loaded.emptied
+    assert loaded.resume_offset(0, 500) == 0
+
+
+def test_buffered_matches_are_written_with_the_next_chunk(journal):
+    journal.record_start("spotify-id")
+    journal.record_emptied()
+    journal.record_match("artist - a", Match("spotify:track:a", 90.0))
+    assert "artist - a" not in reload(journal).matches
+    journal.record_chunk(1, 1)
+    assert "artist - a" in reload(journal).matches
+
+
+def test_emptying_again_forgets_written_chunks(journal):
+    journal.record_start("spotify-id")
+    journal.record_emptied()
+    journal.record_chunk(100, 100)
+    journal.record_emptied()
+    loaded = reload(journal)
+    assert (loaded.written_end, loaded.written_tracks) == (0, 0)
+
+
+@pytest.mark.parametrize("playlist_tracks, offset", [
+    (None, 100),  # Unknown track count, trust the journal
+    (98, 100),  # Fewer tracks than recorded, e.g. unavailable songs Spotify dropped
+    (100, 100),
+    (150, 150),  # A chunk was added right before the process died
+    (900, 500),  # Never past the songs to write
+])
+def test_resume_offset(journal, playlist_tracks, offset):
+    journal.record_start("spotify-id")
+    journal.record_emptied()
+    journal.record_chunk(100, 100)
+    assert reload(journal).resume_offset(playlist_tracks, 500) == offset
+
+
+def test_completed_journal_is_removed(journal):
+    journal.record_start("spotify-id")
+    journal.close(completed=True)
+    assert not Journal(journal.path).load()
@@ -0,0 +1,98 @@
+import json
+import re
+import pytest
+from ytm2spt.match_manifest import read_match_manifest, track_uri, write_match_manifest
+from ytm2spt.transfer import TransferItem
+from ytm2spt.utils import Candidate, Match
+from ytm2spt.youtube import Song
+
+ITEMS = [
+    TransferItem(1, Song("Artist", "A, with a comma", 201, "vid-a"),
+                 Match("spotify:track:a", 95.0, (Candidate("spotify:track:a", "A", "Artist", 95.0),
+                                                 Candidate("spotify:track:b", "A (Live)", "Artist", 80.0)))),
+    TransferItem(2, Song("Other", "B", None, None), Match(None, 0.0)),
+]
+
+
+def write_lines(path, rows: list):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows), encoding="utf-8")
+
+
+@pytest.mark.parametrize("name", ["matches.jsonl", "matches.csv"])
+def test_written_manifest_reads_back(tmp_path, name):
+    path = str(tmp_path / name)
+    write_match_manifest(path, ITEMS)
+    assert read_match_manifest(path) == ITEMS
+
+
+def test_csv_edits_are_read(tmp_path):
+    path = tmp_path / "matches.csv"
+    path.write_text(
+        "position,video_id,artist,title,duration,uri,confidence,candidates\n"
+        "1,vid-a,Artist,A,201,https://open.spotify.com/track/abc?si=xyz,95.0,[]\n"
+        "2,,Other,B,,,0,\n",
+        encoding="utf-8")
+    items = read_match_manifest(str(path))
+    assert [item.match.uri for item in items] == ["spotify:track:abc", None]
+    assert items[0].song == Song("Artist", "A", 201, "vid-a")
+    assert items[1].song == Song("Other", "B", None, None)
+
+
+def test_rows_are_read_in_file_order(tmp_path):
+    path = tmp_path / "matches.jsonl"
+    write_lines(path, [{"position": 2, "artist": "Other", "title": "B", "uri": "spotify:track:b"},
+                       {"position": 1, "artist": "Artist", "title": "A", "uri": "spotify:track:a"}])
+    assert [item.match.uri for item in read_match_manifest(str(path))] == ["spotify:track:b", "spotify:track:a"]
+
+
+def test_blank_lines_are_skipped(tmp_path):
+    path = tmp_path / "matches.jsonl"
+    path.write_text('\n{"artist": "Artist", "title": "A", "uri": "spotify:track:a"}\n\n', encoding="utf-8")
+    items = read_match_manifest(str(path))
+    assert len(items) == 1
+    assert items[0].position == 1
+
+
+@pytest.mark.parametrize("value, uri", [
+    ("spotify:track:abc", "spotify:track:abc"),
+    ("https://open.spotify.com/track/abc", "spotify:track:abc"),
+    ("https://open.spotify.com/track/abc?si=xyz", "spotify:track:abc"),
+    ("https://open.spotify.com/intl-de/track/abc", "spotify:track:abc"),
+    ("  spotify:track:abc  ", "spotify:track:abc"),
+    ("", None),
+    (None, None),
+])
+def test_track_uri(value, uri):
+    assert track_uri(value) == uri
+
+
+def test_empty_uri_rejects_the_match(tmp_path):
+    path = tmp_path / "matches.jsonl"
+    write_lines(path, [{"artist": "Artist", "title": "A", "uri": "", "confidence": 95.0}])
+    match = read_match_manifest(str(path))[0].match
+    assert match.uri is None
+    assert match.confidence == 95.0
+
+
+@pytest.mark.parametrize("line, error", [
+    ('{"artist": "Artist", "title": "A", "uri": "https://open.spotify.com/album/abc"}', "Not a Spotify track"),
+    ('{"artist": "Artist", "title": "A", "uri": "spotify:track:a", "duration": "long"}', "invalid literal"),
+    ('{"artist": "Artist", "title": "A"}', "no uri"),
+    ('{"artist": "Artist", "title": "A", "uri": "spotify:track:a"', "Expecting"),
+])
+def test_invalid_rows_are_rejected_with_their_line(tmp_path, line, error):
+    path = tmp_path / "matches.jsonl"
+    path.write_text('{"artist": "Artist", "title": "Ok", "uri": "spotify:track:ok"}\n' + line + "\n", encoding="utf-8")
+    with pytest.raises(ValueError, match=f"Line 2 of {re.escape(str(path))}: .*{error}"):
+        read_match_manifest(str(path))
+
+
+def test_invalid_csv_row_is_rejected_with_its_line(tmp_path):
+    path = tmp_path / "matches.csv"
+    path.write_text(
+        "position,video_id,artist,title,duration,uri,confidence,candidates\n"
+        "1,vid-a,Artist,A,201,spotify:track:a,95.0,[]\n"
+        "2,vid-b,Artist,B,,spotify:album:b,90.0,[]\n",
+        encoding="utf-8")
+    with pytest.raises(ValueError, match="Line 3 of .*: Not a Spotify track: spotify:album:b"):
+        read_match_manifest(str(path))
@@ -0,0 +1,127 @@
+import pytest
+from ytm2spt import rate_limit
+from ytm2spt.rate_limit import RateLimiter, TokenBucket
+
+API = "https://api.spotify.com/v1"
+
+
+class FakeClock:
+    # Stands in for the time module, sleeping moves the clock forward. Like a real sleep it
+    # takes a moment however short the wait, rounding could leave a token just short otherwise.
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        seconds = max(seconds, 1e-6)
+        self.now += seconds
+        self.slept += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+def send(bucket: TokenBucket, clock: FakeClock, requests: int, interval: float):
+    for _ in range(requests):
+        bucket.acquire()
+        bucket.on_success()
+        clock.now += interval
+
+
+def test_throttling_lowers_the_rate_once_per_interval(clock):
+    bucket = TokenBucket(10.0)
+    bucket.on_throttled(None)
+    assert bucket.rate == pytest.approx(10.0 * rate_limit.DECREASE)
+    # More 429s of requests that were already in flight
+    bucket.on_throttled(None)
+    assert bucket.rate == pytest.approx(10.0 * rate_limit.DECREASE)
+    clock.now += rate_limit.DECREASE_INTERVAL
+    bucket.on_throttled(None)
+    assert bucket.rate == pytest.approx(10.0 * rate_limit.DECREASE ** 2)
+
+
+def test_throttling_never_goes_below_the_min_rate(clock):
+    bucket = TokenBucket(rate_limit.MIN_RATE)
+    bucket.on_throttled(None)
+    assert bucket.rate == rate_limit.MIN_RATE
+
+
+def test_unpaced_bucket_starts_from_the_rate_it_sent_at(clock):
+    bucket = TokenBucket()
+    send(bucket, clock, 21, 0.05)
+    assert bucket.rate is None
+    bucket.on_throttled(None)
+    assert bucket.rate == pytest.approx(20.0 * rate_limit.DECREASE)
+
+
+def test_rate_grows_step_by_step_up_to_the_headroom(clock):
+    bucket = TokenBucket(2.0)
+    rates = []
+    # Requests are only sent 2 per second, the rate doesn't grow past twice that
+    for _ in range(20):
+        send(bucket, clock, 1, 0.5)
+        rates.append(bucket.rate)
+    assert rates[0] == pytest.approx(2.0 + rate_limit.INCREASE / 2.0)
+    assert rates[1] == pytest.approx(rates[0] + rate_limit.INCREASE / rates[0])
+    assert rates == sorted(rates)
+    assert rates[-1] == pytest.approx(2.0 * rate_limit.MAX_HEADROOM)
+    assert clock.slept == 0
+
+
+def test_acquire_waits_out_retry_after(clock):
+    bucket = TokenBucket(100.0)
+    bucket.on_throttled(3.0)
+    bucket.acquire()
+    # Then one token at the lowered rate
+    assert clock.slept == pytest.approx(3.0 + 1 / (100.0 * rate_limit.DECREASE))
+    assert bucket.stats()["waited_seconds"] == pytest.approx(clock.slept, abs=1e-3)
+
+
+def test_retry_after_zero_neither_waits_nor_slows_down(clock):
+    bucket = TokenBucket(10.0)
+    bucket.on_throttled(0)
+    bucket.acquire()
+    assert clock.slept == 0
+    assert bucket.rate == 10.0
+    assert bucket.throttled == 1
+
+
+def test_requests_are_paced_at_the_rate(clock):
+    bucket = TokenBucket(4.0)
+    for _ in range(9):
+        bucket.acquire()
+    # The first one right away, then one every quarter second
+    assert clock.slept == pytest.approx(2.0)
+
+
+@pytest.mark.parametrize("method, url, name", [
+    ("GET", f"{API}/search?q=a&type=track", "search"),
+    ("POST", f"{API}/playlists/p/tracks", "write"),
+    ("DELETE", f"{API}/playlists/p/tracks", "write"),
+    ("GET", f"{API}/playlists/p/tracks", "read"),
+    ("POST", "https://music.youtube.com/youtubei/v1/browse", "youtube"),
+    ("POST", "https://accounts.spotify.com/api/token", None),
+    ("GET", "https://i.ytimg.com/vi/x/hqdefault.jpg", None),
+])
+def test_bucket_name(method, url, name):
+    assert rate_limit.bucket_name(method, url) == name
+
+
+def test_search_and_write_are_limited_separately(clock):
+    limiter = RateLimiter({"search": 10.0, "write": 10.0})
+    search = limiter.bucket("GET", f"{API}/search?q=a")
+    write = limiter.bucket("POST", f"{API}/playlists/p/tracks")
+    assert search is not write
+    search.on_throttled(5.0)
+    write.acquire()
+    assert clock.slept == 0
+    assert write.rate == 10.0
+    assert limiter.stats()["search"]["throttled"] == 1
+    assert limiter.stats()["write"]["throttled"] == 0
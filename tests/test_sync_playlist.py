@@ -0,0 +1,70 @@
+import random
+import pytest
+
+
+def track_uris(count: int, prefix: str = "t") -> list:
+    return [f"spotify:track:{prefix}{i}" for i in range(count)]
+
+
+def edit(rng: random.Random, uris: list) -> list:
+    # A few removes, adds, duplicates and moves, like a playlist edited between two syncs
+    target = list(uris)
+    for _ in range(rng.randint(0, 3)):
+        if target:
+            del target[rng.randrange(len(target))]
+    for i in range(rng.randint(0, 3)):
+        target.insert(rng.randint(0, len(target)), f"spotify:track:new{i}")
+    if target and rng.random() < 0.3:
+        target.insert(rng.randint(0, len(target)), rng.choice(target))
+    for _ in range(rng.randint(0, 2)):
+        if target:
+            start = rng.randrange(len(target))
+            moved = target[start:start + rng.randint(1, 5)]
+            del target[start:start + len(moved)]
+            position = rng.randint(0, len(target))
+            target[position:position] = moved
+    return target
+
+
+@pytest.mark.parametrize("seed", range(12))
+def test_sync_reaches_target_order(sp, spotify_server, seed):
+    rng = random.Random(seed)
+    current = track_uris(rng.randint(1000, 2000))
+    target = edit(rng, current)
+    spotify_server.playlists["test"] = {"items": list(current), "snapshot": 0}
+
+    stats = sp.sync_playlist(target)
+
+    assert stats is not None
+    assert spotify_server.playlists["test"]["items"] == target
+
+
+def test_sync_moves_contiguous_run_in_one_request(sp, spotify_server):
+    current = track_uris(300)
+    target = current[:50] + current[250:] + current[50:250]
+    spotify_server.playlists["test"] = {"items": list(current), "snapshot": 0}
+
+    stats = sp.sync_playlist(target)
+
+    assert stats == {"removed": 0, "added": 0, "moved": 50}
+    assert spotify_server.calls["playlist_put"] == 1
+    assert spotify_server.playlists["test"]["items"] == target
+
+
+def test_sync_returns_none_when_replace_is_cheaper(sp, spotify_server):
+    current = track_uris(500)
+    target = list(current)
+    random.Random(1).shuffle(target)
+    spotify_server.playlists["test"] = {"items": list(current), "snapshot": 0}
+
+    assert sp.sync_playlist(target) is None
+    assert spotify_server.playlists["test"]["items"] == current
+    assert spotify_server.calls["playlist_put"] == spotify_server.calls["playlist_post"] == 0
+
+
+def test_sync_unchanged_playlist_writes_nothing(sp, spotify_server):
+    current = track_uris(120)
+    spotify_server.playlists["test"] = {"items": list(current), "snapshot": 0}
+
+    assert sp.sync_playlist(current) == {"removed": 0, "added": 0, "moved": 0}
+    assert spotify_server.calls["playlist_put"] == spotify_server.calls["playlist_post"] == 0